@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+#
+# Benchmark of the gathering subsystem on synthetic cohorts.
+#
+# For each cohort size, a fake geomosaic working directory is generated with
+# the outputs of every gathered package (kraken2 reports, kaiju rank tables,
+# emapper annotations, reCOGnizer tables, hmmsearch coverage tables, GTDB-Tk
+# summaries, coverm tables, DRAM distillation and mifaser), then each
+# function of gm_gather.gather_functions() is run in a fresh process,
+# recording wall time, CPU time and peak RSS.
+#
+#   python benchmarks/gather_benchmark.py --samples 10 100 1000 -o results.tsv
+#   python benchmarks/gather_benchmark.py --samples 100 --baseline results.tsv
+#
+
+import argparse
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from queue import Empty
+import pandas as pd
+import yaml
+
+
+RANKS = ["domain", "phylum", "class", "order", "family", "genus", "species"]
+KRAKEN_CODES = ["D", "P", "C", "O", "F", "G", "S"]
+
+HMM_COLUMNS = ["HMM_model", "orf_id", "HMM_length", "hmm_start", "hmm_end", "identical_match", "conserved_match", "perc_identical", "perc_conserved", "bitscore", "indipendent_evalue", "conditional_evalue", "dels", "sequence_match", "contig"]
+RECOGNIZER_COLUMNS = ["qseqid", "DB ID", "Protein description", "DB description", "EC number", "CDD ID", "taxonomic_range_name", "taxonomic_range", "Superfamilies", "Sites", "Motifs", "pident", "length", "mismatch", "gapopen", "qstart", "qend", "sstart", "send", "evalue", "bitscore", "General functional category", "Functional category", "KO"]
+EMAPPER_COLUMNS = ["#query", "seed_ortholog", "evalue", "score", "eggNOG_OGs", "max_annot_lvl", "COG_category", "Description", "Preferred_name", "GOs", "EC", "KEGG_ko", "KEGG_Pathway", "KEGG_Module", "KEGG_Reaction", "KEGG_rclass", "BRITE", "KEGG_TC", "CAZy", "BiGG_Reaction", "PFAMs"]
+
+ASSEMBLY_HMM_FOLDER = "hmm_out"
+MAGS_HMM_FOLDER = "mags_hmm_out"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time and memory profile of the geomosaic gathering on synthetic cohorts")
+    parser.add_argument("--samples", nargs="+", type=int, default=[10, 100, 1000], help="Cohort sizes (number of samples). Default: 10 100 1000")
+    parser.add_argument("--features", type=int, default=200, help="Number of distinct features (KOs, ECs, COGs, HMMs, taxa) of the cohort. Default: 200")
+    parser.add_argument("--mags", type=int, default=4, help="Maximum number of MAGs for each sample. Default: 4")
+    parser.add_argument("--packages", nargs="+", default=None, help="Packages to profile. Default: all the gathered packages")
+    parser.add_argument("--io_workers", type=int, default=1, help="Value of 'geomosaic gather --io_workers'. Default: 1")
+    parser.add_argument("--workdir", type=str, default=None, help="Folder for the synthetic cohorts, kept after the benchmark. Default: a temporary folder, removed at the end")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("-o", "--output", type=str, default=None, help="Write the measures to this TSV file")
+    parser.add_argument("--baseline", type=str, default=None, help="TSV file of a previous run, to report the ratios of time and memory against it")
+    parser.add_argument("--timeout", type=float, default=None, help="Seconds after which the gathering of a package is stopped and reported as failed. Default: no limit")
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+    from geomosaic.gm_gather import gather_functions
+
+    packages = args.packages if args.packages is not None else list(gather_functions())
+    workdir = args.workdir if args.workdir is not None else tempfile.mkdtemp(prefix="gm_benchmark_")
+
+    results = []
+    try:
+        for n in args.samples:
+            cohort = os.path.join(workdir, f"cohort_{n}")
+            if not os.path.isdir(cohort):
+                print(f"Generating a synthetic cohort of {n} samples in {cohort}...", file=sys.stderr)
+                make_cohort(cohort, n, args.features, args.mags, args.seed)
+
+            for pckg in packages:
+                res = profile_package(pckg, cohort, n, args.io_workers, args.timeout)
+                results.append(res)
+                if "error" in res:
+                    print(f"{pckg}\t{n} samples\tFAILED: {res['error']}", file=sys.stderr)
+                else:
+                    print(f"{pckg}\t{n} samples\t{res['wall_s']:.2f} s\t{res['peak_rss_mb']:.0f} MB", file=sys.stderr)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    df = pd.DataFrame(results)
+
+    if args.baseline is not None:
+        base = pd.read_csv(args.baseline, sep="\t")[["package", "samples", "wall_s", "peak_rss_mb"]]
+        df = df.merge(base, on=["package", "samples"], how="left", suffixes=("", "_baseline"))
+        df["wall_ratio"] = (df["wall_s"] / df["wall_s_baseline"]).round(2)
+        df["rss_ratio"] = (df["peak_rss_mb"] / df["peak_rss_mb_baseline"]).round(2)
+
+    if args.output is not None:
+        df.to_csv(args.output, sep="\t", index=False)
+
+    print(df.to_string(index=False))
+
+    if "error" in df.columns and df["error"].notna().any():
+        sys.exit(1)
+
+
+def profile_package(pckg, cohort, n_samples, io_workers, timeout=None):
+    # a fresh interpreter for each package, so that the peak RSS is its own
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+
+    proc = ctx.Process(target=run_package, args=(pckg, cohort, io_workers, queue))
+    proc.start()
+    start = time.perf_counter()
+
+    res = None
+    while res is None:
+        try:
+            res = queue.get(timeout=1)
+        except Empty:
+            if not proc.is_alive():
+                # the result may have been queued just before the process exited
+                try:
+                    res = queue.get(timeout=1)
+                except Empty:
+                    res = {"error": f"the gathering process died with exit code {proc.exitcode}"}
+            elif timeout is not None and time.perf_counter() - start > timeout:
+                proc.terminate()
+                res = {"error": f"stopped after {timeout:g} s"}
+
+    proc.join()
+
+    if "error" in res:
+        # a failed measurement, reported in the table
+        return {"package": pckg, "samples": n_samples, "wall_s": None, "cpu_s": None, "peak_rss_mb": None,
+                "rss_before_mb": None, "output_mb": None, "error": res["error"]}
+
+    return res
+
+
+def run_package(pckg, cohort, io_workers, queue):
+    try:
+        from geomosaic.gm_gather import gather_functions, gather_dependencies
+
+        gathering = gather_functions()
+        config_file = os.path.join(cohort, "config.yaml")
+        output_folder = tempfile.mkdtemp(prefix=f"gather_{pckg}_", dir=cohort)
+
+        additional_info = {
+            "assembly_hmmsearch_output_folder": ASSEMBLY_HMM_FOLDER,
+            "mags_hmmsearch_output_folder": MAGS_HMM_FOLDER,
+            "io_workers": io_workers,
+            "io_memory": None,
+            "gather_cache": None,
+            "output_format": "tsv",
+            "sparse_output": False,
+        }
+
+        # gathered tables read by the package are not part of its measure
+        for dep in gather_dependencies().get(pckg, []):
+            gathering[dep](config_file, cohort, output_folder, additional_info)
+
+        rss_before = peak_rss_mb()
+        cpu_before = cpu_seconds()
+        start = time.perf_counter()
+
+        gathering[pckg](config_file, cohort, output_folder, additional_info)
+
+        wall = time.perf_counter() - start
+        cpu = cpu_seconds() - cpu_before
+
+        with open(config_file) as file:
+            n_samples = len(yaml.load(file, Loader=yaml.FullLoader)["SAMPLES"])
+
+        queue.put({
+            "package": pckg,
+            "samples": n_samples,
+            "wall_s": round(wall, 3),
+            "cpu_s": round(cpu, 3),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "rss_before_mb": round(rss_before, 1),
+            "output_mb": round(folder_size(output_folder) / 2**20, 2),
+        })
+
+        shutil.rmtree(output_folder, ignore_errors=True)
+    except Exception as e:
+        queue.put({"error": repr(e)})
+
+
+def peak_rss_mb():
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return maxrss / 2**20 if sys.platform == "darwin" else maxrss / 2**10
+
+
+def cpu_seconds():
+    total = 0
+    for who in [resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN]:
+        usage = resource.getrusage(who)
+        total += usage.ru_utime + usage.ru_stime
+
+    return total
+
+
+def folder_size(folder):
+    return sum(os.path.getsize(os.path.join(root, fn)) for root, _, files in os.walk(folder) for fn in files)
+
+
+def make_cohort(wdir, n_samples, n_features, max_mags, seed):
+    rnd = random.Random(seed)
+    samples = [f"S{i}" for i in range(1, n_samples + 1)]
+
+    os.makedirs(wdir, exist_ok=True)
+    with open(os.path.join(wdir, "config.yaml"), "w") as f:
+        yaml.dump({"SAMPLES": samples}, f)
+    with open(os.path.join(wdir, "gmsetup.yaml"), "w") as f:
+        yaml.dump({"SAMPLES": samples, "GEOMOSAIC_WDIR": wdir}, f)
+
+    pools = {
+        "KO": [f"K{i:05d}" for i in range(n_features)],
+        "EC": [f"{i % 7 + 1}.{i % 5}.{i % 3}.{i}" for i in range(n_features)],
+        "HMM": [f"HMM{i}" for i in range(max(2, n_features // 4))],
+        "taxa": {r: [f"{r}_{i}" for i in range(max(2, n_features // (8 - k)))] for k, r in enumerate(RANKS)},
+    }
+
+    for s in samples:
+        sample_dir = os.path.join(wdir, s)
+        mags = [f"mag_{i}" for i in range(1, rnd.randint(1, max_mags) + 1)]
+
+        write_mifaser(rnd, sample_dir, pools, n_features)
+        write_kaiju(rnd, sample_dir, pools)
+        write_kraken2(rnd, sample_dir, pools)
+        write_emapper(rnd, sample_dir, pools, n_features)
+        write_recognizer(rnd, sample_dir, pools, n_features, mags)
+        write_hmmsearch(rnd, sample_dir, pools, n_features, s, mags)
+        write_gtdbtk(rnd, sample_dir, pools, mags)
+        write_coverm(rnd, sample_dir, s, mags)
+        write_dram(rnd, sample_dir, pools, mags)
+
+    return samples
+
+
+def write_mifaser(rnd, sample_dir, pools, n_features):
+    os.makedirs(f"{sample_dir}/mifaser", exist_ok=True)
+    with open(f"{sample_dir}/mifaser/analysis.tsv", "w") as f:
+        f.write("ec\tcount\n")
+        for ec in rnd.sample(pools["EC"], n_features // 2):
+            f.write(f"{ec}\t{rnd.randint(1, 100)}\n")
+
+
+def write_kaiju(rnd, sample_dir, pools):
+    os.makedirs(f"{sample_dir}/kaiju", exist_ok=True)
+    for r in RANKS[1:]:
+        with open(f"{sample_dir}/kaiju/{r}.tsv", "w") as f:
+            f.write("file\tpercent\treads\ttaxon_id\ttaxon_name\n")
+            for i, taxon in enumerate(rnd.sample(pools["taxa"][r], len(pools["taxa"][r]) // 2)):
+                f.write(f"kaiju.out\t{rnd.random() * 10:.6f}\t{rnd.randint(1, 1000)}\t{i}\t{taxon}\n")
+            f.write(f"kaiju.out\t{rnd.random() * 10:.6f}\t{rnd.randint(1, 1000)}\tNA\tunclassified\n")
+
+
+def write_kraken2(rnd, sample_dir, pools):
+    os.makedirs(f"{sample_dir}/kraken2", exist_ok=True)
+
+    lines = [
+        "10.00\t100\t100\tU\t0\tunclassified",
+        "90.00\t900\t0\tR\t1\troot",
+        "90.00\t900\t0\tR1\t131567\t  cellular organisms",
+    ]
+
+    taxid = 10
+    def clade(depth):
+        # ranks with sub-ranks (e.g. G1) and children, as in the real reports
+        nonlocal taxid
+        for name in rnd.sample(pools["taxa"][RANKS[depth]], min(3, rnd.randint(1, 3), len(pools["taxa"][RANKS[depth]]))):
+            taxid += 1
+            reads = rnd.randint(0, 500)
+            lines.append(f"1.00\t{reads}\t{rnd.randint(0, reads)}\t{KRAKEN_CODES[depth]}\t{taxid}\t{'  ' * (depth + 2)}{name}")
+
+            if depth < len(RANKS) - 1 and rnd.random() < 0.2:
+                taxid += 1
+                lines.append(f"0.50\t{reads}\t0\t{KRAKEN_CODES[depth]}1\t{taxid}\t{'  ' * (depth + 3)}{name} subgroup")
+
+            if depth < len(RANKS) - 1 and rnd.random() < 0.7:
+                clade(depth + 1)
+
+    clade(0)
+
+    with open(f"{sample_dir}/kraken2/kraken_report.txt", "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def write_emapper(rnd, sample_dir, pools, n_features):
+    def facet(prefix, pool):
+        if rnd.random() < 0.3:
+            return "-"
+        return ",".join(f"{prefix}{x}" for x in rnd.sample(pool, rnd.randint(1, 3)))
+
+    modules = [f"M{i:05d}" for i in range(max(3, n_features // 3))]
+    reactions = [f"R{i:05d}" for i in range(n_features)]
+    rclasses = [f"RC{i:05d}" for i in range(max(3, n_features // 2))]
+
+    os.makedirs(f"{sample_dir}/eggnog_mapper", exist_ok=True)
+    with open(f"{sample_dir}/eggnog_mapper/gm_eggnog_annot.emapper.annotations", "w") as f:
+        f.write("## Mon Jan  1 00:00:00 2024\n## emapper-2.1.12\n## command: emapper.py\n##\n")
+        f.write("\t".join(EMAPPER_COLUMNS) + "\n")
+        for i in range(n_features * 3):
+            row = [f"contig_{i}_orf_1", "1234.ABC_0001", "1.2e-50", "180.3", "COG0001@1|root", "2|Bacteria", "C", "a description, with commas", "abcD", "-", "-",
+                   facet("ko:", pools["KO"]), "-", facet("", modules), facet("", reactions), facet("", rclasses), "-", "-", "-", "-", "PF00001"]
+            f.write("\t".join(row) + "\n")
+        f.write("## 1000 queries scanned\n## Total time (seconds): 10\n## Rate: 100 q/s\n")
+
+
+def write_recognizer(rnd, sample_dir, pools, n_features, mags):
+    os.makedirs(f"{sample_dir}/recognizer", exist_ok=True)
+    write_recognizer_folder(rnd, f"{sample_dir}/recognizer", pools, n_features, n_features * 3)
+
+    for m in mags:
+        os.makedirs(f"{sample_dir}/mags_recognizer/{m}", exist_ok=True)
+        write_recognizer_folder(rnd, f"{sample_dir}/mags_recognizer/{m}", pools, n_features, n_features)
+
+
+def write_recognizer_folder(rnd, folder, pools, n_features, n_hits):
+    with open(f"{folder}/reCOGnizer_results.tsv", "w") as f:
+        f.write("\t".join(RECOGNIZER_COLUMNS) + "\n")
+        for i in range(n_hits):
+            ec = rnd.choice(["", "-", ",".join(rnd.sample(pools["EC"], rnd.randint(1, 2)))])
+            ko = rnd.choice(["", "-", ";".join(rnd.sample(pools["KO"], rnd.randint(1, 2)))])
+            row = [f"contig_{i % (n_hits // 2 + 1)}_orf_1", "CDD:1", "protein", "db description", ec, "cd00001", "Bacteria", "2", "", "", "",
+                   f"{rnd.uniform(50, 100):.1f}", "100", "1", str(rnd.randint(0, 7)), "1", "100", "1", "100", "1e-20", "80", "general", "function", ko]
+            f.write("\t".join(row) + "\n")
+
+    for kind in ["COG", "KOG"]:
+        with open(f"{folder}/{kind}_quantification.tsv", "w") as f:
+            for i in rnd.sample(range(n_features), n_features // 2):
+                f.write(f"{rnd.randint(1, 50)}\tclass {i % 3}\tsubclass {i % 5}\tdescription {i}\t{kind}{i:04d}\n")
+
+
+def write_hmmsearch(rnd, sample_dir, pools, n_features, s, mags):
+    os.makedirs(f"{sample_dir}/{ASSEMBLY_HMM_FOLDER}", exist_ok=True)
+    write_hmm_coverage(rnd, f"{sample_dir}/{ASSEMBLY_HMM_FOLDER}/HMMs_coverage_table.tsv", pools, n_features, ["mean", "trimmed_mean", "count", "tpm"], s)
+
+    for m in mags:
+        os.makedirs(f"{sample_dir}/{MAGS_HMM_FOLDER}/{m}", exist_ok=True)
+        write_hmm_coverage(rnd, f"{sample_dir}/{MAGS_HMM_FOLDER}/{m}/HMMs_coverage_table.tsv", pools, n_features // 2, ["relative_abundance", "mean", "tpm"], s)
+
+
+def write_hmm_coverage(rnd, filename, pools, n_hits, norms, s):
+    with open(filename, "w") as f:
+        f.write("\t".join(HMM_COLUMNS + norms + ["sample"]) + "\n")
+        for i in range(n_hits):
+            row = [rnd.choice(pools["HMM"]), f"contig_{i}_orf_1", "250", "1", "240", "90", "150", f"{rnd.uniform(10, 90):.3f}", f"{rnd.uniform(10, 90):.3f}",
+                   "150.2", "1e-40", "1e-41", "0", "MKV+LA", f"contig_{i}"]
+            row += [f"{rnd.uniform(0, 20):.4f}" for _ in norms]
+            f.write("\t".join(row + [s]) + "\n")
+
+
+def write_gtdbtk(rnd, sample_dir, pools, mags):
+    def classification():
+        # the lower ranks are sometimes not assigned (e.g. 'g__')
+        parts = []
+        for k, r in enumerate(RANKS):
+            name = rnd.choice(pools["taxa"][r]) if rnd.random() > 0.05 * k else ""
+            parts.append(f"{r[0]}__{name}")
+        return ";".join(parts)
+
+    os.makedirs(f"{sample_dir}/mags_gtdbtk", exist_ok=True)
+    for kind in ["bac120", "ar53"]:
+        selected = [m for m in mags if (kind == "ar53") == (int(m.split("_")[1]) % 3 == 0)]
+        if len(selected) == 0:
+            continue
+
+        with open(f"{sample_dir}/mags_gtdbtk/gtdbtk.{kind}.summary.tsv", "w") as f:
+            f.write("user_genome\tclassification\tfastani_reference\n")
+            for m in selected:
+                f.write(f"{m}\t{classification()}\tN/A\n")
+
+
+def write_coverm(rnd, sample_dir, s, mags):
+    methods = ["relative_abundance", "mean", "tpm"]
+
+    os.makedirs(f"{sample_dir}/coverm_genome", exist_ok=True)
+    with open(f"{sample_dir}/coverm_genome/list.txt", "w") as f:
+        f.write("\n".join(methods) + "\n")
+
+    for mtd in methods:
+        with open(f"{sample_dir}/coverm_genome/{mtd}.tsv", "w") as f:
+            f.write(f"Genome\t{s} {mtd}\n")
+            f.write(f"unmapped\t{rnd.uniform(0, 50):.5f}\n")
+            for m in mags:
+                f.write(f"{m}\t{rnd.uniform(0, 50):.5f}\n")
+
+
+def write_dram(rnd, sample_dir, pools, mags):
+    from geomosaic.gathering.gather_mags_dram import get_dram_cols
+
+    folder = f"{sample_dir}/mags_dram/dram_distillation"
+    os.makedirs(folder, exist_ok=True)
+
+    summary = pd.DataFrame({"gene_id": pools["KO"], "gene_description": "description", "module": "module", "sheet": "sheet", "header": "header"})
+    for m in mags:
+        summary[m] = [rnd.randint(0, 3) for _ in pools["KO"]]
+    summary.to_excel(f"{folder}/metabolism_summary.xlsx", index=False)
+
+    product = {"genome": mags}
+    for cols in get_dram_cols().values():
+        for c in cols:
+            product[c] = [rnd.choice([True, False, 0.5]) for _ in mags]
+    pd.DataFrame(product).to_csv(f"{folder}/product.tsv", sep="\t", index=False)
+
+
+if __name__ == "__main__":
+    main()
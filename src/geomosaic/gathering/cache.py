@@ -0,0 +1,242 @@
+import io
+import os
+import json
+import hashlib
+import pandas as pd
+from geomosaic.gathering.loader import load_sample_files
+from geomosaic.gathering.scan import file_stat
+
+
+# increase it whenever the per-sample parsing of a gatherer changes,
+# so that results cached by previous versions are parsed again
+CACHE_VERSION = 3
+
+
+def load_sample_results(tasks, reader, parser, additional_info, cache_name):
+    """
+    Yield (key, parser(key, reader(path))) for each task, in order.
+
+    When a gathering cache folder is available in `additional_info`, the
+    parsed result of each task is stored in it together with a manifest
+    that records size, mtime and hash of the source files. Later calls
+    parse again only the tasks whose files are new or changed, while the
+    other results are loaded from the cache. The cache is discarded when
+    CACHE_VERSION or the pandas version change or its manifest cannot be
+    read, and a cached result that cannot be loaded is parsed again. Without
+    tasks the cache is left untouched.
+    """
+    cache_folder = additional_info.get("gather_cache", None)
+
+    if cache_folder is None:
+        yield from load_sample_files(tasks, reader, additional_info, parser=parser, step=cache_name)
+        return
+
+    # nothing to gather (e.g. a sample without its result file): the cache is left as it is
+    if len(tasks) == 0:
+        return
+
+    cache_dir = os.path.join(cache_folder, cache_name)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    manifest_file = os.path.join(cache_dir, "manifest.json")
+    manifest = read_manifest(manifest_file)
+
+    stale_tasks = []
+    cached_signatures = {}
+    for key, path in tasks:
+        signature = cached_signature(manifest["samples"].get(key, None), path, cache_dir, additional_info)
+        if signature is None:
+            stale_tasks.append((key, path))
+        else:
+            cached_signatures[key] = signature
+
+    stale_keys = set(key for key, _ in stale_tasks)
+    hashing_reader = lambda path: read_hashed(path, reader, additional_info)
+    hashing_parser = lambda key, loaded: (parser(key, loaded[0]), loaded[1])
+    parsed = load_sample_files(stale_tasks, hashing_reader, additional_info, parser=hashing_parser, step=cache_name)
+
+    updated = {"version": CACHE_VERSION, "pandas": pd.__version__, "samples": {}}
+    for key, path in tasks:
+        result_file = os.path.join(cache_dir, f"{key}.pkl")
+
+        if key in stale_keys:
+            _, (result, signature) = next(parsed)
+            pd.to_pickle(result, result_file)
+        else:
+            signature = cached_signatures[key]
+            try:
+                result = pd.read_pickle(result_file)
+            except Exception:
+                # truncated or unreadable cached result: the sample is parsed again
+                _, (result, signature) = next(load_sample_files([(key, path)], hashing_reader, additional_info, parser=hashing_parser, step=cache_name))
+                pd.to_pickle(result, result_file)
+
+        updated["samples"][key] = {"files": signature, "result": os.path.basename(result_file)}
+        yield key, result
+
+    for key, entry in manifest["samples"].items():
+        if key not in updated["samples"] and os.path.isfile(os.path.join(cache_dir, entry["result"])):
+            os.remove(os.path.join(cache_dir, entry["result"]))
+
+    write_manifest(manifest_file, updated)
+
+
+def cached_signature(entry, path, cache_dir, additional_info):
+    # returns the up-to-date signature of the files if the cached result is still valid
+    if entry is None or not os.path.isfile(os.path.join(cache_dir, entry["result"])):
+        return None
+
+    current = files_signature(path, with_hash=False, additional_info=additional_info)
+    if [i["path"] for i in current] != [i["path"] for i in entry["files"]]:
+        return None
+
+    for new, old in zip(current, entry["files"]):
+        if new["size"] != old["size"]:
+            return None
+
+        new["hash"] = old["hash"]
+
+        # same size but touched file: trust the content hash
+        if new["mtime"] != old["mtime"] and file_hash(new["path"]) != old["hash"]:
+            return None
+
+    return current
+
+
+def files_signature(path, with_hash, additional_info=None):
+    paths = [path] if isinstance(path, str) else path
+
+    # the stats of an index saved by a previous gathering may be outdated (files rewritten in place)
+    project_index = additional_info.get("project_index", None) if additional_info is not None else None
+    if project_index is not None and project_index.get("saved", False):
+        additional_info = None
+
+    signature = []
+    for p in paths:
+        size, mtime = file_stat(p, additional_info)
+        signature.append({
+            "path": os.path.abspath(p),
+            "size": size,
+            "mtime": mtime,
+            "hash": file_hash(p) if with_hash else None,
+        })
+
+    return signature
+
+
+def read_hashed(path, reader, additional_info):
+    # reader(path) on files that hash the bytes read, so that the signature of the files does not read them again
+    paths = [path] if isinstance(path, str) else path
+    sources = [io.BufferedReader(HashingFile(p)) for p in paths]
+
+    try:
+        data = reader(sources[0] if isinstance(path, str) else sources)
+
+        signature = files_signature(path, with_hash=False, additional_info=additional_info)
+        for item, source in zip(signature, sources):
+            item["hash"] = source.raw.hexdigest()
+    finally:
+        for source in sources:
+            source.close()
+
+    return data, signature
+
+
+class HashingFile(io.RawIOBase):
+    """
+    Binary file that hashes the bytes read from the start of the file. Bytes
+    not read sequentially (e.g. zip archives, read from the end) are read
+    again by hexdigest.
+    """
+    def __init__(self, path):
+        self.name = path
+        self.fd = open(path, "rb", buffering=0)
+        self.digest = hashlib.sha256()
+        self.position = 0
+        self.hashed = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        n = self.fd.readinto(b)
+        if n and self.position <= self.hashed < self.position + n:
+            self.digest.update(memoryview(b)[self.hashed - self.position:n])
+            self.hashed = self.position + n
+        self.position += n or 0
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        self.position = self.fd.seek(offset, whence)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def close(self):
+        self.fd.close()
+        super().close()
+
+    def hexdigest(self):
+        with open(self.name, "rb") as fd:
+            fd.seek(self.hashed)
+            for chunk in iter(lambda: fd.read(1024*1024), b""):
+                self.digest.update(chunk)
+                self.hashed += len(chunk)
+
+        return self.digest.hexdigest()
+
+
+def source_name(source):
+    # path of a file given to a reader, either as a path or as an open file
+    return source if isinstance(source, str) else source.name
+
+
+def file_hash(path, chunk_size=1024*1024):
+    h = hashlib.sha256()
+    with open(path, "rb") as fd:
+        for chunk in iter(lambda: fd.read(chunk_size), b""):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+
+def read_manifest(manifest_file):
+    # an unreadable or malformed manifest is an empty cache: all the tasks are parsed again
+    try:
+        with open(manifest_file) as fd:
+            manifest = json.load(fd)
+
+        # pickles are not guaranteed to load across pandas versions
+        if manifest["version"] == CACHE_VERSION and manifest["pandas"] == pd.__version__ and valid_entries(manifest["samples"]):
+            return manifest
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    return {"version": CACHE_VERSION, "pandas": pd.__version__, "samples": {}}
+
+
+def valid_entries(samples):
+    if not isinstance(samples, dict):
+        return False
+
+    for entry in samples.values():
+        if not isinstance(entry, dict) or not isinstance(entry.get("result", None), str) or not isinstance(entry.get("files", None), list):
+            return False
+
+        for item in entry["files"]:
+            if not isinstance(item, dict) or any(k not in item for k in ["path", "size", "mtime", "hash"]):
+                return False
+
+    return True
+
+
+def write_manifest(manifest_file, manifest):
+    tmp_file = f"{manifest_file}.tmp"
+    with open(tmp_file, "wt") as fd:
+        json.dump(manifest, fd, indent=1)
+
+    os.replace(tmp_file, manifest_file)
@@ -0,0 +1,279 @@
+"""
+Export of the gathered tables to a local SQLite database, in long form.
+"""
+import os
+import sqlite3
+import numpy as np
+import pandas as pd
+from geomosaic.gathering.writer import GATHER_FORMATS, read_sparse_parts
+
+
+# packages with one folder of tables for each sample, with MAGs as columns
+MAG_PACKAGES = ["mags_recognizer", "mags_hmmsearch", "mags_dram"]
+
+COVERM_LEVELS = ["phylum", "class", "order", "family", "genus", "species"]
+
+# tables loaded as they are, which belong to a package
+RAW_TABLES = {
+    "hmms_search": ["hmms_search_hits"],
+    "mags_hmmsearch": ["mags_hmmsearch_hits"],
+    "mags_gtdbtk": ["mags_taxonomy"],
+    "kraken2": ["kraken2_lineage"],
+}
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS abundance (package TEXT, source TEXT, norm TEXT, sample TEXT, mag TEXT, feature TEXT, info TEXT, value REAL)",
+    "CREATE TABLE IF NOT EXISTS features (package TEXT, source TEXT, feature TEXT, info TEXT)",
+]
+
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS abundance_feature ON abundance (feature, norm, value)",
+    "CREATE INDEX IF NOT EXISTS abundance_sample ON abundance (sample, package, source)",
+    "CREATE INDEX IF NOT EXISTS features_feature ON features (feature, package)",
+]
+
+
+def export_database(db_file, output_gather_folder, packages, samples, chunksize=100000):
+    """
+    Load the gathered tables of `packages` in the SQLite database `db_file`.
+
+    Feature x sample (or MAG) tables are stored in the 'abundance' table as
+    (package, source, norm, sample, mag, feature, info, value) rows, without
+    the zeros; when a table has more key columns (e.g. COG class, subclass
+    and description) the other keys are joined in 'info', which is also
+    stored with the feature in 'features', so that the same id under two
+    classes stays apart. HMM hits, GTDB-Tk
+    taxonomy of the MAGs and kraken2 lineages are stored as they are in
+    their own tables. The tables of a package are replaced when the package
+    is loaded again.
+    """
+    con = sqlite3.connect(db_file)
+
+    try:
+        for statement in SCHEMA:
+            con.execute(statement)
+        # databases exported before the 'info' column
+        add_missing_columns(con, "abundance", ["info"])
+
+        for pckg in packages:
+            pckg_folder = os.path.join(output_gather_folder, pckg)
+            if not os.path.isdir(pckg_folder):
+                continue
+
+            clear_package(con, pckg)
+            for name, path in gathered_tables(pckg_folder):
+                load_table(con, pckg, name, path, samples, chunksize)
+
+            con.commit()
+
+        for statement in INDEXES:
+            con.execute(statement)
+        con.commit()
+    finally:
+        con.close()
+
+
+def clear_package(con, pckg):
+    con.execute("DELETE FROM abundance WHERE package = ?", (pckg,))
+    con.execute("DELETE FROM features WHERE package = ?", (pckg,))
+
+    for table in RAW_TABLES.get(pckg, []):
+        con.execute(f'DROP TABLE IF EXISTS "{table}"')
+
+
+def gathered_tables(pckg_folder):
+    extensions = set(GATHER_FORMATS.values()) | {".npz"}
+
+    tables = []
+    for root, dirs, files in os.walk(pckg_folder):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+
+        for fn in files:
+            base, ext = os.path.splitext(fn)
+            if ext not in extensions or base.endswith(".features") or base.endswith(".samples"):
+                continue
+
+            name = os.path.relpath(os.path.join(root, base), pckg_folder).replace(os.sep, "/")
+            tables.append((name, os.path.join(root, fn)))
+
+    return sorted(tables)
+
+
+def load_table(con, pckg, name, path, samples, chunksize):
+    parts = name.split("/")
+    base = parts[-1]
+
+    if base.startswith("ALL_SAMPLES_HMM") or base.startswith("ALL_MAGs_HMM"):
+        load_raw_table(con, f"{pckg}_hits", path, {}, ["sample", "HMM_model", "orf_id"], chunksize)
+    elif pckg == "mags_gtdbtk" and parts[0] == "geomosaic_samples":
+        load_raw_table(con, "mags_taxonomy", path, {"sample": base}, ["sample", "MAGs"], chunksize)
+    elif pckg == "kraken2" and base == "lineage":
+        load_raw_table(con, "kraken2_lineage", path, {}, ["NCBI_taxon_id"], chunksize)
+    elif pckg == "mags_dram" and base != "metabolism_summary":
+        load_mag_traits(con, pckg, base, parts[0], path, chunksize)
+    else:
+        source, norm = table_source(pckg, base)
+        sample = parts[0] if pckg in MAG_PACKAGES else None
+
+        if path.endswith(".npz"):
+            load_sparse_matrix(con, pckg, source, norm, sample, path)
+        else:
+            load_matrix(con, pckg, source, norm, sample, path, samples, chunksize)
+
+
+def table_source(pckg, base):
+    if pckg in ["hmms_search", "mags_hmmsearch"]:
+        return "HMM_model", base
+
+    if pckg == "coverm_genome":
+        for level in COVERM_LEVELS:
+            if base.startswith(f"{level}_"):
+                return level, base[len(level)+1:]
+
+    return base, None
+
+
+def load_matrix(con, pckg, source, norm, sample, path, samples, chunksize):
+    columns = table_header(path)
+
+    if sample is None:
+        value_cols = [c for c in columns if c in samples]
+    else:
+        value_cols = [c for c in columns if c.startswith("mag_")]
+
+    keys = [c for c in columns if c not in value_cols]
+
+    for chunk in table_chunks(path, {k: str for k in keys}, chunksize):
+        insert_features(con, pckg, source, chunk, keys)
+
+        long_df = chunk.melt(id_vars=keys, value_vars=value_cols, var_name="column", value_name="value")
+        insert_abundance(con, pckg, source, norm, sample, long_df["column"], long_df[keys[-1]], long_df["value"], feature_info(long_df, keys))
+
+
+def load_sparse_matrix(con, pckg, source, norm, sample, path):
+    features, columns, row, col, data = read_sparse_parts(path)
+    keys = list(features.columns)
+
+    insert_features(con, pckg, source, features, keys)
+
+    labels = features[keys[-1]].to_numpy(dtype=object)
+    info = feature_info(features, keys)
+    info = None if info is None else pd.Series(info.to_numpy(dtype=object)[row])
+    insert_abundance(con, pckg, source, norm, sample, pd.Series(np.array(columns, dtype=object)[col]), pd.Series(labels[row]), pd.Series(data), info)
+
+
+def load_mag_traits(con, pckg, source, sample, path, chunksize):
+    # DRAM distillation tables: one row per MAG ('genome') and one column per trait
+    for chunk in table_chunks(path, {"genome": str}, chunksize):
+        long_df = chunk.melt(id_vars=["genome"], var_name="feature", value_name="value")
+        long_df["value"] = long_df["value"].replace({"True": 1, "False": 0})
+
+        insert_abundance(con, pckg, source, None, sample, long_df["genome"], long_df["feature"], long_df["value"])
+
+
+def insert_abundance(con, pckg, source, norm, sample, columns, features, values, info=None):
+    # `columns` holds the samples, or the MAGs of `sample`
+    values = pd.to_numeric(values.astype(object).where(values.notna(), None), errors="coerce").astype(np.float64).to_numpy()
+    keep = ~np.isnan(values) & (values != 0)
+
+    columns = columns.to_numpy(dtype=object)[keep]
+    features = features.to_numpy(dtype=object)[keep]
+    info = [None] * len(features) if info is None else info.to_numpy(dtype=object)[keep].tolist()
+    values = values[keep]
+
+    if sample is None:
+        rows = zip(columns.tolist(), [None] * len(values), features.tolist(), info, values.tolist())
+    else:
+        rows = zip([sample] * len(values), columns.tolist(), features.tolist(), info, values.tolist())
+
+    con.executemany(
+        "INSERT INTO abundance (package, source, norm, sample, mag, feature, info, value) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        ((pckg, source, norm, s, m, f, i, v) for s, m, f, i, v in rows)
+    )
+
+
+def feature_info(df, keys):
+    # the key columns before the feature id (e.g. COG class, subclass and description), joined
+    if len(keys) < 2:
+        return None
+
+    info = df[keys[0]].astype(str)
+    for k in keys[1:-1]:
+        info = info + " | " + df[k].astype(str)
+
+    return info
+
+
+def insert_features(con, pckg, source, df, keys):
+    info = feature_info(df, keys)
+    if info is None:
+        return
+
+    con.executemany(
+        "INSERT INTO features (package, source, feature, info) VALUES (?, ?, ?, ?)",
+        zip([pckg] * len(df), [source] * len(df), df[keys[-1]].astype(str).tolist(), info.tolist())
+    )
+
+
+def load_raw_table(con, table, path, extra_cols, index_cols, chunksize):
+    for chunk in table_chunks(path, None, chunksize):
+        for c, v in extra_cols.items():
+            chunk[c] = v
+
+        add_missing_columns(con, table, chunk.columns)
+        chunk.to_sql(table, con, if_exists="append", index=False)
+
+    existing = table_columns(con, table)
+    for c in index_cols:
+        if c in existing:
+            con.execute(f'CREATE INDEX IF NOT EXISTS "{table}_{c}" ON "{table}" ("{c}")')
+
+
+def add_missing_columns(con, table, columns):
+    existing = table_columns(con, table)
+    if len(existing) == 0:
+        return
+
+    for c in columns:
+        if c not in existing:
+            con.execute(f'ALTER TABLE "{table}" ADD COLUMN "{c}"')
+
+
+def table_columns(con, table):
+    return [r[1] for r in con.execute(f'PRAGMA table_info("{table}")')]
+
+
+def table_header(path):
+    if path.endswith(".tsv"):
+        return list(pd.read_csv(path, sep="\t", nrows=0).columns)
+
+    import pyarrow.parquet as pq
+    import pyarrow as pa
+
+    if path.endswith(".parquet"):
+        return list(pq.read_schema(path).names)
+
+    with pa.ipc.open_file(path) as reader:
+        return list(reader.schema.names)
+
+
+def table_chunks(path, dtype, chunksize):
+    if path.endswith(".tsv"):
+        yield from pd.read_csv(path, sep="\t", dtype=dtype, chunksize=chunksize)
+        return
+
+    import pyarrow.parquet as pq
+    import pyarrow as pa
+
+    if path.endswith(".parquet"):
+        batches = pq.ParquetFile(path).iter_batches(batch_size=chunksize)
+    else:
+        reader = pa.ipc.open_file(path)
+        batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+
+    for batch in batches:
+        chunk = batch.to_pandas()
+        for c, t in (dtype or {}).items():
+            chunk[c] = chunk[c].astype(object).where(chunk[c].notna(), None)
+            chunk[c] = chunk[c].map(lambda x: x if x is None else t(x))
+        yield chunk
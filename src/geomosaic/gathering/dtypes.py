@@ -0,0 +1,46 @@
+"""
+Memory-lean dtype policy of the gathered frames: the readers declare the
+dtypes of the columns they parse, with the repeated annotation columns read
+as categorical, the counts parsed from each sample are kept in the smallest
+dtype that holds them exactly, and long frames keep their sample column as
+categorical. The written tables do not change.
+"""
+import numpy as np
+
+
+# whole numbers up to 2**24 are exact in float32
+FLOAT32_EXACT = 2**24
+
+
+def lean_array(values, floats=True):
+    """
+    Smallest dtype for a numpy array of counts: integers are downcast (e.g.
+    to int16 or int32) and, with `floats`, floats become float32 when they
+    are whole numbers below 2**24. Everything else is returned as it is.
+    """
+    kind = values.dtype.kind
+
+    if kind in "iu" and len(values) > 0:
+        for dtype in [np.int8, np.int16, np.int32]:
+            info = np.iinfo(dtype)
+            if values.min() >= info.min and values.max() <= info.max:
+                return values.astype(dtype)
+
+    if floats and kind == "f" and values.dtype.itemsize > 4:
+        finite = values[~np.isnan(values)]
+        if np.all(finite == np.round(finite)) and np.all(np.abs(finite) < FLOAT32_EXACT):
+            return values.astype(np.float32)
+
+    return values
+
+
+def lean_counts(df, keys):
+    """
+    Apply lean_array to the value columns of a frame (the columns not in
+    `keys`), as soon as a sample has been parsed.
+    """
+    keys = [keys] if isinstance(keys, str) else list(keys)
+
+    lean = {c: lean_array(df[c].to_numpy()) for c in df.columns if c not in keys and df[c].dtype.kind in "iuf"}
+    return df.assign(**lean)
+
@@ -4,7 +4,10 @@ from subprocess import check_call
 from os import listdir
 import os
 import yaml
-from geomosaic.gathering.utils import get_sample_with_results
+from geomosaic.gathering.utils import get_sample_with_results, split_gtdb_classification
+from geomosaic.gathering.writer import write_table
+from geomosaic.gathering.matrix import compose_long_matrix
+from geomosaic.gathering.cache import load_sample_results, source_name
 
 
 def gather_coverm_genome(config_file, geomosaic_wdir, output_base_folder, additional_info):
@@ -13,54 +16,57 @@ def gather_coverm_genome(config_file, geomosaic_wdir, output_base_folder, additi
     with open(config_file) as file:
         config = yaml.load(file, Loader=yaml.FullLoader)
     
-    samples = get_sample_with_results(pckg, geomosaic_wdir, config["SAMPLES"])
+    samples = get_sample_with_results(pckg, geomosaic_wdir, config["SAMPLES"], additional_info)
 
     gtdbtk_gather = os.path.join(output_base_folder, "mags_gtdbtk")
     output_folder = os.path.join(output_base_folder, pckg)
 
     check_call(f"mkdir -p {output_folder}", shell=True)
-    complete_coverm_genome(geomosaic_wdir, output_folder, gtdbtk_gather, samples)
+    complete_coverm_genome(geomosaic_wdir, output_folder, gtdbtk_gather, samples, additional_info)
 
 
-def complete_coverm_genome(folder, output_folder, gtdbtk_gather, samples):
-    DF_NORM = parse_coverm_genome(folder, gtdbtk_gather, samples)
+def complete_coverm_genome(folder, output_folder, gtdbtk_gather, samples, additional_info):
+    DF_NORM = parse_coverm_genome(folder, gtdbtk_gather, samples, additional_info)
+    DF_LONG = concat_norm_samples(DF_NORM)
 
     for level in ["phylum", "class", "order", "family", "genus", "species"]:
-        res = taxa_level_abundances(DF_NORM, level)
+        res = taxa_level_abundances(DF_LONG, level)
 
         for norm, dfnorm in res.items():
-            dfnorm.to_csv(f"{output_folder}/{level}_{norm}.tsv", sep="\t", index=False, header=True)
+            write_table(dfnorm, f"{output_folder}/{level}_{norm}.tsv", additional_info)
 
 
-def taxa_level_abundances(DF_NORM, level):
+def concat_norm_samples(DF_NORM):
+    # one long frame per normalisation, with the sample of each MAG
+    DF_LONG = {}
+
+    for norm in DF_NORM:
+        list_dfs = [x.loc[:, ["phylum", "class", "order", "family", "genus", "species", norm]].assign(gm_sample=s) for s, x in DF_NORM[norm].items()]
+        long_df = pd.concat(list_dfs, ignore_index=True)
+        long_df["gm_sample"] = pd.Categorical(long_df["gm_sample"], categories=list(DF_NORM[norm]))
+
+        DF_LONG[norm] = (list(DF_NORM[norm]), long_df)
+
+    return DF_LONG
+
+
+def taxa_level_abundances(DF_LONG, level):
     assert level in ["phylum", "class", "order", "family", "genus", "species"]
 
     df = {}
     
-    for norm in DF_NORM:
-        db_list = []
-        for s, x in DF_NORM[norm].items():
-            db_list += list(x[level])
+    for norm, (samples, long_df) in DF_LONG.items():
+        features = ["unclassified_"] if long_df[level].isna().any() else []
+        grouped = long_df.groupby(by=[level, "gm_sample"], sort=False, observed=True)[norm].sum().reset_index()
 
-        unique_db_list = sorted(set([i if i == i else "unclassified_" for i in db_list]))
-            
-        m = pd.DataFrame(unique_db_list, columns=[level])
-        
-        for s, x in DF_NORM[norm].items():
-            temp_sample_df = x.loc[:,[level, norm]].groupby(by=level).sum().reset_index()
-            temp_sample_df.rename(columns={norm: s}, inplace=True)
-            temp = pd.merge(m, temp_sample_df, how="left", on=level)
-            m = temp.copy()
-        
-        newm = m.fillna(0)
-
-        df[norm] = newm
+        df[norm] = compose_long_matrix(grouped, level, "gm_sample", norm, samples, features=features)
     return df
 
 
-def parse_coverm_genome(folder, gtdbtk_gather, samples):
+def parse_coverm_genome(folder, gtdbtk_gather, samples, additional_info):
     DF_NORM = {}
 
+    tasks = []
     for s in samples:
         sample_folder = f"{folder}/{s}/coverm_genome/"
         methods = []
@@ -69,21 +75,38 @@ def parse_coverm_genome(folder, gtdbtk_gather, samples):
             for line in fd:
                 methods.append(line.rstrip("\n"))
         
-        for mtd in methods:
+        # GEOMOSAIC GTDBTK GATHER FILE
+        gtdbtk_file = f"{gtdbtk_gather}/geomosaic_samples/{s}.tsv"
+
+        tasks.append((s, [gtdbtk_file] + [f"{sample_folder}/{mtd}.tsv" for mtd in methods]))
+    
+    reader = lambda fns: [(os.path.basename(source_name(fn))[:-len(".tsv")], pd.read_csv(fn, sep="\t")) for fn in fns]
+
+    for s, sample_norms in load_sample_results(tasks, reader, parse_coverm_sample, additional_info, cache_name="coverm_genome"):
+        for mtd, m in sample_norms.items():
             if mtd not in DF_NORM:
                 DF_NORM[mtd] = {}
-        
-            df_mtd = pd.read_csv(f"{sample_folder}/{mtd}.tsv", sep="\t")
-            df_mtd.columns = ["MAGs", mtd]
 
-            df_mtd = df_mtd[df_mtd["MAGs"] != "unmapped"]
+            DF_NORM[mtd][s] = m
+    
+    return DF_NORM
 
-            # GEOMOSAIC GTDBTK GATHER FILE
-            df_cov = pd.read_csv(f"{gtdbtk_gather}/geomosaic_samples/{s}.tsv", sep="\t")
-            df_cov = df_cov.loc[:, ["MAGs", "phylum", "class", "order", "family", "genus", "species"]]
 
-            m = pd.merge(df_mtd, df_cov, how="left", on="MAGs")
+def parse_coverm_sample(s, sample_dfs):
+    # the first table is the one from the GTDB-Tk gathering
+    _, gtdbtk = sample_dfs[0]
 
-            DF_NORM[mtd][s] = m
+    # empty ranks are left missing, as they are read back from the gathered table
+    ranks = split_gtdb_classification(gtdbtk["classification"]).replace("", np.nan)
+    df_cov = pd.concat([gtdbtk.loc[:, ["MAGs"]], ranks], axis=1)
+    df_cov = df_cov.loc[:, ["MAGs", "phylum", "class", "order", "family", "genus", "species"]]
+
+    sample_norms = {}
+    for mtd, df_mtd in sample_dfs[1:]:
+        df_mtd.columns = ["MAGs", mtd]
+
+        df_mtd = df_mtd[df_mtd["MAGs"] != "unmapped"]
+
+        sample_norms[mtd] = pd.merge(df_mtd, df_cov, how="left", on="MAGs")
     
-    return DF_NORM
+    return sample_norms
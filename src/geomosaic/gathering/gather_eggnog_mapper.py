@@ -1,10 +1,14 @@
 import pandas as pd
 import numpy as np
 from subprocess import check_call
-from os import listdir
+from geomosaic.gathering.scan import list_folder
 import os
 import yaml
 from geomosaic.gathering.utils import get_sample_with_results
+from geomosaic.gathering.writer import write_table
+from geomosaic.gathering.matrix import compose_feature_matrix
+from geomosaic.gathering.cache import load_sample_results
+from geomosaic.gathering.dtypes import lean_array
 
 
 def gather_eggnogmapper(config_file, geomosaic_wdir, output_base_folder, additional_info):
@@ -13,86 +17,92 @@ def gather_eggnogmapper(config_file, geomosaic_wdir, output_base_folder, additio
     with open(config_file) as file:
         config = yaml.load(file, Loader=yaml.FullLoader)
     
-    samples = get_sample_with_results(pckg, geomosaic_wdir, config["SAMPLES"])
+    samples = get_sample_with_results(pckg, geomosaic_wdir, config["SAMPLES"], additional_info)
 
     output_folder = os.path.join(output_base_folder, pckg)
 
     check_call(f"mkdir -p {output_folder}", shell=True)
-    parse_eggonog_files(geomosaic_wdir, output_folder, samples)
+    parse_eggonog_files(geomosaic_wdir, output_folder, samples, additional_info)
 
 
-def parse_eggonog_files(folder, output_folder, samples):
+def parse_eggonog_files(folder, output_folder, samples, additional_info):
     DFs_modules = []
     DFs_ko = []
     DFs_reaction = []
     DFs_rclass = []
 
-    unique_modules = set()
-    unique_ko = set()
-    unique_reaction = set()
-    unique_rclass = set()
-
+    flag = True
+    tasks = []
     for s in samples:
         folder_data = f"{folder}/{s}/eggnog_mapper"
 
-        flag = True
-        if "gm_eggnog_annot.emapper.annotations" not in listdir(folder_data):
+        if "gm_eggnog_annot.emapper.annotations" not in list_folder(folder_data, additional_info):
             flag = False
             break
-            
-        df = pd.read_csv(f"{folder_data}/gm_eggnog_annot.emapper.annotations", sep="\t", skiprows=4)
         
-        a = parse_eggnog_annotation(df, s, "KEGG_Module")
-        unique_modules.update(list(a["KEGG_Module"].unique()))
+        tasks.append((s, f"{folder_data}/gm_eggnog_annot.emapper.annotations"))
+    
+    if not flag:
+        return
+    
+    for s, (a, b, c, d) in load_sample_results(tasks, count_kegg_facets, parse_eggnog_sample, additional_info, cache_name="eggnog_mapper"):
         DFs_modules.append(a)
-        
-        b = parse_eggnog_annotation(df, s, "KEGG_ko")
-        unique_ko.update(list(b["KEGG_ko"].unique()))
         DFs_ko.append(b)
-        
-        c = parse_eggnog_annotation(df, s, "KEGG_Reaction")
-        unique_reaction.update(list(c["KEGG_Reaction"].unique()))
         DFs_reaction.append(c)
-        
-        d = parse_eggnog_annotation(df, s, "KEGG_rclass")
-        unique_rclass.update(list(d["KEGG_rclass"].unique()))
         DFs_rclass.append(d)
     
-    if flag:
-        final_modules = compose_final_matrix(DFs_modules, unique_modules, "KEGG_Module")
-        final_modules.to_csv(f"{output_folder}/KEGG_module.tsv", sep="\t", index=False, header=True)
-        
-        final_ko = compose_final_matrix(DFs_ko, unique_ko, "KEGG_ko")
-        final_ko.to_csv(f"{output_folder}/KEGG_ko.tsv", sep="\t", index=False, header=True)
-        
-        final_reaction = compose_final_matrix(DFs_reaction, unique_reaction, "KEGG_Reaction")
-        final_reaction.to_csv(f"{output_folder}/KEGG_reaction.tsv", sep="\t", index=False, header=True)
-        
-        final_rclass = compose_final_matrix(DFs_rclass, unique_rclass, "KEGG_rclass")
-        final_rclass.to_csv(f"{output_folder}/KEGG_rclass.tsv", sep="\t", index=False, header=True)
+    final_modules = compose_feature_matrix(DFs_modules, "KEGG_Module", additional_info)
+    write_table(final_modules, f"{output_folder}/KEGG_module.tsv", additional_info)
+    
+    final_ko = compose_feature_matrix(DFs_ko, "KEGG_ko", additional_info)
+    write_table(final_ko, f"{output_folder}/KEGG_ko.tsv", additional_info)
+    
+    final_reaction = compose_feature_matrix(DFs_reaction, "KEGG_Reaction", additional_info)
+    write_table(final_reaction, f"{output_folder}/KEGG_reaction.tsv", additional_info)
+    
+    final_rclass = compose_feature_matrix(DFs_rclass, "KEGG_rclass", additional_info)
+    write_table(final_rclass, f"{output_folder}/KEGG_rclass.tsv", additional_info)
 
 
-def parse_eggnog_annotation(df, s, pivot):
-    df_parsed = df[df[pivot] == df[pivot]]
-    df_parsed = df_parsed.loc[:, ["#query", pivot]]
+KEGG_FACETS = ["KEGG_Module", "KEGG_ko", "KEGG_Reaction", "KEGG_rclass"]
 
-    df_parsed = df_parsed[df_parsed[pivot] != "-"]
-    
-    df_parsed[pivot] = df_parsed[pivot].str.split(',')
-    df_parsed = df_parsed.explode(pivot)
 
-    df_parsed.drop_duplicates(inplace=True)
+def count_kegg_facets(filename, chunksize=50000):
+    """
+    Stream the annotation file in chunks, reading only the query and the
+    KEGG columns, and count for each annotation of the four KEGG facets the
+    number of distinct queries. emapper writes one line per query, so the
+    counts of the chunks can be summed.
+    """
+    chunks = pd.read_csv(filename, sep="\t", skiprows=4, usecols=["#query"] + KEGG_FACETS, dtype=str, chunksize=chunksize)
 
-    res = df_parsed.groupby(pivot).count().reset_index()
-    res.rename(columns = {"#query": s}, inplace=True)
-    return res
+    counts = []
+    for chunk in chunks:
+        long_df = chunk.melt(id_vars="#query", var_name="facet", value_name="annotation").dropna()
+        long_df = long_df[long_df["annotation"] != "-"]
 
+        long_df["annotation"] = long_df["annotation"].str.split(',')
+        long_df = long_df.explode("annotation").drop_duplicates()
 
-def compose_final_matrix(list_dfs, unique_list, pivot):
-    m = pd.DataFrame(sorted(unique_list), columns=[pivot])
-    for x in list_dfs:
-        temp = pd.merge(m, x, how="left", on=pivot)
-        m = temp.copy()
-    
-    finalm = m.replace(np.nan, 0, regex=True)
-    return finalm
+        counts.append(long_df.groupby(["facet", "annotation"]).size())
+
+    if len(counts) == 0:
+        return pd.Series(dtype="int64", index=pd.MultiIndex.from_tuples([], names=["facet", "annotation"]))
+
+    return pd.concat(counts).groupby(level=["facet", "annotation"]).sum()
+
+
+def parse_eggnog_sample(s, counts):
+    a = parse_eggnog_annotation(counts, s, "KEGG_Module")
+    b = parse_eggnog_annotation(counts, s, "KEGG_ko")
+    c = parse_eggnog_annotation(counts, s, "KEGG_Reaction")
+    d = parse_eggnog_annotation(counts, s, "KEGG_rclass")
+
+    return a, b, c, d
+
+
+def parse_eggnog_annotation(counts, s, pivot):
+    facets = counts.index.get_level_values("facet")
+    res = counts[facets == pivot].droplevel("facet")
+
+    return pd.DataFrame({pivot: res.index.to_numpy(dtype=object), s: lean_array(res.to_numpy(dtype="int64"))})
@@ -4,6 +4,9 @@ from subprocess import check_call
 import os
 import yaml
 from geomosaic.gathering.utils import get_sample_with_results
+from geomosaic.gathering.writer import write_table, write_table_stream
+from geomosaic.gathering.matrix import compose_feature_matrix
+from geomosaic.gathering.loader import load_sample_files, table_columns
 
 
 def gather_hmms_search(config_file, geomosaic_wdir, output_base_folder, additional_info):
@@ -14,65 +17,52 @@ def gather_hmms_search(config_file, geomosaic_wdir, output_base_folder, addition
 
     hmmsearch_outfolder = additional_info["assembly_hmmsearch_output_folder"]
 
-    samples = get_sample_with_results(hmmsearch_outfolder, geomosaic_wdir, config["SAMPLES"])
+    samples = get_sample_with_results(hmmsearch_outfolder, geomosaic_wdir, config["SAMPLES"], additional_info)
 
     output_folder = os.path.join(output_base_folder, pckg)
 
     check_call(f"mkdir -p {output_folder}", shell=True)
-    complete_hmmsearch(geomosaic_wdir, hmmsearch_outfolder, output_folder, samples)
+    complete_hmmsearch(geomosaic_wdir, hmmsearch_outfolder, output_folder, samples, additional_info)
 
 
-def complete_hmmsearch(folder, hmmsearch_outfolder, output_folder, samples):
-    DF_NORM, All_samples_df = parse_hmmsearch_results(folder, hmmsearch_outfolder, samples)
+def complete_hmmsearch(folder, hmmsearch_outfolder, output_folder, samples, additional_info):
+    DF_NORM = {}
 
-    concat = pd.concat(All_samples_df, ignore_index=True)
-    concat.to_csv(f"{output_folder}/ALL_SAMPLES_HMM_coverage_table.tsv", sep="\t", header=True, index=False)
+    tasks = [(s, f"{folder}/{s}/{hmmsearch_outfolder}/HMMs_coverage_table.tsv") for s in samples]
+    columns = table_columns([fn for _, fn in tasks])
 
-    for n in DF_NORM:
-        norm_merged = merge_results_by_norm(DF_NORM, norm_method=n)
-        norm_merged.to_csv(f"{output_folder}/{n}.tsv", sep="\t", header=True, index=False)
-
-
-def parse_hmmsearch_results(folder, hmmsearch_outfolder, samples):
-    DF_norm = {}
-
-    All_samples_df = []
+    # the per-norm aggregates are collected while the samples are written
+    All_samples_df = parse_hmmsearch_results(tasks, DF_NORM, additional_info)
+    write_table_stream(All_samples_df, f"{output_folder}/ALL_SAMPLES_HMM_coverage_table.tsv", columns, additional_info)
 
-    for s in samples:
-        df = pd.read_csv(f"{folder}/{s}/{hmmsearch_outfolder}/HMMs_coverage_table.tsv", sep="\t")
-        All_samples_df.append(df)
+    for n in DF_NORM:
+        norm_merged = merge_results_by_norm(DF_NORM, norm_method=n, additional_info=additional_info)
+        write_table(norm_merged, f"{output_folder}/{n}.tsv", additional_info)
 
-        norms = list(df.columns)[15:-1]
-        cols = ["HMM_model"] + norms
-        filt = df[df["perc_conserved"] >= 50].loc[:, cols].drop_duplicates()
 
-        grp = filt.groupby(by="HMM_model").sum().reset_index()
+def parse_hmmsearch_results(tasks, DF_norm, additional_info):
+    reader = lambda fn: pd.read_csv(fn, sep="\t")
 
-        for n in norms:
-            norm_df = grp.loc[:,["HMM_model", n]]
-            
+    for s, (df, sample_norms) in load_sample_files(tasks, reader, additional_info, parser=parse_sample_hmms, step="hmms_search"):
+        for n, norm_df in sample_norms.items():
             if n not in DF_norm:
                 DF_norm[n] = {}
             
             DF_norm[n][s] = norm_df
-    
-    return DF_norm, All_samples_df
-
-
-def merge_results_by_norm(DF_NORM, norm_method):
-    db_list = []
-    for _, x in DF_NORM[norm_method].items():
-        db_list += list(x["HMM_model"])
-    
-    unique_db_list = sorted(set(db_list))
-    
-    m = pd.DataFrame(unique_db_list, columns=["HMM_model"])
-    
-    for s, x in DF_NORM[norm_method].items():
-        temp_sample_df = x.copy()
-        temp_sample_df.rename(columns={norm_method: s}, inplace=True)
-        temp = pd.merge(m, temp_sample_df, how="left", on="HMM_model")
-        m = temp.copy()
-    
-    newm = m.fillna(0)
-    return newm
+
+        yield df
+
+
+def parse_sample_hmms(s, df):
+    norms = list(df.columns)[15:-1]
+    cols = ["HMM_model"] + norms
+    filt = df[df["perc_conserved"] >= 50].loc[:, cols].drop_duplicates()
+
+    grp = filt.groupby(by="HMM_model").sum().reset_index()
+
+    return df, {n: grp.loc[:,["HMM_model", n]] for n in norms}
+
+
+def merge_results_by_norm(DF_NORM, norm_method, additional_info):
+    list_dfs = [x.rename(columns={norm_method: s}) for s, x in DF_NORM[norm_method].items()]
+    return compose_feature_matrix(list_dfs, "HMM_model", additional_info)
@@ -2,9 +2,13 @@ import pandas as pd
 import numpy as np
 from subprocess import check_call
 import os
-from os import listdir
+from geomosaic.gathering.scan import list_folder
 import yaml
 from geomosaic.gathering.utils import get_sample_with_results
+from geomosaic.gathering.writer import write_table
+from geomosaic.gathering.matrix import compose_sample_matrix
+from geomosaic.gathering.cache import load_sample_results
+from geomosaic.gathering.dtypes import lean_counts
 
 
 def gather_kaiju(config_file, geomosaic_wdir, output_base_folder, additional_info):
@@ -13,42 +17,43 @@ def gather_kaiju(config_file, geomosaic_wdir, output_base_folder, additional_inf
     with open(config_file) as file:
         config = yaml.load(file, Loader=yaml.FullLoader)
     
-    samples = get_sample_with_results(pckg, geomosaic_wdir, config["SAMPLES"])
+    samples = get_sample_with_results(pckg, geomosaic_wdir, config["SAMPLES"], additional_info)
 
     output_folder = os.path.join(output_base_folder, pckg)
 
     check_call(f"mkdir -p {output_folder}", shell=True)
-    compose_matrix_kaiju(geomosaic_wdir, output_folder, samples)
+    compose_matrix_kaiju(geomosaic_wdir, output_folder, samples, additional_info)
 
 
-def compose_matrix_kaiju(folder, output_folder, samples):
+def compose_matrix_kaiju(folder, output_folder, samples, additional_info):
     for t in ["phylum", "class", "order", "family", "genus", "species"]:
         pivot = t
-        unique_list = set()
         list_dfs = []
 
+        flag = True
+        tasks = []
         for s in samples:
             folder_data = f"{folder}/{s}/kaiju"
             
-            flag = True
-            if f"{t}.tsv" not in listdir(folder_data):
+            if f"{t}.tsv" not in list_folder(folder_data, additional_info):
                 flag = False
                 break
-
-            rawdf = pd.read_csv(f"{folder_data}/{t}.tsv", sep="\t")
-            df = rawdf.loc[:, ["taxon_name", "percent"]]
-            df.rename(columns={"taxon_name": pivot, "percent": s}, inplace=True)
             
-            unique_list.update(list(df[pivot].unique()))
-            list_dfs.append(df)
+            tasks.append((s, f"{folder_data}/{t}.tsv"))
 
         if not flag:
             continue
 
-        m = pd.DataFrame(sorted(unique_list), columns=[pivot])
-        for x in list_dfs:
-            temp = pd.merge(m, x, how="left", on=pivot)
-            m = temp.copy()
-        
-        finalm = m.replace(np.nan, 0, regex=True)
-        finalm.to_csv(f"{output_folder}/{t}.tsv", sep="\t", index=False, header=True)
+        reader = lambda fn: pd.read_csv(fn, sep="\t", usecols=["taxon_name", "percent"])
+
+        for s, df in load_sample_results(tasks, reader, parse_kaiju_table, additional_info, cache_name=f"kaiju/{t}"):
+            df.rename(columns={"taxon_name": pivot, "percent": s}, inplace=True)
+
+            list_dfs.append(df)
+
+        finalm = compose_sample_matrix(list_dfs, pivot)
+        write_table(finalm, f"{output_folder}/{t}.tsv", additional_info)
+
+
+def parse_kaiju_table(s, rawdf):
+    return lean_counts(rawdf.loc[:, ["taxon_name", "percent"]], "taxon_name")
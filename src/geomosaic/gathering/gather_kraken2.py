@@ -5,6 +5,10 @@ import os
 from os import listdir
 import yaml
 from geomosaic.gathering.utils import get_sample_with_results
+from geomosaic.gathering.writer import write_table
+from geomosaic.gathering.matrix import compose_sample_matrix
+from geomosaic.gathering.cache import load_sample_results
+from geomosaic.gathering.dtypes import lean_counts
 
 
 def gather_kraken2(config_file, geomosaic_wdir, output_base_folder, additional_info):
@@ -13,75 +17,34 @@ def gather_kraken2(config_file, geomosaic_wdir, output_base_folder, additional_i
     with open(config_file) as file:
         config = yaml.load(file, Loader=yaml.FullLoader)
     
-    samples = get_sample_with_results(pckg, geomosaic_wdir, config["SAMPLES"])
+    samples = get_sample_with_results(pckg, geomosaic_wdir, config["SAMPLES"], additional_info)
 
     output_folder = os.path.join(output_base_folder, pckg)
 
     check_call(f"mkdir -p {output_folder}", shell=True)
-    parse_kraken_report(geomosaic_wdir, output_folder, samples)
+    parse_kraken_report(geomosaic_wdir, output_folder, samples, additional_info)
 
 
-def parse_kraken_report(folder, output_folder, samples):
-    DF_TAXA_RANKS = load_kraken_files(folder, samples)
+def parse_kraken_report(folder, output_folder, samples, additional_info):
+    DF_TAXA_RANKS, lineage = load_kraken_files(folder, samples, additional_info)
 
-    domain_merged = merge_results_by_taxa(DF_TAXA_RANKS, taxa_level="domain")
-    domain_merged.to_csv(f"{output_folder}/domain.tsv", sep="\t", header=True, index=False)
+    for taxa_level in KRAKEN_RANKS:
+        merged = merge_results_by_taxa(DF_TAXA_RANKS, taxa_level=taxa_level)
+        write_table(merged, f"{output_folder}/{taxa_level}.tsv", additional_info)
 
-    phylum_merged = merge_results_by_taxa(DF_TAXA_RANKS, taxa_level="phylum")
-    phylum_merged.to_csv(f"{output_folder}/phylum.tsv", sep="\t", header=True, index=False)
+    write_table(lineage, f"{output_folder}/lineage.tsv", additional_info)
 
-    class_merged = merge_results_by_taxa(DF_TAXA_RANKS, taxa_level="class")
-    class_merged.to_csv(f"{output_folder}/class.tsv", sep="\t", header=True, index=False)
 
-    order_merged = merge_results_by_taxa(DF_TAXA_RANKS, taxa_level="order")
-    order_merged.to_csv(f"{output_folder}/order.tsv", sep="\t", header=True, index=False)
-
-    family_merged = merge_results_by_taxa(DF_TAXA_RANKS, taxa_level="family")
-    family_merged.to_csv(f"{output_folder}/family.tsv", sep="\t", header=True, index=False)
-
-    genus_merged = merge_results_by_taxa(DF_TAXA_RANKS, taxa_level="genus")
-    genus_merged.to_csv(f"{output_folder}/genus.tsv", sep="\t", header=True, index=False)
+def merge_results_by_taxa(DF_TAXA_RANKS, taxa_level):
+    assert taxa_level in KRAKEN_RANKS
 
-    species_merged = merge_results_by_taxa(DF_TAXA_RANKS, taxa_level="species")
-    species_merged.to_csv(f"{output_folder}/species.tsv", sep="\t", header=True, index=False)
+    return compose_sample_matrix(list(DF_TAXA_RANKS[taxa_level].values()), taxa_level)
 
 
-def merge_results_by_taxa(DF_TAXA_RANKS, taxa_level):
-    assert taxa_level in ["domain", "phylum", "class", "order", "family", "genus", "species"]
-    
-    # remove empty classification
-    for _, x in DF_TAXA_RANKS[taxa_level].items():
-        x.replace(r'^\s*$', "unclassified_", regex=True, inplace=True)
-    
-    db_list = []
-    for _, x in DF_TAXA_RANKS[taxa_level].items():
-        db_list += list(x[taxa_level])
-    
-    unique_db_list = sorted(set(db_list))
-    
-    m = pd.DataFrame(unique_db_list, columns=[taxa_level])
-    
-    for s, x in DF_TAXA_RANKS[taxa_level].items():
-        temp_sample_df = x.copy()
-        temp = pd.merge(m, temp_sample_df, how="left", on=taxa_level)
-        m = temp.copy()
-    
-    newm = m.fillna(0)
-    return newm
+KRAKEN_RANKS = {"domain": "D", "phylum": "P", "class": "C", "order": "O", "family": "F", "genus": "G", "species": "S"}
 
 
-def load_kraken_files(folder, samples):
-    def adjust_scientific_name(string):
-        scientific_name = ""
-        flag = False
-        for c in string:
-            if c != " " and not flag:
-                flag = True
-    
-            if flag:
-                scientific_name += c
-        return scientific_name
-    
+def load_kraken_files(folder, samples, additional_info):
     cols = [
         "fragments_pecentage_rooted_at_this_taxon",
         "fragments_clade_rooted_at_this_taxon",
@@ -91,33 +54,82 @@ def load_kraken_files(folder, samples):
         "sc. name"
     ]
 
-    DF_TAXA_RANKS = {
-        "domain": {},
-        "phylum": {},
-        "class": {},
-        "order": {},
-        "family": {},
-        "genus": {},
-        "species": {},
-    }
-
-    for s in samples:
-        df = pd.read_csv(f"{folder}/{s}/kraken2/kraken_report.txt", sep="\t", names=cols)
-        df["scientific_name"] = df.apply(lambda x: adjust_scientific_name(x["sc. name"]), axis=1)
-        c1 = df["scientific_name"] != "unclassified"
-        c2 = df["scientific_name"] != "root"
-        c3 = df["scientific_name"] != "cellular organisms"
-        c4 = df["fragments_clade_rooted_at_this_taxon"] > 0
-        
-        df = df[c1 & c2 & c3 & c4]
-        df.drop_duplicates(inplace=True)
-
-        categories = {"domain": "D", "phylum": "P", "class": "C", "order": "O", "family": "F", "genus": "G", "species": "S"}
-        
-        for cat, cls in categories.items():
-            final = df[df["classification"] == cls ].loc[:,["scientific_name", "fragments_clade_rooted_at_this_taxon"]]
-            final.rename(columns={"scientific_name": cat, "fragments_clade_rooted_at_this_taxon": s}, inplace=True)
-            
+    DF_TAXA_RANKS = {taxa_level: {} for taxa_level in KRAKEN_RANKS}
+    DFs_lineage = []
+
+    tasks = [(s, f"{folder}/{s}/kraken2/kraken_report.txt") for s in samples]
+    # the rank codes repeat on every line and are read as categorical
+    dtypes = {"classification": "category", "NCBI_taxon_id": "int64", "sc. name": str}
+    reader = lambda fn: pd.read_csv(fn, sep="\t", names=cols, dtype=dtypes)
+
+    for s, (sample_ranks, sample_lineage) in load_sample_results(tasks, reader, parse_kraken_sample, additional_info, cache_name="kraken2"):
+        for cat, final in sample_ranks.items():
             DF_TAXA_RANKS[cat][s] = final
+        DFs_lineage.append(sample_lineage)
+
+    lineage_cols = ["NCBI_taxon_id", "rank"] + list(KRAKEN_RANKS)
+    lineage = pd.concat(DFs_lineage, ignore_index=True) if len(DFs_lineage) > 0 else pd.DataFrame(columns=lineage_cols)
+    lineage = lineage.drop_duplicates().sort_values(lineage_cols[2:] + ["NCBI_taxon_id"], kind="stable")
+
+    return DF_TAXA_RANKS, lineage.loc[:, lineage_cols]
+
+
+def parse_kraken_sample(s, df):
+    raw_name = df["sc. name"].astype(str)
+    scientific_name = raw_name.str.lstrip(" ")
+    depth = ((raw_name.str.len() - scientific_name.str.len()) // 2).to_numpy()
+
+    # empty classification
+    scientific_name = scientific_name.mask(scientific_name.str.strip() == "", "unclassified_")
+    df = df.assign(scientific_name=scientific_name)
+
+    lineage = kraken_lineage(depth, df["classification"].to_numpy(), scientific_name.to_numpy(dtype=object))
+
+    c1 = df["scientific_name"] != "unclassified"
+    c2 = df["scientific_name"] != "root"
+    c3 = df["scientific_name"] != "cellular organisms"
+    c4 = df["fragments_clade_rooted_at_this_taxon"] > 0
+    c5 = df["classification"].isin(KRAKEN_RANKS.values())
+
+    keep = c1 & c2 & c3 & c4 & c5
+    ranked = df[keep].drop_duplicates(subset=list(df.columns[:6]))
+
+    sample_ranks = {}
+    by_code = dict(tuple(ranked.groupby("classification", sort=False, observed=True)))
+    for cat, cls in KRAKEN_RANKS.items():
+        final = by_code[cls] if cls in by_code else ranked.iloc[:0]
+        final = final.loc[:, ["scientific_name", "fragments_clade_rooted_at_this_taxon"]]
+        final = final.rename(columns={"scientific_name": cat, "fragments_clade_rooted_at_this_taxon": s})
+
+        sample_ranks[cat] = lean_counts(final, cat)
+
+    rank_names = {cls: cat for cat, cls in KRAKEN_RANKS.items()}
+    sample_lineage = lineage[keep.to_numpy()]
+    sample_lineage.insert(0, "NCBI_taxon_id", df.loc[keep, "NCBI_taxon_id"].to_numpy())
+    sample_lineage.insert(1, "rank", df.loc[keep, "classification"].map(rank_names).to_numpy())
+
+    return sample_ranks, sample_lineage.drop_duplicates()
+
+
+def kraken_lineage(depth, codes, names):
+    """
+    Rebuild the lineage of each line of a kraken report from the indentation
+    of the names: the reports list the taxonomy in depth-first order, so the
+    ancestor at depth d of a line is the last line at depth d before it.
+    Returns a frame with the name of the ancestor at each rank ('' if none).
+    """
+    pos = np.arange(len(depth))
+    lineage = {}
+
+    for taxa_level, code in KRAKEN_RANKS.items():
+        ancestor = np.full(len(depth), -1)
+
+        for d in np.unique(depth[codes == code]):
+            last = np.maximum.accumulate(np.where(depth == d, pos, -1))
+            found = (depth >= d) & (last >= 0)
+            found[found] = codes[last[found]] == code
+            ancestor[found] = last[found]
+
+        lineage[taxa_level] = np.where(ancestor >= 0, names[ancestor], "")
 
-    return DF_TAXA_RANKS
+    return pd.DataFrame(lineage)
@@ -5,6 +5,9 @@ from os import listdir
 import yaml
 import os
 from geomosaic.gathering.utils import get_sample_with_results
+from geomosaic.gathering.writer import write_table
+from geomosaic.gathering.cache import load_sample_results
+from geomosaic.gathering.xlsx import read_first_sheet
 
 
 def gather_mags_dram(config_file, geomosaic_wdir, output_base_folder, additional_info):
@@ -13,36 +16,45 @@ def gather_mags_dram(config_file, geomosaic_wdir, output_base_folder, additional
     with open(config_file) as file:
         config = yaml.load(file, Loader=yaml.FullLoader)
     
-    samples = get_sample_with_results(pckg, geomosaic_wdir, config["SAMPLES"])
+    samples = get_sample_with_results(pckg, geomosaic_wdir, config["SAMPLES"], additional_info)
 
     output_folder = os.path.join(output_base_folder, pckg)
     check_call(f"mkdir -p {output_folder}", shell=True)
 
-    complete_mags_dram(geomosaic_wdir, output_folder, samples)
+    complete_mags_dram(geomosaic_wdir, output_folder, samples, additional_info)
 
 
-def complete_mags_dram(folder, base_output_folder, samples):
+def complete_mags_dram(folder, base_output_folder, samples, additional_info):
+    tasks = []
     for s in samples:
-        parse_for_mags(folder, base_output_folder, s)
-        parse_dram_by_cols(folder, base_output_folder, s)
+        distillation_folder = f"{folder}/{s}/mags_dram/dram_distillation"
+        tasks.append((s, [f"{distillation_folder}/metabolism_summary.xlsx", f"{distillation_folder}/product.tsv"]))
+    
+    reader = lambda fns: (read_first_sheet(fns[0]), pd.read_csv(fns[1], sep="\t"))
+    parser = lambda s, data: (parse_metabolism_summary(data[0]), data[1])
 
+    for s, (df, prod) in load_sample_results(tasks, reader, parser, additional_info, cache_name="mags_dram"):
+        parse_for_mags(df, base_output_folder, s, additional_info)
+        parse_dram_by_cols(prod, base_output_folder, s, additional_info)
 
-def parse_for_mags(folder, base_output_folder, s):
-    df = pd.read_excel(f"{folder}/{s}/mags_dram/dram_distillation/metabolism_summary.xlsx")
-    
+
+def parse_metabolism_summary(df):
     mags_cols = ["gene_id"] + list(df.columns)[5:]
     df = df.loc[:, mags_cols]
     
     df.drop_duplicates(inplace=True)
+    return df
+
+
+def parse_for_mags(df, base_output_folder, s, additional_info):
     output_folder = os.path.join(base_output_folder, s)
     check_call(f"mkdir -p {output_folder}", shell=True)
 
     df.rename(columns={"gene_id": "ko_number"}, inplace=True)
-    df.to_csv(f"{output_folder}/metabolism_summary.tsv", sep="\t", index=False, header=True)
+    write_table(df, f"{output_folder}/metabolism_summary.tsv", additional_info)
 
 
-def parse_dram_by_cols(folder, base_output_folder, s):
-    prod = pd.read_csv(f"{folder}/{s}/mags_dram/dram_distillation/product.tsv", sep="\t")
+def parse_dram_by_cols(prod, base_output_folder, s, additional_info):
     dram_cols = get_dram_cols()
 
     output_folder = os.path.join(base_output_folder, s)
@@ -51,7 +63,7 @@ def parse_dram_by_cols(folder, base_output_folder, s):
     for tag, tag_cols in dram_cols.items():
         tag_prod = prod.loc[:,["genome"]+tag_cols].copy()
         tag_prod.drop_duplicates(inplace=True)
-        tag_prod.to_csv(f"{output_folder}/{tag}.tsv", sep="\t", index=False, header=True)
+        write_table(tag_prod, f"{output_folder}/{tag}.tsv", additional_info)
 
 
 def get_dram_cols():
@@ -2,9 +2,13 @@ import pandas as pd
 import numpy as np
 from subprocess import check_call
 import os
-from os import listdir
+from geomosaic.gathering.scan import list_folder
 import yaml
-from geomosaic.gathering.utils import get_sample_with_results
+from geomosaic.gathering.utils import get_sample_with_results, split_gtdb_classification
+from geomosaic.gathering.writer import write_table
+from geomosaic.gathering.matrix import compose_sample_matrix
+from geomosaic.gathering.cache import load_sample_results, source_name
+from geomosaic.gathering.dtypes import lean_counts
 
 
 def gather_mags_gtdbtk(config_file, geomosaic_wdir, output_base_folder, additional_info):
@@ -13,40 +17,40 @@ def gather_mags_gtdbtk(config_file, geomosaic_wdir, output_base_folder, addition
     with open(config_file) as file:
         config = yaml.load(file, Loader=yaml.FullLoader)
     
-    samples = get_sample_with_results(pckg, geomosaic_wdir, config["SAMPLES"])
+    samples = get_sample_with_results(pckg, geomosaic_wdir, config["SAMPLES"], additional_info)
 
     output_folder = os.path.join(output_base_folder, pckg)
 
     check_call(f"mkdir -p {output_folder}", shell=True)
-    complete_mags_gtdbtk(geomosaic_wdir, output_folder, samples)
+    complete_mags_gtdbtk(geomosaic_wdir, output_folder, samples, additional_info)
 
 
-def complete_mags_gtdbtk(folder, output_folder, samples):
-    DF_TAXA_RANKS = get_tax_info(folder, output_folder, samples)
+def complete_mags_gtdbtk(folder, output_folder, samples, additional_info):
+    DF_TAXA_RANKS = get_tax_info(folder, output_folder, samples, additional_info)
 
     domain_merged = merge_results_by_taxa(DF_TAXA_RANKS, taxa_level="domain")
-    domain_merged.to_csv(f"{output_folder}/domain.tsv", sep="\t", header=True, index=False)
+    write_table(domain_merged, f"{output_folder}/domain.tsv", additional_info)
 
     phylum_merged = merge_results_by_taxa(DF_TAXA_RANKS, taxa_level="phylum")
-    phylum_merged.to_csv(f"{output_folder}/phylum.tsv", sep="\t", header=True, index=False)
+    write_table(phylum_merged, f"{output_folder}/phylum.tsv", additional_info)
 
     class_merged = merge_results_by_taxa(DF_TAXA_RANKS, taxa_level="class")
-    class_merged.to_csv(f"{output_folder}/class.tsv", sep="\t", header=True, index=False)
+    write_table(class_merged, f"{output_folder}/class.tsv", additional_info)
 
     order_merged = merge_results_by_taxa(DF_TAXA_RANKS, taxa_level="order")
-    order_merged.to_csv(f"{output_folder}/order.tsv", sep="\t", header=True, index=False)
+    write_table(order_merged, f"{output_folder}/order.tsv", additional_info)
 
     family_merged = merge_results_by_taxa(DF_TAXA_RANKS, taxa_level="family")
-    family_merged.to_csv(f"{output_folder}/family.tsv", sep="\t", header=True, index=False)
+    write_table(family_merged, f"{output_folder}/family.tsv", additional_info)
 
     genus_merged = merge_results_by_taxa(DF_TAXA_RANKS, taxa_level="genus")
-    genus_merged.to_csv(f"{output_folder}/genus.tsv", sep="\t", header=True, index=False)
+    write_table(genus_merged, f"{output_folder}/genus.tsv", additional_info)
 
     species_merged = merge_results_by_taxa(DF_TAXA_RANKS, taxa_level="species")
-    species_merged.to_csv(f"{output_folder}/species.tsv", sep="\t", header=True, index=False)
+    write_table(species_merged, f"{output_folder}/species.tsv", additional_info)
 
 
-def get_tax_info(base_folder, output_folder, samples):
+def get_tax_info(base_folder, output_folder, samples, additional_info):
     DF_TAXA_RANKS = {
         "domain": {},
         "phylum": {},
@@ -59,120 +63,50 @@ def get_tax_info(base_folder, output_folder, samples):
 
     taxa_ranks = ["domain", "phylum", "class", "order", "family", "genus", "species"]
 
+    tasks = []
     for s in samples:
         results_folder = f"{base_folder}/{s}/mags_gtdbtk"
-        
-        flag_bac = False
-        if "gtdbtk.bac120.summary.tsv" in listdir(results_folder):
-            flag_bac = True
-        
-            bac_df = pd.read_csv(f"{results_folder}/gtdbtk.bac120.summary.tsv", sep="\t")
-            
-            bac_df["domain"]  = bac_df.apply(lambda x: get_taxa_ranks(x["classification"], "domain"), axis=1)
-            bac_df["phylum"]  = bac_df.apply(lambda x: get_taxa_ranks(x["classification"], "phylum"), axis=1)
-            bac_df["class"]   = bac_df.apply(lambda x: get_taxa_ranks(x["classification"], "class"), axis=1)
-            bac_df["order"]   = bac_df.apply(lambda x: get_taxa_ranks(x["classification"], "order"), axis=1)
-            bac_df["family"]  = bac_df.apply(lambda x: get_taxa_ranks(x["classification"], "family"), axis=1)
-            bac_df["genus"]   = bac_df.apply(lambda x: get_taxa_ranks(x["classification"], "genus"), axis=1)
-            bac_df["species"] = bac_df.apply(lambda x: get_taxa_ranks(x["classification"], "species"), axis=1)
-
-        flag_arc = False
-        if "gtdbtk.ar53.summary.tsv" in listdir(results_folder):
-            flag_arc = True
-            
-            arc_df = pd.read_csv(f"{results_folder}/gtdbtk.ar53.summary.tsv", sep="\t")
-            
-            arc_df["domain"]  = arc_df.apply(lambda x: get_taxa_ranks(x["classification"], "domain"), axis=1)
-            arc_df["phylum"]  = arc_df.apply(lambda x: get_taxa_ranks(x["classification"], "phylum"), axis=1)
-            arc_df["class"]   = arc_df.apply(lambda x: get_taxa_ranks(x["classification"], "class"), axis=1)
-            arc_df["order"]   = arc_df.apply(lambda x: get_taxa_ranks(x["classification"], "order"), axis=1)
-            arc_df["family"]  = arc_df.apply(lambda x: get_taxa_ranks(x["classification"], "family"), axis=1)
-            arc_df["genus"]   = arc_df.apply(lambda x: get_taxa_ranks(x["classification"], "genus"), axis=1)
-            arc_df["species"] = arc_df.apply(lambda x: get_taxa_ranks(x["classification"], "species"), axis=1)
-
-        if not flag_bac and not flag_arc:
+        summaries = [f"{results_folder}/{fn}" for fn in ["gtdbtk.bac120.summary.tsv", "gtdbtk.ar53.summary.tsv"] if fn in list_folder(results_folder, additional_info)]
+        tasks.append((s, summaries))
+    
+    reader = lambda fns: {os.path.basename(source_name(fn)): pd.read_csv(fn, sep="\t", usecols=["user_genome", "classification"]) for fn in fns}
+
+    for s, final in load_sample_results(tasks, reader, parse_gtdbtk_sample, additional_info, cache_name="mags_gtdbtk"):
+        if final is None:
             continue
 
         check_call(f"mkdir -p {output_folder}/geomosaic_samples", shell=True)
         
-        if flag_arc and flag_bac:
-            final = pd.concat([bac_df, arc_df], ignore_index=True, )
-        elif flag_arc and not flag_bac:
-            final = arc_df
-        else:
-            assert flag_bac and not flag_arc
-            final = bac_df
-
-        final.rename(columns={"user_genome": "MAGs"}, inplace=True)
-        final.loc[:, ["MAGs", "domain", "phylum", "class", "order", "family", "genus", "species", "classification"]].to_csv(
+        final.to_csv(
             f"{output_folder}/geomosaic_samples/{s}.tsv", 
             sep="\t", header=True, index=False
         )
         
         for tr in taxa_ranks:
-            DF_TAXA_RANKS[tr][s] = final.loc[:,[tr, "MAGs"]].groupby(by=tr).count().reset_index()
+            # remove empty classification
+            ranks = final.loc[:,[tr, "MAGs"]]
+            ranks[tr] = ranks[tr].mask(ranks[tr].str.strip() == "", "unclassified_")
+
+            DF_TAXA_RANKS[tr][s] = lean_counts(ranks.groupby(by=tr).count().reset_index(), tr)
         
     return DF_TAXA_RANKS
 
 
+def parse_gtdbtk_sample(s, summaries):
+    dfs = [summaries[fn] for fn in ["gtdbtk.bac120.summary.tsv", "gtdbtk.ar53.summary.tsv"] if fn in summaries]
+
+    if len(dfs) == 0:
+        return None
+
+    final = pd.concat(dfs, ignore_index=True) if len(dfs) > 1 else dfs[0]
+    final = pd.concat([final, split_gtdb_classification(final["classification"])], axis=1)
+
+    final.rename(columns={"user_genome": "MAGs"}, inplace=True)
+    return final.loc[:, ["MAGs", "domain", "phylum", "class", "order", "family", "genus", "species", "classification"]]
+
+
 def merge_results_by_taxa(DF_TAXA_RANKS, taxa_level):
     assert taxa_level in ["domain", "phylum", "class", "order", "family", "genus", "species"]
-    
-    # remove empty classification
-    for _, x in DF_TAXA_RANKS[taxa_level].items():
-        x.replace(r'^\s*$', "unclassified_", regex=True, inplace=True)
-    
-    db_list = []
-    for _, x in DF_TAXA_RANKS[taxa_level].items():
-        db_list += list(x[taxa_level])
-    
-    unique_db_list = sorted(set(db_list))
-    
-    m = pd.DataFrame(unique_db_list, columns=[taxa_level])
-    
-    for s, x in DF_TAXA_RANKS[taxa_level].items():
-        temp_sample_df = x.copy()
-        temp_sample_df.rename(columns={"MAGs": s}, inplace=True)
-        temp = pd.merge(m, temp_sample_df, how="left", on=taxa_level)
-        m = temp.copy()
-    
-    newm = m.fillna(0)
-    return newm
-
-
-def get_taxa_ranks(classification, taxa_rank="all"):
-    mapping = {
-        "domain": 'd',
-        "phylum": 'p',
-        "class": 'c',
-        "order": 'o',
-        "family": 'f',
-        "genus": 'g',
-        "species": 's',
-    }
-    
-    tokens = classification.split(";")
-    d = {}
-    for tkn in tokens:
-        rank = tkn[0]
-        info = tkn[3:]
-        
-        d[rank] = info
-    
-    if taxa_rank == "all":
-        return d
-    elif taxa_rank == "domain":
-        return d[mapping[taxa_rank]]
-    elif taxa_rank == "phylum":
-        return d[mapping[taxa_rank]]
-    elif taxa_rank == "class":
-        return d[mapping[taxa_rank]]
-    elif taxa_rank == "order":
-        return d[mapping[taxa_rank]]
-    elif taxa_rank == "family":
-        return d[mapping[taxa_rank]]
-    elif taxa_rank == "genus":
-        return d[mapping[taxa_rank]]
-    else:
-        assert taxa_rank == "species"
-        return d[mapping[taxa_rank]]
+
+    list_dfs = [x.rename(columns={"MAGs": s}) for s, x in DF_TAXA_RANKS[taxa_level].items()]
+    return compose_sample_matrix(list_dfs, taxa_level)
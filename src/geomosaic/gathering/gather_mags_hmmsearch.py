@@ -4,7 +4,10 @@ from subprocess import check_call
 from os import listdir
 import os
 import yaml
-from geomosaic.gathering.utils import get_sample_with_results
+from geomosaic.gathering.utils import get_sample_with_results, scan_mag_folders
+from geomosaic.gathering.writer import write_table, write_table_stream
+from geomosaic.gathering.matrix import compose_feature_matrix
+from geomosaic.gathering.loader import load_sample_files, table_columns
 
 
 def gather_mags_hmmsearch(config_file, geomosaic_wdir, output_base_folder, additional_info):
@@ -15,79 +18,62 @@ def gather_mags_hmmsearch(config_file, geomosaic_wdir, output_base_folder, addit
 
     mags_hmmsearch_outfolder = additional_info["mags_hmmsearch_output_folder"]
 
-    samples = get_sample_with_results(mags_hmmsearch_outfolder, geomosaic_wdir, config["SAMPLES"])
+    samples = get_sample_with_results(mags_hmmsearch_outfolder, geomosaic_wdir, config["SAMPLES"], additional_info)
 
     output_folder = os.path.join(output_base_folder, pckg)
 
     check_call(f"mkdir -p {output_folder}", shell=True)
-    complete_hmmsearch(geomosaic_wdir, mags_hmmsearch_outfolder, output_folder, samples)
+    complete_hmmsearch(geomosaic_wdir, mags_hmmsearch_outfolder, output_folder, samples, additional_info)
 
 
-def complete_hmmsearch(folder, mags_hmmsearch_outfolder, base_output_folder, samples):
+def complete_hmmsearch(folder, mags_hmmsearch_outfolder, base_output_folder, samples, additional_info):
     for s in samples:
-        DF_NORM, All_mags_df = parse_hmmsearch_mags(folder, mags_hmmsearch_outfolder, s)
+        DF_NORM = {}
+
+        results_folder = f"{folder}/{s}/{mags_hmmsearch_outfolder}"
+        mag_files = scan_mag_folders(results_folder, additional_info)
+
+        tasks = [(m, f"{results_folder}/{m}/HMMs_coverage_table.tsv") for m, files in mag_files.items() if "HMMs_coverage_table.tsv" in files]
+        columns = table_columns([fn for _, fn in tasks])
 
         output_folder = os.path.join(base_output_folder, s)
         check_call(f"mkdir -p {output_folder}", shell=True)
 
-        concat = pd.concat(All_mags_df, ignore_index=True)
-        concat.to_csv(f"{output_folder}/ALL_MAGs_HMM_coverage_table.tsv", sep="\t", header=True, index=False)
+        # the per-norm aggregates are collected while the MAGs are written
+        All_mags_df = parse_hmmsearch_mags(s, tasks, DF_NORM, additional_info)
+        write_table_stream(All_mags_df, f"{output_folder}/ALL_MAGs_HMM_coverage_table.tsv", columns, additional_info)
 
         for n in DF_NORM:
-            norm_merged = merge_results_by_norm(DF_NORM, norm_method=n)
-            norm_merged.to_csv(f"{output_folder}/{n}.tsv", sep="\t", header=True, index=False)
+            norm_merged = merge_results_by_norm(DF_NORM, norm_method=n, additional_info=additional_info)
+            write_table(norm_merged, f"{output_folder}/{n}.tsv", additional_info)
 
 
-def merge_results_by_norm(DF_NORM, norm_method):
-    db_list = []
-    for _, x in DF_NORM[norm_method].items():
-        db_list += list(x["HMM_model"])
-    
-    unique_db_list = sorted(set(db_list))
-    
-    m = pd.DataFrame(unique_db_list, columns=["HMM_model"])
-    
-    for s, x in DF_NORM[norm_method].items():
-        temp_sample_df = x.copy()
-        temp_sample_df.rename(columns={norm_method: s}, inplace=True)
-        temp = pd.merge(m, temp_sample_df, how="left", on="HMM_model")
-        m = temp.copy()
-    
-    newm = m.fillna(0)
-    return newm
+def merge_results_by_norm(DF_NORM, norm_method, additional_info):
+    list_dfs = [x.rename(columns={norm_method: s}) for s, x in DF_NORM[norm_method].items()]
+    return compose_feature_matrix(list_dfs, "HMM_model", additional_info)
 
 
-def parse_hmmsearch_mags(folder, mags_hmmsearch_output_folder, s):
-    DF_norm = {}
-    All_mags_df = []
-    
-    results_folder = f"{folder}/{s}/{mags_hmmsearch_output_folder}"
-    for m in listdir(results_folder):
-        folder_data = f"{results_folder}/{m}"
-        if not os.path.isdir(folder_data) or not m.startswith("mag_"):
-            continue
-    
-        if "HMMs_coverage_table.tsv" not in listdir(f"{folder_data}"):
-            continue
-    
-        df = pd.read_csv(f"{folder_data}/HMMs_coverage_table.tsv", sep="\t")
-        All_mags_df.append(df)
-        
-        c1 = df["perc_conserved"] >= 50
-        
-        norms = list(df.columns)[15:-1]
-        cols = ["HMM_model"] + norms
-    
-        filt = df[c1].loc[:, cols].drop_duplicates()
-    
-        grp = filt.groupby(by="HMM_model").sum().reset_index()
-    
-        for n in norms:
-            norm_df = grp.loc[:,["HMM_model", n]]
-            
+def parse_hmmsearch_mags(s, tasks, DF_norm, additional_info):
+    reader = lambda fn: pd.read_csv(fn, sep="\t")
+
+    for m, (df, mag_norms) in load_sample_files(tasks, reader, additional_info, parser=parse_mag_hmms, step=f"mags_hmmsearch/{s}"):
+        for n, norm_df in mag_norms.items():
             if n not in DF_norm:
                 DF_norm[n] = {}
             
             DF_norm[n][m] = norm_df
+
+        yield df
+
+
+def parse_mag_hmms(m, df):
+    c1 = df["perc_conserved"] >= 50
     
-    return DF_norm, All_mags_df
+    norms = list(df.columns)[15:-1]
+    cols = ["HMM_model"] + norms
+
+    filt = df[c1].loc[:, cols].drop_duplicates()
+
+    grp = filt.groupby(by="HMM_model").sum().reset_index()
+
+    return df, {n: grp.loc[:,["HMM_model", n]] for n in norms}
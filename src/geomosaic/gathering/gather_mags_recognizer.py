@@ -4,8 +4,12 @@ from subprocess import check_call
 from os import listdir
 import os
 import yaml
-from geomosaic.gathering.gather_recognizer import get_dtypes
-from geomosaic.gathering.utils import get_sample_with_results
+from geomosaic.gathering.gather_recognizer import read_reliable_hits
+from geomosaic.gathering.utils import get_sample_with_results, scan_mag_folders
+from geomosaic.gathering.writer import write_table
+from geomosaic.gathering.matrix import compose_feature_matrix
+from geomosaic.gathering.cache import load_sample_results
+from geomosaic.gathering.dtypes import lean_counts
 
 
 def gather_mags_recognizer(config_file, geomosaic_wdir, output_base_folder, additional_info):
@@ -14,70 +18,64 @@ def gather_mags_recognizer(config_file, geomosaic_wdir, output_base_folder, addi
     with open(config_file) as file:
         config = yaml.load(file, Loader=yaml.FullLoader)
     
-    samples = get_sample_with_results(pckg, geomosaic_wdir, config["SAMPLES"])
+    samples = get_sample_with_results(pckg, geomosaic_wdir, config["SAMPLES"], additional_info)
 
     output_folder = os.path.join(output_base_folder, pckg)
 
     check_call(f"mkdir -p {output_folder}", shell=True)
-    complete_mags_recognizer(geomosaic_wdir, output_folder, samples)
+    complete_mags_recognizer(geomosaic_wdir, output_folder, samples, additional_info)
 
 
-def complete_mags_recognizer(folder, output_folder, samples):
+def complete_mags_recognizer(folder, output_folder, samples, additional_info):
     for s in samples:
-        cog = parse_quantification(folder, s, filename = "COG_quantification.tsv", pivot="COG_id")
+        mag_files = scan_mag_folders(f"{folder}/{s}/mags_recognizer", additional_info)
+
+        cog = parse_quantification(folder, s, mag_files, filename = "COG_quantification.tsv", pivot="COG_id", additional_info=additional_info)
         check_call(f"mkdir -p {output_folder}/{s}", shell=True)
-        cog.to_csv(f"{output_folder}/{s}/COG_quantification.tsv", header=True, index=False, sep="\t")
+        write_table(cog, f"{output_folder}/{s}/COG_quantification.tsv", additional_info)
 
-        kog = parse_quantification(folder, s, filename = "KOG_quantification.tsv", pivot="KOG_id")
+        kog = parse_quantification(folder, s, mag_files, filename = "KOG_quantification.tsv", pivot="KOG_id", additional_info=additional_info)
         check_call(f"mkdir -p {output_folder}/{s}", shell=True)
-        kog.to_csv(f"{output_folder}/{s}/KOG_quantification.tsv", header=True, index=False, sep="\t")
+        write_table(kog, f"{output_folder}/{s}/KOG_quantification.tsv", additional_info)
 
-        parse_mags_recognizer_EC_KO(folder, output_folder, s)
+        parse_mags_recognizer_EC_KO(folder, output_folder, s, mag_files, additional_info)
 
 
-def parse_mags_recognizer_EC_KO(folder, output_folder, s):
+def parse_mags_recognizer_EC_KO(folder, output_folder, s, mag_files, additional_info):
     results_folder = f"{folder}/{s}/mags_recognizer"
     
     DFs_ec = []
     DFs_ko = []
     
-    unique_ec = set()
-    unique_ko = set()
-    for m in listdir(results_folder):
-        folder_data = f"{results_folder}/{m}"
-        if not os.path.isdir(folder_data) or not m.startswith("mag_"):
-            continue
-
-        if "reCOGnizer_results.tsv" not in listdir(f"{folder_data}"):
-            continue
-            
-        df = pd.read_csv(f"{folder_data}/reCOGnizer_results.tsv", sep="\t", dtype=get_dtypes())
-        c1 = df["pident"] > 80
-        c2 = df["gapopen"] < 5
-        
-        relia = df[c1 & c2].copy()
-        if relia.shape[0] == 0:
+    tasks = [(m, f"{results_folder}/{m}/reCOGnizer_results.tsv") for m, files in mag_files.items() if "reCOGnizer_results.tsv" in files]
+    
+    for m, parsed in load_sample_results(tasks, read_reliable_hits, parse_mag_recognizer, additional_info, cache_name=f"mags_recognizer/{s}/EC_KO"):
+        if parsed is None:
             continue
 
         check_call(f"mkdir -p {output_folder}/{s}", shell=True)
         
-        relia.drop_duplicates(inplace=True)
-        
-        ec = clean_recognizer_dataframe(relia, m, "EC number", delim=",")
-        unique_ec.update(list(ec["EC number"].unique()))
+        ec, ko = parsed
         DFs_ec.append(ec)
-        
-        ko = clean_recognizer_dataframe(relia, m, "KO", delim=";")
-        unique_ko.update(list(ko["KO"].unique()))
         DFs_ko.append(ko)
         
     if len(DFs_ec) > 0:
-        final_ec = compose_final_matrix(DFs_ec, unique_ec, "EC number")
-        final_ec.to_csv(f"{output_folder}/{s}/EC_number.tsv", sep="\t", index=False, header=True)
+        final_ec = compose_feature_matrix(DFs_ec, "EC number", additional_info)
+        write_table(final_ec, f"{output_folder}/{s}/EC_number.tsv", additional_info)
 
     if len(DFs_ko) > 0:
-        final_ko = compose_final_matrix(DFs_ko, unique_ko, "KO")
-        final_ko.to_csv(f"{output_folder}/{s}/KO.tsv", sep="\t", index=False, header=True)
+        final_ko = compose_feature_matrix(DFs_ko, "KO", additional_info)
+        write_table(final_ko, f"{output_folder}/{s}/KO.tsv", additional_info)
+
+
+def parse_mag_recognizer(m, relia):
+    if relia.shape[0] == 0:
+        return None
+    
+    ec = clean_recognizer_dataframe(relia, m, "EC number", delim=",")
+    ko = clean_recognizer_dataframe(relia, m, "KO", delim=";")
+
+    return ec, ko
 
 
 def clean_recognizer_dataframe(df, s, pivot, delim):
@@ -91,46 +89,20 @@ def clean_recognizer_dataframe(df, s, pivot, delim):
 
     res = df_parsed.groupby(pivot).count().reset_index()
     res.rename(columns = {"qseqid": s}, inplace=True)
-    return res
-
-
-def compose_final_matrix(list_dfs, unique_list, pivot):
-    m = pd.DataFrame(sorted(unique_list), columns=[pivot])
-    for x in list_dfs:
-        temp = pd.merge(m, x, how="left", on=pivot)
-        m = temp.copy()
-    
-    finalm = m.replace(np.nan, 0, regex=True)
-    return finalm
+    return lean_counts(res, pivot)
 
 
-def parse_quantification(folder, s, filename, pivot):
+def parse_quantification(folder, s, mag_files, filename, pivot, additional_info):
     DFs_cog = []
-    unique_cog = set()
 
     results_folder = f"{folder}/{s}/mags_recognizer"
     
-    for m in sorted(listdir(results_folder)):
-        folder_data = f"{results_folder}/{m}"
-        if not os.path.isdir(folder_data) or not m.startswith("mag_"):
-            continue
-        
-        if filename not in listdir(f"{folder_data}"):
-            continue
-        
-        fn = f"{folder_data}/{filename}"
-        cog = pd.read_csv(fn, 
-                          sep="\t", names=["counts", "class", "subclass", "descr", pivot])
+    tasks = [(m, f"{results_folder}/{m}/{filename}") for m in sorted(mag_files) if filename in mag_files[m]]
+    
+    reader = lambda fn: pd.read_csv(fn, sep="\t", names=["counts", "class", "subclass", "descr", pivot])
+    parser = lambda m, cog: lean_counts(cog.rename(columns={"counts": m}), ["class", "subclass", "descr", pivot])
 
-        unique_cog.update(list(cog[["class", "subclass", "descr", pivot]].itertuples(index=False, name=None)))
-        cog.rename(columns={"counts": m}, inplace=True)
+    for m, cog in load_sample_results(tasks, reader, parser, additional_info, cache_name=f"mags_recognizer/{s}/{pivot}"):
         DFs_cog.append(cog)
 
-    merged = pd.DataFrame(sorted(unique_cog), columns=["class", "subclass", "descr", pivot])
-    for x in DFs_cog:
-        temp = pd.merge(merged, x, how="left", on=["class", "subclass", "descr", pivot])
-        merged = temp.copy()
-
-    finalm = merged.replace(np.nan, 0, regex=True)
-        
-    return finalm
+    return compose_feature_matrix(DFs_cog, ["class", "subclass", "descr", pivot], additional_info)
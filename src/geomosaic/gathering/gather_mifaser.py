@@ -2,9 +2,13 @@ import pandas as pd
 import numpy as np
 from subprocess import check_call
 import os
-from os import listdir
+from geomosaic.gathering.scan import list_folder
 import yaml
 from geomosaic.gathering.utils import get_sample_with_results
+from geomosaic.gathering.writer import write_table
+from geomosaic.gathering.matrix import compose_sample_matrix
+from geomosaic.gathering.cache import load_sample_results
+from geomosaic.gathering.dtypes import lean_counts
 
 
 def gather_mifaser(config_file, geomosaic_wdir, output_base_folder, additional_info):
@@ -13,35 +17,34 @@ def gather_mifaser(config_file, geomosaic_wdir, output_base_folder, additional_i
     with open(config_file) as file:
         config = yaml.load(file, Loader=yaml.FullLoader)
     
-    samples = get_sample_with_results(pckg, geomosaic_wdir, config["SAMPLES"])
+    samples = get_sample_with_results(pckg, geomosaic_wdir, config["SAMPLES"], additional_info)
 
     output_folder = os.path.join(output_base_folder, pckg)
 
     check_call(f"mkdir -p {output_folder}", shell=True)
-    compose_matrix_mifaser(geomosaic_wdir, samples, output_folder, pivot="ec_number")
+    compose_matrix_mifaser(geomosaic_wdir, samples, output_folder, pivot="ec_number", additional_info=additional_info)
 
 
-def compose_matrix_mifaser(folder, samples, output_folder, pivot):
-    unique_list = set()
+def compose_matrix_mifaser(folder, samples, output_folder, pivot, additional_info):
     list_dfs = []
 
+    flag = True
+    tasks = []
     for s in samples:
         folder_data = f"{folder}/{s}/mifaser"
         
-        flag = True
-        if "analysis.tsv" not in listdir(folder_data):
+        if "analysis.tsv" not in list_folder(folder_data, additional_info):
             flag = False
             break
 
-        df = pd.read_csv(f"{folder_data}/analysis.tsv", sep="\t", skiprows=1, names=[pivot,s])
-        unique_list.update(list(df[pivot].unique()))
+        tasks.append((s, f"{folder_data}/analysis.tsv"))
+
+    reader = lambda fn: pd.read_csv(fn, sep="\t", skiprows=1, names=[pivot, "count"], dtype={pivot: str})
+    parser = lambda s, df: lean_counts(df.rename(columns={"count": s}), pivot)
+
+    for s, df in load_sample_results(tasks if flag else [], reader, parser, additional_info, cache_name="mifaser"):
         list_dfs.append(df)
 
     if flag:
-        m = pd.DataFrame(sorted(unique_list), columns=[pivot])
-        for x in list_dfs:
-            temp = pd.merge(m, x, how="left", on=pivot)
-            m = temp.copy()
-        
-        finalm = m.replace(np.nan, 0, regex=True)
-        finalm.to_csv(f"{output_folder}/mifaser.tsv", sep="\t", index=False, header=True)
+        finalm = compose_sample_matrix(list_dfs, pivot)
+        write_table(finalm, f"{output_folder}/mifaser.tsv", additional_info)
@@ -2,10 +2,14 @@ import pandas as pd
 import numpy as np
 from subprocess import check_call
 import os
-from os import listdir
+from geomosaic.gathering.scan import list_folder
 import yaml
 from numpy import float64
 from geomosaic.gathering.utils import get_sample_with_results
+from geomosaic.gathering.writer import write_table
+from geomosaic.gathering.matrix import compose_feature_matrix
+from geomosaic.gathering.cache import load_sample_results
+from geomosaic.gathering.dtypes import lean_counts
 
 
 def gather_recognizer(config_file, geomosaic_wdir, output_base_folder, additional_info):
@@ -14,57 +18,76 @@ def gather_recognizer(config_file, geomosaic_wdir, output_base_folder, additiona
     with open(config_file) as file:
         config = yaml.load(file, Loader=yaml.FullLoader)
     
-    samples = get_sample_with_results(pckg, geomosaic_wdir, config["SAMPLES"])
+    samples = get_sample_with_results(pckg, geomosaic_wdir, config["SAMPLES"], additional_info)
 
     output_folder = os.path.join(output_base_folder, pckg)
 
     check_call(f"mkdir -p {output_folder}", shell=True)
-    complete_recognizer(geomosaic_wdir, output_folder, samples)
+    complete_recognizer(geomosaic_wdir, output_folder, samples, additional_info)
 
 
-def complete_recognizer(folder, output_folder, samples):
+def complete_recognizer(folder, output_folder, samples, additional_info):
     DFs_ec = []
     DFs_ko = []
 
-    unique_ec = set()
-    unique_ko = set()
-
+    flag = True
+    tasks = []
     for s in samples:
         folder_data = f"{folder}/{s}/recognizer"
 
-        flag = True
-        if "reCOGnizer_results.tsv" not in listdir(folder_data):
+        if "reCOGnizer_results.tsv" not in list_folder(folder_data, additional_info):
             flag = False
             break
-            
-        df = pd.read_csv(f"{folder_data}/reCOGnizer_results.tsv", sep="\t", dtype=get_dtypes())
-        c1 = df["pident"] > 80
-        c2 = df["gapopen"] < 5
-        
-        relia = df[c1 & c2].copy()
-        relia.drop_duplicates(inplace=True)
         
-        ec = parse_recognizer_results(relia, s, "EC number", delim=",")
-        unique_ec.update(list(ec["EC number"].unique()))
+        tasks.append((s, f"{folder_data}/reCOGnizer_results.tsv"))
+    
+    for s, (ec, ko) in load_sample_results(tasks if flag else [], read_reliable_hits, parse_recognizer_sample, additional_info, cache_name="recognizer/EC_KO"):
         DFs_ec.append(ec)
-        
-        ko = parse_recognizer_results(relia, s, "KO", delim=";")
-        unique_ko.update(list(ko["KO"].unique()))
         DFs_ko.append(ko)
         
-        
     if flag:
-        final_ec = compose_final_matrix(DFs_ec, unique_ec, "EC number")
-        final_ec.to_csv(f"{output_folder}/EC_number.tsv", sep="\t", index=False, header=True)
+        final_ec = compose_feature_matrix(DFs_ec, "EC number", additional_info)
+        write_table(final_ec, f"{output_folder}/EC_number.tsv", additional_info)
         
-        final_ko = compose_final_matrix(DFs_ko, unique_ko, "KO")
-        final_ko.to_csv(f"{output_folder}/KO.tsv", sep="\t", index=False, header=True)
+        final_ko = compose_feature_matrix(DFs_ko, "KO", additional_info)
+        write_table(final_ko, f"{output_folder}/KO.tsv", additional_info)
     
-    cog = parse_recognizer_quantification(folder, samples, filename="COG_quantification.tsv", pivot="COG_id")
-    cog.to_csv(f"{output_folder}/COG_quantification.tsv", header=True, index=False, sep="\t")
+    cog = parse_recognizer_quantification(folder, samples, filename="COG_quantification.tsv", pivot="COG_id", additional_info=additional_info)
+    write_table(cog, f"{output_folder}/COG_quantification.tsv", additional_info)
+
+    kog = parse_recognizer_quantification(folder, samples, filename="KOG_quantification.tsv", pivot="KOG_id", additional_info=additional_info)
+    write_table(kog, f"{output_folder}/KOG_quantification.tsv", additional_info)
+
+
+def read_reliable_hits(filename, chunksize=500000):
+    """
+    Stream a reCOGnizer results table in chunks, keeping only the reliable
+    hits (pident > 80 and gapopen < 5) and the columns used to count them.
+    """
+    cols = ["qseqid", "EC number", "KO"]
+    usecols = cols + ["pident", "gapopen"]
+    dtypes = {c: t for c, t in get_dtypes().items() if c in usecols}
+    # the annotations repeat over the hits of the same function
+    dtypes.update({"EC number": "category", "KO": "category"})
+
+    hits = []
+    for chunk in pd.read_csv(filename, sep="\t", usecols=usecols, dtype=dtypes, chunksize=chunksize):
+        c1 = chunk["pident"] > 80
+        c2 = chunk["gapopen"] < 5
+
+        hits.append(chunk.loc[c1 & c2, cols].drop_duplicates())
 
-    kog = parse_recognizer_quantification(folder, samples, filename="KOG_quantification.tsv", pivot="KOG_id")
-    kog.to_csv(f"{output_folder}/KOG_quantification.tsv", header=True, index=False, sep="\t")
+    if len(hits) == 0:
+        return pd.DataFrame(columns=cols)
+
+    return pd.concat(hits, ignore_index=True).drop_duplicates()
+
+
+def parse_recognizer_sample(s, relia):
+    ec = parse_recognizer_results(relia, s, "EC number", delim=",")
+    ko = parse_recognizer_results(relia, s, "KO", delim=";")
+
+    return ec, ko
 
 
 def parse_recognizer_results(df, s, pivot, delim):
@@ -78,39 +101,22 @@ def parse_recognizer_results(df, s, pivot, delim):
 
     res = df_parsed.groupby(pivot).count().reset_index()
     res.rename(columns = {"qseqid": s}, inplace=True)
-    return res
+    return lean_counts(res, pivot)
 
 
-def compose_final_matrix(list_dfs, unique_list, pivot):
-    m = pd.DataFrame(sorted(unique_list), columns=[pivot])
-    for x in list_dfs:
-        temp = pd.merge(m, x, how="left", on=pivot)
-        m = temp.copy()
-    
-    finalm = m.replace(np.nan, 0, regex=True)
-    return finalm
-
-
-def parse_recognizer_quantification(folder, samples, filename, pivot):
+def parse_recognizer_quantification(folder, samples, filename, pivot, additional_info):
     DFs_cog = []
-    unique_cog = set()
 
-    for s in samples:
-        fn = f"{folder}/{s}/recognizer/{filename}"
-        cog = pd.read_csv(fn, 
-                          sep="\t", names=["counts", "class", "subclass", "descr", pivot])
+    tasks = [(s, f"{folder}/{s}/recognizer/{filename}") for s in samples]
+    # the class and description columns repeat for every id of the same class
+    dtypes = {"class": "category", "subclass": "category", "descr": "category", pivot: str}
+    reader = lambda fn: pd.read_csv(fn, sep="\t", names=["counts", "class", "subclass", "descr", pivot], dtype=dtypes)
+    parser = lambda s, cog: lean_counts(cog.rename(columns={"counts": s}), ["class", "subclass", "descr", pivot])
 
-        unique_cog.update(list(cog[["class", "subclass", "descr", pivot]].itertuples(index=False, name=None)))
-        cog.rename(columns={"counts": s}, inplace=True)
+    for s, cog in load_sample_results(tasks, reader, parser, additional_info, cache_name=f"recognizer/{pivot}"):
         DFs_cog.append(cog)
 
-    m = pd.DataFrame(sorted(unique_cog), columns=["class", "subclass", "descr", pivot])
-    for x in DFs_cog:
-        temp = pd.merge(m, x, how="left", on=["class", "subclass", "descr", pivot])
-        m = temp.copy()
-
-    finalm = m.replace(np.nan, 0, regex=True)
-    return finalm
+    return compose_feature_matrix(DFs_cog, ["class", "subclass", "descr", pivot], additional_info)
 
 
 
@@ -0,0 +1,93 @@
+import os
+import pandas as pd
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from geomosaic.gathering.scan import file_stat
+from geomosaic.gathering.profiling import profile_sample
+
+
+def load_sample_files(tasks, reader, additional_info, parser=None, step=None):
+    """
+    Read the files of each task with a bounded pool of threads.
+
+    `tasks` is a list of (key, path), where path is a file or a list of
+    files, and `reader(path)` returns the loaded data. When `parser` is
+    given, the workers also run `parser(key, data)` and its result is
+    returned in place of the data. With `geomosaic gather --profile`, each
+    task is recorded under `step`. Results are yielded as (key, data) in
+    the same order of `tasks` while the next files are read ahead. The read-ahead is limited to twice the number of workers
+    and to `io_memory` GB of files (size on disk) in flight; a single file
+    bigger than the cap is still read, alone.
+    """
+    workers, max_bytes = loader_options(additional_info)
+
+    def load(key, path):
+        def run():
+            data = reader(path)
+            return data if parser is None else parser(key, data)
+
+        if "profile_samples" not in additional_info:
+            return run()
+
+        return profile_sample(additional_info, step, key, files_size(path, additional_info), run, exclusive=workers == 1)
+
+    if workers == 1:
+        for key, path in tasks:
+            yield key, load(key, path)
+        return
+
+    queue = deque()
+    inflight = 0
+    next_task = 0
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while next_task < len(tasks) or len(queue) > 0:
+            while next_task < len(tasks) and len(queue) < 2 * workers:
+                key, path = tasks[next_task]
+                size = files_size(path, additional_info)
+
+                if len(queue) > 0 and max_bytes is not None and inflight + size > max_bytes:
+                    break
+
+                queue.append((key, size, executor.submit(load, key, path)))
+                inflight += size
+                next_task += 1
+
+            key, size, future = queue.popleft()
+            data = future.result()
+            inflight -= size
+
+            yield key, data
+
+
+def loader_options(additional_info):
+    workers = max(1, int(additional_info.get("io_workers", 1)))
+
+    io_memory = additional_info.get("io_memory", None)
+    max_bytes = None if io_memory is None else int(io_memory * 1024**3)
+
+    return workers, max_bytes
+
+
+def files_size(path, additional_info=None):
+    paths = [path] if isinstance(path, str) else path
+
+    size = 0
+    for p in paths:
+        try:
+            size += file_stat(p, additional_info)[0]
+        except FileNotFoundError:
+            pass
+
+    return size
+
+
+def table_columns(paths):
+    # columns of pd.concat of the tables, reading only their headers
+    columns = []
+    for p in paths:
+        for c in pd.read_csv(p, sep="\t", nrows=0).columns:
+            if c not in columns:
+                columns.append(c)
+
+    return columns
@@ -0,0 +1,193 @@
+import pandas as pd
+import numpy as np
+from geomosaic.gathering.dtypes import lean_array
+
+
+def compose_sample_matrix(list_dfs, pivot, features=None):
+    """
+    Build the feature x sample table from a list of per-sample frames.
+
+    Each frame contains the key column(s) in `pivot` and exactly one value
+    column, named after the sample. Instead of merging the frames one at a
+    time, the (feature, sample, value) triplets of all the frames are
+    collected, the feature keys are factorized once and the values are
+    placed in a single array. Missing entries are filled with 0 and keys
+    repeated within the same sample are summed. Missing (NaN) keys are kept
+    as a feature of their own, sorted last, as with the merge on the keys.
+
+    `features` is an optional list of additional keys that must appear as
+    rows even if no sample reports them.
+    """
+    samples, values, codes, uniques = index_sample_frames(list_dfs, pivot, features)
+    n_features = len(uniques)
+
+    # one sample column at a time: the whole float64 array is never allocated
+    columns = []
+    filled = np.zeros(len(samples), dtype=np.int64)
+
+    start = 0
+    for j, v in enumerate(values):
+        end = start + len(v)
+        rows = codes[start:end]
+        valid = rows >= 0
+        col = np.bincount(rows[valid], weights=v.to_numpy(dtype=np.float64, na_value=np.nan)[valid], minlength=n_features)
+        columns.append(col.astype(np.float64, copy=False))
+        filled[j] = len(np.unique(rows[valid]))
+        start = end
+
+    return matrix_frame(uniques, samples, columns, filled, [v.dtype for v in values])
+
+
+def compose_long_matrix(df, pivot, sample_col, value_col, samples, features=None):
+    """
+    Build the feature x sample table from a single long frame with the key
+    column(s) in `pivot`, the sample of each row in `sample_col` and the
+    values in `value_col`. It follows the same rules of
+    compose_sample_matrix, with columns in the order of `samples`.
+    """
+    keys = [pivot] if isinstance(pivot, str) else list(pivot)
+
+    all_keys = df.loc[:, keys]
+    if features is not None:
+        all_keys = pd.concat([all_keys, pd.DataFrame(list(features), columns=keys)], ignore_index=True)
+
+    codes, uniques = factorize_keys(all_keys, keys)
+    n_features = len(uniques)
+
+    rows = codes[:len(df)]
+    cols = pd.Categorical(df[sample_col], categories=samples).codes
+    values = df[value_col].to_numpy(dtype=np.float64, na_value=np.nan)
+    valid = (rows >= 0) & (cols >= 0)
+
+    matrix = np.zeros((n_features, len(samples)), dtype=np.float64)
+    np.add.at(matrix, (rows[valid], cols[valid]), values[valid])
+
+    cells = np.unique(rows[valid].astype(np.int64) * len(samples) + cols[valid])
+    filled = np.bincount(cells % len(samples), minlength=len(samples)) if len(samples) > 0 else np.zeros(0, dtype=np.int64)
+
+    return matrix_frame(uniques, samples, list(matrix.T), filled, [df[value_col].dtype] * len(samples))
+
+
+def matrix_frame(uniques, samples, columns, filled, dtypes):
+    n_features = len(uniques)
+
+    final = uniques.reset_index(drop=True)
+    data = {}
+    for j, (s, dtype) in enumerate(zip(samples, dtypes)):
+        col = columns[j]
+        # a sample reporting every feature keeps an integer dtype,
+        # as it happened with the left merge on the sorted key frame
+        if filled[j] == n_features and pd.api.types.is_integer_dtype(dtype):
+            col = lean_array(col.astype(np.int64))
+        data[s] = np.nan_to_num(col, nan=0, copy=False) if col.dtype.kind == "f" else col
+
+    final = pd.concat([final, pd.DataFrame(data, index=final.index)], axis=1)
+    return final
+
+
+def compose_feature_matrix(list_dfs, pivot, additional_info):
+    # high-cardinality functional tables can be kept sparse on request
+    if additional_info.get("sparse_output", False):
+        return compose_sparse_matrix(list_dfs, pivot)
+
+    return compose_sample_matrix(list_dfs, pivot)
+
+
+def compose_sparse_matrix(list_dfs, pivot, features=None):
+    """
+    Same as compose_sample_matrix, but the values are kept in coordinate
+    format and the dense feature x sample array is never allocated.
+
+    Returns a dict with the `features` frame (row labels), the list of
+    `samples` (column labels) and the `row`, `col` and `data` arrays of the
+    non-zero entries.
+    """
+    samples, values, codes, uniques = index_sample_frames(list_dfs, pivot, features)
+
+    rows = []
+    cols = []
+    data = []
+
+    start = 0
+    for j, v in enumerate(values):
+        end = start + len(v)
+        r = codes[start:end]
+        x = v.to_numpy(dtype=np.float64, na_value=np.nan)
+        valid = (r >= 0) & ~np.isnan(x)
+        rows.append(r[valid])
+        cols.append(np.full(valid.sum(), j, dtype=np.int64))
+        data.append(x[valid])
+        start = end
+
+    row = np.concatenate(rows) if len(rows) > 0 else np.zeros(0, dtype=np.int64)
+    col = np.concatenate(cols) if len(cols) > 0 else np.zeros(0, dtype=np.int64)
+    val = np.concatenate(data) if len(data) > 0 else np.zeros(0, dtype=np.float64)
+
+    # keys repeated within the same sample are summed, as in the dense table
+    n_samples = max(1, len(samples))
+    flat = row * n_samples + col
+    order = np.argsort(flat, kind="stable")
+    flat, val = flat[order], val[order]
+    unique_flat, first = np.unique(flat, return_index=True)
+    val = np.add.reduceat(val, first) if len(val) > 0 else val
+
+    nonzero = val != 0
+    unique_flat, val = unique_flat[nonzero], val[nonzero]
+
+    return {
+        "features": uniques.reset_index(drop=True),
+        "samples": samples,
+        "row": unique_flat // n_samples,
+        "col": unique_flat % n_samples,
+        "data": val,
+    }
+
+
+def index_sample_frames(list_dfs, pivot, features):
+    keys = [pivot] if isinstance(pivot, str) else list(pivot)
+
+    samples, codes_keys, values = collect_triplets(list_dfs, keys)
+
+    all_keys = pd.concat(codes_keys, ignore_index=True) if len(codes_keys) > 0 else pd.DataFrame(columns=keys)
+    if features is not None:
+        extra = pd.DataFrame(list(features), columns=keys)
+        all_keys = pd.concat([all_keys, extra], ignore_index=True)
+
+    codes, uniques = factorize_keys(all_keys, keys)
+    return samples, values, codes, uniques
+
+
+def collect_triplets(list_dfs, keys):
+    samples = []
+    codes_keys = []
+    values = []
+
+    for x in list_dfs:
+        value_cols = [c for c in x.columns if c not in keys]
+        if len(value_cols) != 1:
+            raise ValueError(f"Expected one value column besides {keys}, found {value_cols}")
+        s = value_cols[0]
+
+        samples.append(s)
+        codes_keys.append(x.loc[:, keys])
+        values.append(x[s])
+
+    return samples, codes_keys, values
+
+
+def factorize_keys(all_keys, keys):
+    if len(keys) == 1:
+        codes, uniques = pd.factorize(all_keys[keys[0]], sort=True)
+
+        # NaN keys get the code -1: they become the last feature, as the
+        # MultiIndex does with several keys
+        missing = codes < 0
+        if missing.any():
+            codes = np.where(missing, len(uniques), codes)
+            uniques = pd.Index(uniques).insert(len(uniques), np.nan)
+
+        return codes, pd.DataFrame({keys[0]: uniques})
+
+    mindex = pd.MultiIndex.from_frame(all_keys)
+    codes, uniques = mindex.factorize(sort=True)
+    return codes, pd.DataFrame(list(uniques), columns=keys)
@@ -0,0 +1,166 @@
+"""
+Timing and memory instrumentation of the gathering (geomosaic gather
+--profile), for each package and for each sample parsed by the loader.
+"""
+import os
+import sys
+import json
+import time
+import resource
+import pandas as pd
+from geomosaic._utils import GEOMOSAIC_NOTE
+
+
+PROFILE_COLUMNS = ["level", "package", "step", "sample", "wall_s", "cpu_s", "peak_rss_mb", "bytes_read"]
+
+
+def run_gathering(function, pckg, config_file, geomosaic_wdir, output_gather_folder, additional_info):
+    """
+    Run the gathering of a package. With profiling enabled, returns the
+    record of the package, with the records of its samples in "samples".
+    """
+    if not additional_info.get("profile", False):
+        function(config_file, geomosaic_wdir, output_gather_folder, additional_info)
+        return None
+
+    info = dict(additional_info, profile_samples=[], profile_peak=[0])
+
+    reset_peak_rss()
+    start = usage_snapshot()
+
+    function(config_file, geomosaic_wdir, output_gather_folder, info)
+
+    end = usage_snapshot()
+    fold_peak_rss(info)
+
+    samples = info["profile_samples"]
+    for record in samples:
+        record["package"] = pckg
+
+    bytes_read = end["rchar"] - start["rchar"] if start["rchar"] is not None else sum(r["bytes_read"] for r in samples)
+
+    return {
+        "level": "package",
+        "package": pckg,
+        "step": None,
+        "sample": None,
+        "wall_s": round(end["wall"] - start["wall"], 3),
+        "cpu_s": round(end["cpu"] - start["cpu"], 3),
+        "peak_rss_mb": round(info["profile_peak"][0] / 2**20, 1),
+        "bytes_read": bytes_read,
+        "samples": samples,
+    }
+
+
+def profile_sample(additional_info, step, key, size, load, exclusive):
+    """
+    Run `load()` for a sample and record its wall time, CPU time of the
+    thread and size of its files. When the sample is the only one being
+    loaded (`exclusive`), also its peak RSS.
+    """
+    records = additional_info.get("profile_samples", None)
+    if records is None:
+        return load()
+
+    if exclusive:
+        fold_peak_rss(additional_info)
+        reset_peak_rss()
+
+    wall = time.perf_counter()
+    cpu = time.thread_time()
+
+    data = load()
+
+    record = {
+        "level": "sample",
+        "package": None,
+        "step": step,
+        "sample": key,
+        "wall_s": round(time.perf_counter() - wall, 3),
+        "cpu_s": round(time.thread_time() - cpu, 3),
+        "peak_rss_mb": round(peak_rss() / 2**20, 1) if exclusive else None,
+        "bytes_read": size,
+    }
+    records.append(record)
+
+    return data
+
+
+def usage_snapshot():
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    return {
+        "wall": time.perf_counter(),
+        "cpu": self_usage.ru_utime + self_usage.ru_stime + children.ru_utime + children.ru_stime,
+        "rchar": read_chars(),
+    }
+
+
+def read_chars():
+    # bytes read by the process (Linux only)
+    try:
+        with open("/proc/self/io") as fd:
+            for line in fd:
+                if line.startswith("rchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+
+    return None
+
+
+def peak_rss():
+    # bytes; VmHWM can be reset on Linux, ru_maxrss is the peak since the start
+    try:
+        with open("/proc/self/status") as fd:
+            for line in fd:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def reset_peak_rss():
+    try:
+        with open("/proc/self/clear_refs", "w") as fd:
+            fd.write("5")
+    except OSError:
+        pass
+
+
+def fold_peak_rss(additional_info):
+    # keep the peak of the package across the resets done for its samples
+    additional_info["profile_peak"][0] = max(additional_info["profile_peak"][0], peak_rss())
+
+
+def write_profile(profiles, output_gather_folder, top):
+    """
+    Write gather_profile.json and gather_profile.tsv in the gathering
+    folder and print the `top` packages and samples by wall time.
+    """
+    packages = [{k: v for k, v in p.items() if k != "samples"} for p in profiles]
+    samples = [s for p in profiles for s in p["samples"]]
+
+    json_file = os.path.join(output_gather_folder, "gather_profile.json")
+    with open(json_file, "wt") as fd:
+        json.dump({"packages": packages, "samples": samples}, fd, indent=1)
+
+    df = pd.DataFrame(packages + samples, columns=PROFILE_COLUMNS)
+    df.to_csv(os.path.join(output_gather_folder, "gather_profile.tsv"), sep="\t", header=True, index=False)
+
+    print(f"\n{GEOMOSAIC_NOTE}: gathering profile written in {json_file} (and .tsv)")
+
+    top_packages = df[df["level"] == "package"].sort_values("wall_s", ascending=False).head(top)
+    print(f"Top {len(top_packages)} packages by wall time:")
+    for _, r in top_packages.iterrows():
+        print(f"  {r['package']:<16} {r['wall_s']:>10.2f} s  cpu {r['cpu_s']:>10.2f} s  peak {r['peak_rss_mb']:>9.1f} MB  read {r['bytes_read'] / 2**20:>10.1f} MB")
+
+    top_samples = df[df["level"] == "sample"].sort_values("wall_s", ascending=False).head(top)
+    if len(top_samples) > 0:
+        print(f"Top {len(top_samples)} samples by wall time:")
+        for _, r in top_samples.iterrows():
+            print(f"  {r['package']:<16} {r['step']:<32} {r['sample']:<20} {r['wall_s']:>8.2f} s  read {r['bytes_read'] / 2**20:>10.1f} MB")
@@ -0,0 +1,194 @@
+"""
+Index of the result folders of a geomosaic working directory, built with a
+single scandir crawl at the start of the gathering and queried by the
+gatherers in place of listdir/stat calls on the filesystem.
+"""
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+
+def scan_project(geomosaic_wdir, samples, result_folders, workers=1):
+    """
+    Crawl the folder of each sample. All its entries are indexed by name,
+    while the `result_folders` (e.g. 'kraken2', 'mags_recognizer') are
+    crawled recursively recording size and mtime of their files.
+
+    The index is {"wdir": ..., "samples": {sample: tree}, "folders": {sample:
+    {folder: mtime}}}, where a tree maps the name of each entry to a sub-tree
+    for crawled folders, to [size, mtime] for their files, and to None for
+    entries not crawled, and "folders" records the mtime of the sample folder
+    ('.') and of the crawled folders. Sample folders are crawled by `workers`
+    threads.
+    """
+    result_folders = set(result_folders)
+
+    def scan(s):
+        sample_folder = os.path.join(geomosaic_wdir, s)
+        if not os.path.isdir(sample_folder):
+            return s, None, None
+
+        tree = {}
+        mtimes = {".": os.stat(sample_folder).st_mtime}
+        with os.scandir(sample_folder) as it:
+            for entry in it:
+                if entry.name in result_folders and entry.is_dir():
+                    tree[entry.name] = scan_tree(entry.path, mtimes, entry.name)
+                else:
+                    tree[entry.name] = None
+
+        return s, tree, mtimes
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        scanned = list(executor.map(scan, samples))
+
+    return {
+        "wdir": os.path.abspath(geomosaic_wdir),
+        "samples": {s: tree for s, tree, _ in scanned if tree is not None},
+        "folders": {s: mtimes for s, tree, mtimes in scanned if tree is not None},
+    }
+
+
+def scan_tree(folder, mtimes, rel):
+    tree = {}
+    mtimes[rel] = os.stat(folder).st_mtime
+    with os.scandir(folder) as it:
+        for entry in it:
+            if entry.is_dir():
+                tree[entry.name] = scan_tree(entry.path, mtimes, os.path.join(rel, entry.name))
+            else:
+                st = entry.stat()
+                tree[entry.name] = [st.st_size, st.st_mtime]
+
+    return tree
+
+
+def update_project_index(project_index, geomosaic_wdir, samples, result_folders, workers=1):
+    """
+    Crawl again the samples of a saved index that are new, or whose folder or
+    crawled folders changed since the index was built (added or removed
+    entries change the mtime of a folder), or with a result folder that was
+    not crawled. Returns the list of the crawled samples.
+    """
+    if project_index.get("wdir", None) != os.path.abspath(geomosaic_wdir) or "folders" not in project_index:
+        project_index.update(scan_project(geomosaic_wdir, samples, result_folders, workers))
+        return list(samples)
+
+    def changed(s):
+        tree = project_index["samples"].get(s, None)
+        mtimes = project_index["folders"].get(s, None)
+        if tree is None or mtimes is None:
+            return os.path.isdir(os.path.join(geomosaic_wdir, s))
+
+        for rel, mtime in mtimes.items():
+            try:
+                if os.stat(os.path.join(geomosaic_wdir, s, rel)).st_mtime != mtime:
+                    return True
+            except FileNotFoundError:
+                return True
+
+        return any(rf in tree and tree[rf] is None and os.path.isdir(os.path.join(geomosaic_wdir, s, rf)) for rf in result_folders)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        stale = [s for s, c in zip(samples, executor.map(changed, samples)) if c]
+
+    if len(stale) > 0:
+        rescanned = scan_project(geomosaic_wdir, stale, result_folders, workers)
+        for s in stale:
+            project_index["samples"].pop(s, None)
+            project_index["folders"].pop(s, None)
+        project_index["samples"].update(rescanned["samples"])
+        project_index["folders"].update(rescanned["folders"])
+
+    return stale
+
+
+def indexed_entry(path, additional_info):
+    # node of the index for `path`, None when the index does not cover it
+    project_index = additional_info.get("project_index", None) if additional_info is not None else None
+    if project_index is None:
+        return None
+
+    rel = os.path.relpath(os.path.abspath(path), project_index["wdir"])
+    parts = [p for p in rel.split(os.sep) if p not in ["", "."]]
+    if len(parts) == 0 or parts[0] == "..":
+        return None
+
+    node = project_index["samples"].get(parts[0], None)
+    for name in parts[1:]:
+        if not isinstance(node, dict) or name not in node:
+            return None
+        node = node[name]
+
+    return node
+
+
+def list_folder(folder, additional_info=None):
+    """
+    Names of the entries of `folder`, from the project index when the
+    folder was crawled, otherwise from os.listdir.
+    """
+    node = indexed_entry(folder, additional_info)
+    if isinstance(node, dict):
+        return list(node)
+
+    return os.listdir(folder)
+
+
+def file_stat(path, additional_info=None):
+    """
+    (size, mtime) of a file, from the project index when available.
+    """
+    node = indexed_entry(path, additional_info)
+    if isinstance(node, list):
+        return node[0], node[1]
+
+    st = os.stat(path)
+    return st.st_size, st.st_mtime
+
+
+def indexed_folder(folder, additional_info=None):
+    """
+    Indexed tree of `folder` (see scan_project), None when the project
+    index does not cover it.
+    """
+    node = indexed_entry(folder, additional_info)
+
+    return node if isinstance(node, dict) else None
+
+
+def write_project_index(project_index, filename):
+    tmp_file = f"{filename}.tmp"
+    with open(tmp_file, "wt") as fd:
+        json.dump(project_index, fd)
+
+    os.replace(tmp_file, filename)
+
+
+def read_project_index(filename):
+    """
+    Index saved by write_project_index, None when the file cannot be read or
+    does not have the structure of an index.
+    """
+    try:
+        with open(filename) as fd:
+            project_index = json.load(fd)
+    except (OSError, ValueError):
+        return None
+
+    if not isinstance(project_index, dict) or not isinstance(project_index.get("wdir", None), str):
+        return None
+
+    samples = project_index.get("samples", None)
+    folders = project_index.get("folders", None)
+    if not isinstance(samples, dict) or not isinstance(folders, dict):
+        return None
+
+    if not all(isinstance(tree, dict) for tree in samples.values()):
+        return None
+
+    for mtimes in folders.values():
+        if not isinstance(mtimes, dict) or not all(isinstance(m, (int, float)) for m in mtimes.values()):
+            return None
+
+    return project_index
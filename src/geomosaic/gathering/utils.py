@@ -1,7 +1,9 @@
 import yaml
+import pandas as pd
 from geomosaic._utils import GEOMOSAIC_ERROR
 import os
 from subprocess import check_call
+from geomosaic.gathering.scan import list_folder, indexed_folder
 
 
 def essential_data_config(gmsetup, path_gathering):
@@ -23,10 +25,59 @@ def essential_data_config(gmsetup, path_gathering):
     return geomosaic_samples, geomosaic_gathering
 
 
-def get_sample_with_results(result_folder, geomosaic_wdir, all_samples):
+def get_sample_with_results(result_folder, geomosaic_wdir, all_samples, additional_info=None):
     true_samples = []
     for s in all_samples:
-        if result_folder in os.listdir(os.path.join(geomosaic_wdir, s)): 
+        if result_folder in list_folder(os.path.join(geomosaic_wdir, s), additional_info): 
             true_samples.append(s)
     
     return true_samples
+
+
+def scan_mag_folders(results_folder, additional_info=None):
+    """
+    List in a single pass the 'mag_*' folders of a sample result folder
+    and the files they contain, as {mag: set of file names} in directory
+    order. The project index is used when it covers the folder.
+    """
+    tree = indexed_folder(results_folder, additional_info)
+    if tree is not None:
+        return {name: set(node) for name, node in tree.items() if name.startswith("mag_") and isinstance(node, dict)}
+
+    mags = {}
+    with os.scandir(results_folder) as it:
+        for entry in it:
+            if entry.name.startswith("mag_") and entry.is_dir():
+                with os.scandir(entry.path) as mag_it:
+                    mags[entry.name] = set(e.name for e in mag_it)
+
+    return mags
+
+
+GTDB_RANKS = {"domain": "d", "phylum": "p", "class": "c", "order": "o", "family": "f", "genus": "g", "species": "s"}
+
+
+def split_gtdb_classification(classification):
+    """
+    Decode a Series of GTDB-Tk classification strings
+    ('d__Bacteria;p__...;s__...') in a frame with one column per rank.
+    Ranks are recognized by their prefix; missing or empty ranks are ''.
+    """
+    if len(classification) == 0:
+        return pd.DataFrame(index=classification.index, columns=list(GTDB_RANKS), dtype=object)
+
+    tokens = classification.astype(str).str.split(";", expand=True).stack()
+    tokens = tokens[tokens.str[1:3] == "__"]
+
+    decoded = pd.DataFrame({
+        "row": tokens.index.get_level_values(0),
+        "prefix": tokens.str[0].to_numpy(),
+        "info": tokens.str[3:].to_numpy(),
+    })
+    decoded = decoded.drop_duplicates(subset=["row", "prefix"], keep="last")
+
+    ranks = decoded.pivot(index="row", columns="prefix", values="info")
+    ranks = ranks.reindex(index=classification.index, columns=list(GTDB_RANKS.values())).fillna("")
+    ranks.columns = list(GTDB_RANKS)
+
+    return ranks
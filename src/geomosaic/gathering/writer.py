@@ -0,0 +1,220 @@
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from subprocess import check_call
+
+
+GATHER_FORMATS = {
+    "tsv": ".tsv",
+    "parquet": ".parquet",
+    "feather": ".feather",
+}
+
+
+def write_table(df, path, additional_info):
+    """
+    Write a gathered table in the output format chosen by the user.
+
+    `path` is the name of the table with the '.tsv' extension, which is
+    replaced according to the format. Columnar formats (parquet and
+    feather) are written with zstd compression and with text columns
+    stored as strings, so that they can be loaded without parsing.
+    """
+    if isinstance(df, dict):
+        return write_sparse_table(df, path)
+
+    fmt = additional_info.get("output_format", "tsv")
+    output_path = table_path(path, fmt)
+
+    if fmt == "tsv":
+        df.to_csv(output_path, sep="\t", header=True, index=False)
+    elif fmt == "parquet":
+        typed_table(df).to_parquet(output_path, index=False, compression="zstd")
+    else:
+        assert fmt == "feather"
+        typed_table(df).to_feather(output_path, compression="zstd")
+
+    return output_path
+
+
+def write_table_stream(frames, path, columns, additional_info):
+    """
+    Write the frames yielded by `frames` as a single table, one frame at a
+    time, as pd.concat(frames) would do with the given `columns`: the
+    header is written once and each frame is appended as soon as it is
+    available. The frames are first spooled to disk, so that the column
+    types can be promoted across all of them as pd.concat does (integers
+    and floats to float64 and, in columnar formats, mixed types to
+    strings), and then written as text, in row groups (parquet) or in
+    record batches (feather).
+    """
+    fmt = additional_info.get("output_format", "tsv")
+    output_path = table_path(path, fmt)
+
+    if fmt == "tsv":
+        return write_text_stream(frames, output_path, columns)
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    spool_folder = f"{output_path}.tmp.{os.getpid()}"
+    check_call(f"mkdir -p {spool_folder}", shell=True)
+
+    try:
+        spooled = []
+        schema = None
+        for df in frames:
+            # frames without rows (e.g. a header-only sample) do not take part in the schema
+            if len(df) == 0:
+                continue
+
+            table = pa.Table.from_pandas(typed_table(df.reindex(columns=columns)), preserve_index=False)
+            table = table.replace_schema_metadata()
+            schema = table.schema if schema is None else promoted_schema(schema, table.schema)
+
+            spool_file = os.path.join(spool_folder, f"{len(spooled)}.arrow")
+            with pa.ipc.new_file(spool_file, table.schema) as spool:
+                spool.write_table(table)
+            spooled.append(spool_file)
+
+        if schema is None:
+            return write_table(pd.DataFrame(columns=columns), path, additional_info)
+
+        if fmt == "parquet":
+            writer = pq.ParquetWriter(output_path, schema, compression="zstd")
+        else:
+            assert fmt == "feather"
+            writer = pa.ipc.new_file(output_path, schema, options=pa.ipc.IpcWriteOptions(compression="zstd"))
+
+        with writer:
+            for spool_file in spooled:
+                with pa.memory_map(spool_file) as source:
+                    writer.write_table(pa.ipc.open_file(source).read_all().cast(schema))
+    finally:
+        shutil.rmtree(spool_folder, ignore_errors=True)
+
+    return output_path
+
+
+def write_text_stream(frames, output_path, columns):
+    spool_folder = f"{output_path}.tmp.{os.getpid()}"
+    check_call(f"mkdir -p {spool_folder}", shell=True)
+
+    try:
+        spooled = []
+        kinds = {c: set() for c in columns}
+        for df in frames:
+            df = df.reindex(columns=columns)
+            for c in columns:
+                kinds[c].add(df[c].dtype.kind)
+
+            spool_file = os.path.join(spool_folder, f"{len(spooled)}.pkl")
+            df.to_pickle(spool_file)
+            spooled.append(spool_file)
+
+        # integer columns are written as floats (3.0) when another frame has floats in the same column
+        floats = [c for c in columns if "f" in kinds[c] and kinds[c] <= set("iuf")]
+
+        with open(output_path, "wt") as fd:
+            pd.DataFrame(columns=columns).to_csv(fd, sep="\t", header=True, index=False)
+            for spool_file in spooled:
+                df = pd.read_pickle(spool_file)
+                df = df.astype({c: np.float64 for c in floats if df[c].dtype.kind in "iu"})
+                df.to_csv(fd, sep="\t", header=False, index=False)
+    finally:
+        shutil.rmtree(spool_folder, ignore_errors=True)
+
+    return output_path
+
+
+def promoted_schema(schema, other):
+    # the column types of the concatenation of two tables with the same columns
+    import pyarrow as pa
+
+    fields = []
+    for a, b in zip(schema, other):
+        if a.type == b.type or pa.types.is_null(b.type):
+            t = a.type
+        elif pa.types.is_null(a.type):
+            t = b.type
+        elif pa.types.is_integer(a.type) and pa.types.is_integer(b.type):
+            t = pa.int64()
+        elif (pa.types.is_integer(a.type) or pa.types.is_floating(a.type)) and (pa.types.is_integer(b.type) or pa.types.is_floating(b.type)):
+            t = pa.float64()
+        else:
+            t = pa.large_string()
+        fields.append(pa.field(a.name, t))
+
+    return pa.schema(fields)
+
+
+def write_sparse_table(matrix, path):
+    """
+    Write a table built by compose_sparse_matrix as a compressed '.npz'
+    with the coordinates of the non-zero values, which can also be opened
+    with scipy.sparse.load_npz, and two label sidecars: '.features.tsv'
+    (rows) and '.samples.tsv' (columns).
+    """
+    base, _ = os.path.splitext(path)
+    output_path = f"{base}.npz"
+
+    np.savez_compressed(output_path,
+        row=matrix["row"], col=matrix["col"], data=matrix["data"],
+        shape=np.array([len(matrix["features"]), len(matrix["samples"])]),
+        format=np.array("coo")
+    )
+    matrix["features"].to_csv(f"{base}.features.tsv", sep="\t", header=True, index=False)
+    pd.DataFrame({"sample": matrix["samples"]}).to_csv(f"{base}.samples.tsv", sep="\t", header=True, index=False)
+
+    return output_path
+
+
+def read_sparse_table(path):
+    """
+    Load a table written by write_sparse_table (given the '.npz' file or
+    the name of the table) as a DataFrame with the feature label columns
+    followed by one sparse column per sample, with 0 as fill value.
+    """
+    features, samples, row, col, data = read_sparse_parts(path)
+
+    order = np.argsort(col, kind="stable")
+    row, col, data = row[order], col[order], data[order]
+    bounds = np.searchsorted(col, np.arange(len(samples) + 1))
+
+    columns = {}
+    for j, s in enumerate(samples):
+        values = np.zeros(len(features), dtype=data.dtype)
+        values[row[bounds[j]:bounds[j+1]]] = data[bounds[j]:bounds[j+1]]
+        columns[s] = pd.arrays.SparseArray(values, fill_value=0)
+
+    return pd.concat([features, pd.DataFrame(columns, index=features.index)], axis=1)
+
+
+def read_sparse_parts(path):
+    # row labels, column labels and coordinates of a sparse table
+    base, _ = os.path.splitext(path)
+
+    features = pd.read_csv(f"{base}.features.tsv", sep="\t", dtype=str, keep_default_na=False)
+    samples = pd.read_csv(f"{base}.samples.tsv", sep="\t", dtype=str, keep_default_na=False)["sample"].tolist()
+
+    with np.load(f"{base}.npz") as npz:
+        row, col, data = npz["row"], npz["col"], npz["data"]
+
+    return features, samples, row, col, data
+
+
+def table_path(path, fmt):
+    base, _ = os.path.splitext(path)
+    return f"{base}{GATHER_FORMATS[fmt]}"
+
+
+def typed_table(df):
+    typed = df.reset_index(drop=True)
+    typed.columns = [str(c) for c in typed.columns]
+
+    for c in typed.columns:
+        if typed[c].dtype == object:
+            typed[c] = typed[c].astype("string")
+
+    return typed
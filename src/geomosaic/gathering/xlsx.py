@@ -0,0 +1,266 @@
+"""
+Streaming reader for the first sheet of xlsx workbooks (e.g. the DRAM
+metabolism_summary.xlsx), much faster than pd.read_excel with openpyxl.
+"""
+import posixpath
+import zipfile
+import numpy as np
+import pandas as pd
+from xml.etree.ElementTree import iterparse, fromstring
+from openpyxl.styles.numbers import BUILTIN_FORMATS, is_date_format
+
+
+MAIN_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+DOC_REL_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+PKG_REL_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+
+def read_first_sheet(filename):
+    """
+    Same result of pd.read_excel(filename) for the first worksheet. The
+    XML of the sheet is parsed as a stream of plain values, converted as
+    pandas does with openpyxl, and then typed column by column as the parser
+    of pd.read_excel does. Sheets with date cells are left to pd.read_excel.
+    """
+    with zipfile.ZipFile(filename) as zf:
+        date_styles = date_style_ids(zf)
+        strings = shared_strings(zf)
+
+        with zf.open(first_sheet_path(zf)) as fd:
+            data = sheet_rows(fd, strings, date_styles)
+
+    if data is None:
+        return pd.read_excel(filename)
+
+    # as pandas: trim trailing empty cells and rows, then pad the rows
+    for row in data:
+        while row and row[-1] == "":
+            row.pop()
+
+    while len(data) > 0 and len(data[-1]) == 0:
+        data.pop()
+
+    if len(data) > 0:
+        max_width = max(len(row) for row in data)
+        data = [row + [""] * (max_width - len(row)) for row in data]
+
+    if len(data) == 0:
+        return pd.DataFrame()
+
+    columns = [typed_column([row[i] for row in data[1:]]) for i in range(len(data[0]))]
+    df = pd.concat(columns, axis=1, ignore_index=True) if len(columns) > 0 else pd.DataFrame(index=range(len(data) - 1))
+    df.columns = header_names(data[0])
+
+    return df
+
+
+# default na_values of the pandas parsers
+NA_STRINGS = {"", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+              "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null"}
+
+
+def typed_column(values):
+    # as pd.read_excel: missing values, then booleans, numbers (also from numeric text and booleans with missing values) or text
+    if len(values) == 0:
+        return pd.Series(values, dtype=object)
+
+    values = [np.nan if isinstance(v, str) and v in NA_STRINGS else v for v in values]
+    if all(isinstance(v, bool) for v in values):
+        return pd.Series(values, dtype=bool)
+
+    try:
+        return pd.to_numeric(pd.Series(values, dtype=object))
+    except (ValueError, TypeError):
+        return pd.Series(values).infer_objects()
+
+
+def header_names(header):
+    # empty names become 'Unnamed: i' and duplicated names get a '.N' suffix, as pd.read_excel does
+    names = [f"Unnamed: {i}" if v == "" else v for i, v in enumerate(header)]
+    unnamed = [i for i, v in enumerate(header) if v == ""]
+
+    counts = {}
+    for i in [i for i in range(len(names)) if i not in unnamed] + unnamed:
+        col = names[i]
+        cur_count = counts.get(col, 0)
+
+        while cur_count > 0:
+            counts[names[i]] = cur_count + 1
+            col = f"{names[i]}.{cur_count}"
+            cur_count = cur_count + 1 if col in names else counts.get(col, 0)
+
+        names[i] = col
+        counts[col] = cur_count + 1
+
+    return names
+
+
+def sheet_rows(fd, strings, date_styles):
+    # returns None when a cell needs the full openpyxl conversion (dates)
+    data = []
+    row = {}
+    columns = {}
+
+    for _, elem in iterparse(fd, events=("end",)):
+        tag = elem.tag
+
+        if tag == f"{MAIN_NS}c":
+            ref = elem.get("r")
+            if ref is None:
+                col = max(row) + 1 if len(row) > 0 else 0
+            else:
+                letters = ref.rstrip("0123456789")
+                if letters not in columns:
+                    columns[letters] = column_index(letters)
+                col = columns[letters]
+
+            value = cell_value(elem, strings, date_styles)
+            if value is DATE_CELL:
+                return None
+
+            row[col] = value
+
+        elif tag == f"{MAIN_NS}row":
+            r = elem.get("r")
+            if r is not None:
+                # rows without any cell are not written in the sheet
+                data.extend([] for _ in range(int(r) - 1 - len(data)))
+
+            data.append([row.get(i, "") for i in range(max(row) + 1)] if len(row) > 0 else [])
+            row = {}
+            elem.clear()
+
+    return data
+
+
+DATE_CELL = object()
+
+
+def cell_value(elem, strings, date_styles):
+    cell_type = elem.get("t", "n")
+    v = elem.find(f"{MAIN_NS}v")
+    text = v.text if v is not None else None
+
+    if cell_type == "inlineStr":
+        inline = elem.find(f"{MAIN_NS}is")
+        return string_text(inline) if inline is not None else ""
+
+    if cell_type == "d":
+        return DATE_CELL
+
+    if text is None:
+        return ""
+
+    if cell_type == "s":
+        return strings[int(text)]
+    if cell_type == "str":
+        return text
+    if cell_type == "b":
+        return bool(int(text))
+    if cell_type == "e":
+        return np.nan
+
+    if elem.get("s", "0") in date_styles:
+        return DATE_CELL
+
+    if "." in text or "E" in text or "e" in text:
+        value = float(text)
+        return int(value) if value.is_integer() else value
+
+    return int(text)
+
+
+def column_index(letters):
+    index = 0
+    for c in letters:
+        index = index * 26 + (ord(c) - ord("A") + 1)
+
+    return index - 1
+
+
+def string_text(elem):
+    # plain or rich text, without the phonetic runs
+    t = elem.find(f"{MAIN_NS}t")
+    if t is not None:
+        return t.text or ""
+
+    return "".join(t.text or "" for r in elem.findall(f"{MAIN_NS}r") for t in r.findall(f"{MAIN_NS}t"))
+
+
+def shared_strings(zf):
+    path = part_path(zf, "sharedStrings")
+    if path is None:
+        return []
+
+    strings = []
+    with zf.open(path) as fd:
+        for _, elem in iterparse(fd, events=("end",)):
+            if elem.tag == f"{MAIN_NS}si":
+                strings.append(string_text(elem))
+                elem.clear()
+
+    return strings
+
+
+def date_style_ids(zf):
+    path = part_path(zf, "styles")
+    if path is None:
+        return set()
+
+    styles = fromstring(zf.read(path))
+
+    formats = dict(BUILTIN_FORMATS)
+    for fmt in styles.iter(f"{MAIN_NS}numFmt"):
+        formats[int(fmt.get("numFmtId"))] = fmt.get("formatCode")
+
+    date_styles = set()
+    cell_xfs = styles.find(f"{MAIN_NS}cellXfs")
+    if cell_xfs is not None:
+        for i, xf in enumerate(cell_xfs.findall(f"{MAIN_NS}xf")):
+            code = formats.get(int(xf.get("numFmtId", 0)), None)
+            if code is not None and is_date_format(code):
+                date_styles.add(str(i))
+
+    return date_styles
+
+
+def first_sheet_path(zf):
+    workbook = fromstring(zf.read(workbook_path(zf)))
+    rels = workbook_rels(zf)
+
+    for sheet in workbook.iter(f"{MAIN_NS}sheet"):
+        rel_type, target = rels[sheet.get(f"{DOC_REL_NS}id")]
+        if rel_type.endswith("/worksheet"):
+            return target
+
+    raise ValueError("Worksheet index 0 is invalid, 0 worksheets found")
+
+
+def part_path(zf, kind):
+    for rel_type, target in workbook_rels(zf).values():
+        if rel_type.endswith(f"/{kind}"):
+            return target
+
+    return None
+
+
+def workbook_path(zf):
+    rels = fromstring(zf.read("_rels/.rels"))
+    for rel in rels.iter(f"{PKG_REL_NS}Relationship"):
+        if rel.get("Type").endswith("/officeDocument"):
+            return rel.get("Target").lstrip("/")
+
+    return "xl/workbook.xml"
+
+
+def workbook_rels(zf):
+    base = posixpath.dirname(workbook_path(zf))
+    rels_path = posixpath.join(base, "_rels", f"{posixpath.basename(workbook_path(zf))}.rels")
+
+    rels = {}
+    for rel in fromstring(zf.read(rels_path)).iter(f"{PKG_REL_NS}Relationship"):
+        target = rel.get("Target")
+        target = target.lstrip("/") if target.startswith("/") else posixpath.normpath(posixpath.join(base, target))
+        rels[rel.get("Id")] = (rel.get("Type"), target)
+
+    return rels
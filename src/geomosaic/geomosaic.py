@@ -160,6 +160,15 @@ def main():
     gather_optional.add_argument('-u' ,'--unit', action='store_true', help="Execute geomosaic gather considering the UNIT config file.")
     gather_optional.add_argument('--assembly_hmmsearch_outfolder', required=False, default=None, type=str, help="Name of the output folder used for the 'assembly_hmm_annotation'")
     gather_optional.add_argument('--mags_hmmsearch_outfolder', required=False, default=None, type=str, help="Name of the output folder used for the 'mags_hmm_annotation'")
+    gather_optional.add_argument('-j', '--jobs', default=1, type=int, help="Number of packages to gather in parallel (one process each). The gathering of 'coverm_genome' always starts after the one of 'mags_gtdbtk'.")
+    gather_optional.add_argument('--io_workers', default=4, type=int, help="Number of threads used by each package to read the result files of the samples concurrently. The files are always aggregated in the order of the samples.")
+    gather_optional.add_argument('--io_memory', default=4, type=float, help="Maximum size (in GB, on disk) of the result files that each package can read ahead of the aggregation.")
+    gather_optional.add_argument('--format', required=False, default="tsv", type=str, choices=["tsv", "parquet", "feather"], help="Format of the gathered tables. 'parquet' and 'feather' are compressed columnar formats that load much faster in downstream analysis (e.g. pandas.read_parquet) and require the 'pyarrow' package.")
+    gather_optional.add_argument('--sparse', action='store_true', help="Write the functional tables (KEGG of eggnog_mapper, EC/KO/COG/KOG of recognizer and mags_recognizer, HMM tables of hmms_search and mags_hmmsearch) in sparse format: a '.npz' file with the non-zero values (readable with scipy.sparse.load_npz or geomosaic.gathering.writer.read_sparse_table) and the '.features.tsv' and '.samples.tsv' label files.")
+    gather_optional.add_argument('--db', required=False, default=None, type=str, help="Also export the gathered tables in this SQLite database file, in long form: a table 'abundance' (package, source, norm, sample, mag, feature, info, value) with the non-zero values, a table 'features' with the descriptions of the features, and the HMM hits, MAG taxonomy and kraken2 lineage tables. Indexes on feature and sample allow fast queries without loading the whole matrices. The tables of the gathered packages are replaced in an existing database.")
+    gather_optional.add_argument('--scan_index', required=False, default=None, type=str, help="Save in this JSON file the index of the result files (names, sizes and modification times) that geomosaic builds with a single scan of the sample folders at the start of the gathering. If the file already exists, it is used in place of a new scan, scanning again only the samples that are new or whose result folders changed (files added or removed): useful for repeated gatherings on slow network filesystems. The gathering cache always checks size and modification time of the files on the filesystem.")
+    gather_optional.add_argument('--profile', required=False, default=None, type=int, nargs="?", const=10, metavar="N", help="Record wall time, CPU time, peak RSS and bytes read of each gathered package and of each sample parsed (samples loaded from the cache are not listed), write them in 'gather_profile.json' and 'gather_profile.tsv' in the gathering folder, and print the N slowest packages and samples (default N: 10). The peak RSS of a sample is recorded only with '--io_workers 1'.")
+    gather_optional.add_argument('--no_cache', action='store_true', help="Parse again the results of every sample. Without this flag, geomosaic keeps in the gathering folder ('.gm_cache') the parsed results of each sample and the size, modification time and hash of its files, so that a new gathering parses only new or changed samples.")
 
     gather_parser.add_argument_group(GEOMOSAIC_PROMPT("Available packages for Gathering"), GEOMOSAIC_GATHER_PACKAGES_DESCRIPTION)
 
@@ -1,6 +1,8 @@
 import yaml
 import os
-from geomosaic._utils import GEOMOSAIC_ERROR, GEOMOSAIC_PROCESS, GEOMOSAIC_OK, GEOMOSAIC_NOTE, GEOMOSAIC_PROMPT, GEOMOSAIC_GATHER_PACKAGES
+import importlib.util
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from geomosaic._utils import GEOMOSAIC_ERROR, GEOMOSAIC_PROCESS, GEOMOSAIC_OK, GEOMOSAIC_NOTE, GEOMOSAIC_WARNING, GEOMOSAIC_PROMPT, GEOMOSAIC_GATHER_PACKAGES
 
 from geomosaic.gathering.gather_eggnog_mapper import gather_eggnogmapper
 from geomosaic.gathering.gather_hmms_search import gather_hmms_search
@@ -13,6 +15,9 @@ from geomosaic.gathering.gather_mags_recognizer import gather_mags_recognizer
 from geomosaic.gathering.gather_mifaser import gather_mifaser
 from geomosaic.gathering.gather_recognizer import gather_recognizer
 from geomosaic.gathering.gather_coverm_genome import gather_coverm_genome
+from geomosaic.gathering.database import export_database
+from geomosaic.gathering.scan import scan_project, update_project_index, read_project_index, write_project_index
+from geomosaic.gathering.profiling import run_gathering, write_profile
 
 
 def geo_gather(args):
@@ -22,6 +27,15 @@ def geo_gather(args):
     unit                    = args.unit
     assembly_hmm_outfolder  = args.assembly_hmmsearch_outfolder
     mags_hmm_outfolder      = args.mags_hmmsearch_outfolder
+    jobs                    = args.jobs
+    io_workers              = args.io_workers
+    io_memory               = args.io_memory
+    no_cache                = args.no_cache
+    output_format           = args.format
+    sparse_output           = args.sparse
+    db_file                 = args.db
+    scan_index              = args.scan_index
+    profile_top             = args.profile
 
     with open(gmsetup) as file:
         geomosaic_setup = yaml.load(file, Loader=yaml.FullLoader)
@@ -37,7 +51,7 @@ def geo_gather(args):
     gm_config   = str(os.path.join(geomosaic_dir, name_config))
 
     # Checks
-    some_checks(assembly_hmm_outfolder, mags_hmm_outfolder, packages)
+    some_checks(assembly_hmm_outfolder, mags_hmm_outfolder, packages, output_format)
 
     output_gather_folder = create_gathering_folder(geomosaic_dir,gather_folder)
 
@@ -51,15 +65,94 @@ def geo_gather(args):
 
     additional_info = {
         "assembly_hmmsearch_output_folder": assembly_hmm_outfolder,
-        "mags_hmmsearch_output_folder": mags_hmm_outfolder
+        "mags_hmmsearch_output_folder": mags_hmm_outfolder,
+        "io_workers": io_workers,
+        "io_memory": io_memory,
+        "gather_cache": None if no_cache else os.path.join(output_gather_folder, ".gm_cache"),
+        "output_format": output_format,
+        "sparse_output": sparse_output,
+        "profile": profile_top is not None,
     }
 
-    for pckg in user_packages:
-        if pckg == "_ALL_":
-            continue
+    user_packages = [pckg for pckg in user_packages if pckg != "_ALL_"]
 
-        print(f"{GEOMOSAIC_PROCESS}: gathering results for {pckg}...")
-        gathering[pckg](gm_config, geomosaic_dir, output_gather_folder, additional_info)
+    additional_info["project_index"] = project_index(geomosaic_dir, geomosaic_samples, user_packages, scan_index, additional_info)
+
+    profiles = []
+    if jobs <= 1:
+        for pckg in user_packages:
+            print(f"{GEOMOSAIC_PROCESS}: gathering results for {pckg}...")
+            profiles.append(run_gathering(gathering[pckg], pckg, gm_config, geomosaic_dir, output_gather_folder, additional_info))
+    else:
+        profiles = parallel_gathering(gathering, user_packages, jobs, gm_config, geomosaic_dir, output_gather_folder, additional_info)
+
+    if profile_top is not None:
+        write_profile(profiles, output_gather_folder, profile_top)
+
+    if db_file is not None:
+        print(f"{GEOMOSAIC_PROCESS}: exporting the gathered tables to the database {db_file}...")
+        export_database(db_file, output_gather_folder, user_packages, geomosaic_samples)
+
+
+def parallel_gathering(gathering, user_packages, jobs, gm_config, geomosaic_dir, output_gather_folder, additional_info):
+    dependencies = gather_dependencies()
+
+    pending = list(user_packages)
+    completed = set()
+    running = {}
+    profiles = []
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        while len(pending) > 0 or len(running) > 0:
+            for pckg in list(pending):
+                if all(d in completed or d not in user_packages for d in dependencies.get(pckg, [])):
+                    print(f"{GEOMOSAIC_PROCESS}: gathering results for {pckg}...")
+                    future = executor.submit(run_gathering, gathering[pckg], pckg, gm_config, geomosaic_dir, output_gather_folder, additional_info)
+                    running[future] = pckg
+                    pending.remove(pckg)
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                pckg = running.pop(future)
+                # re-raise any error of the gathering in the main process
+                profiles.append(future.result())
+                completed.add(pckg)
+                print(f"{GEOMOSAIC_NOTE}: gathering for {pckg} completed.")
+
+    return profiles
+
+
+def project_index(geomosaic_dir, samples, user_packages, scan_index, additional_info):
+    result_folders = {
+        "hmms_search": additional_info["assembly_hmmsearch_output_folder"],
+        "mags_hmmsearch": additional_info["mags_hmmsearch_output_folder"],
+    }
+    folders = [result_folders.get(p, p) for p in user_packages]
+
+    index = None
+    if scan_index is not None and os.path.isfile(scan_index):
+        index = read_project_index(scan_index)
+        if index is None:
+            print(f"{GEOMOSAIC_WARNING}: the index of the result files saved in {scan_index} cannot be read, the working directory is scanned again.")
+
+    if index is not None:
+        rescanned = update_project_index(index, geomosaic_dir, samples, folders, workers=additional_info["io_workers"])
+        print(f"{GEOMOSAIC_NOTE}: using the index of the result files saved in {scan_index} ({len(rescanned)} new or changed samples scanned again).")
+
+        if len(rescanned) > 0:
+            write_project_index(index, scan_index)
+
+        # files rewritten in place keep the size and mtime of the saved index: the cache checks them on the filesystem
+        index["saved"] = True
+        return index
+
+    print(f"{GEOMOSAIC_PROCESS}: scanning the result folders of the samples...")
+    index = scan_project(geomosaic_dir, samples, folders, workers=additional_info["io_workers"])
+
+    if scan_index is not None:
+        write_project_index(index, scan_index)
+
+    return index
 
 
 def order_gathering(packages):
@@ -94,6 +187,13 @@ def gather_functions():
     }
 
 
+def gather_dependencies():
+    # packages that read the gathered tables of other packages
+    return {
+        "coverm_genome": ["mags_gtdbtk"]
+    }
+
+
 def create_gathering_folder(geomosaic_dir,gather_folder):
     user_gather_folder = None
     if gather_folder is None:
@@ -114,7 +214,7 @@ def create_gathering_folder(geomosaic_dir,gather_folder):
 
 
 
-def some_checks(assembly_hmm_outfolder, mags_hmm_outfolder, packages):
+def some_checks(assembly_hmm_outfolder, mags_hmm_outfolder, packages, output_format):
     if assembly_hmm_outfolder is None and "hmms_search" in packages:
         print(f"\n{GEOMOSAIC_ERROR}: To use gathering for the 'hmms_search' package (ASSEMBLY-based), you need to specify also the name of the output folder that you used for this module through the option '--assembly_hmm_outfolder <outputfolder>'.")
         exit(1)
@@ -122,3 +222,7 @@ def some_checks(assembly_hmm_outfolder, mags_hmm_outfolder, packages):
     if mags_hmm_outfolder is None and "mags_hmmsearch" in packages:
         print(f"\n{GEOMOSAIC_ERROR}: To use gathering for the 'mags_hmmsearch' package (BINNING-based), you need to specify also the name of the output folder that you used for this module through the option '--mags_hmm_outfolder <outputfolder>'.")
         exit(1)
+
+    if output_format != "tsv" and importlib.util.find_spec("pyarrow") is None:
+        print(f"\n{GEOMOSAIC_ERROR}: The '{output_format}' format for the gathered tables requires the 'pyarrow' package. Install it in your geomosaic environment (for example with 'pip install pyarrow') or use '--format tsv'.")
+        exit(1)
@@ -5,25 +5,24 @@ rule run_megahit:
         r2=expand("{wdir}/{sample}/{pre_processing}/R2.fastq.gz", pre_processing=config["MODULES"]["pre_processing"], allow_missing=True),
     output:
         folder = directory("{wdir}/{sample}/megahit"),
-        filtered_fasta = ensure("{wdir}/{sample}/megahit/filtered_contigs.fasta", non_empty=True)
     threads: config["threads"]
     conda: config["ENVS"]["megahit"]
     params:
         user_params=( lambda x: " ".join(filter(None , yaml.safe_load(open(x, "r"))["megahit"])) ) (config["USER_PARAMS"]["megahit"]),
-        seqkit_params=( lambda x: " ".join(filter(None , yaml.safe_load(open(x, "r"))["seqkit"])) ) (config["USER_PARAMS"]["megahit"]) 
     shell:
         """
         mkdir -p {output.folder}
         megahit {params.user_params} -t {threads} -1 {input.r1} -2 {input.r2} -o {output.folder}/megahit_computation
-        seqkit seq {params.seqkit_params} {output.folder}/megahit_computation/final.contigs.fa -o {output.filtered_fasta}
         """
 
 rule run_megahit_parser:
     input: 
-        filtered_fasta = rules.run_megahit.output.filtered_fasta
+        folder = rules.run_megahit.output.folder
     output:
         output_fasta="{wdir}/{sample}/megahit/geomosaic_contigs.fasta",
         output_mapping="{wdir}/{sample}/megahit/mapping.tsv"
+    params:
+        seqkit_params=( lambda x: " ".join(filter(None , yaml.safe_load(open(x, "r"))["seqkit"])) ) (config["USER_PARAMS"]["megahit"]) 
     run:
         from geomosaic.parser.rename_contigs import rename_contigs
-        rename_contigs(str(input.filtered_fasta), str(output.output_fasta), str(output.output_mapping))
+        rename_contigs(os.path.join(str(input.folder), "megahit_computation", "final.contigs.fa"), str(output.output_fasta), str(output.output_mapping), params.seqkit_params)
@@ -6,26 +6,25 @@ rule run_metaspades:
     output:
         folder = directory("{wdir}/{sample}/metaspades"),
         contigs_fasta = "{wdir}/{sample}/metaspades/contigs.fasta",
-        filtered_fasta = ensure("{wdir}/{sample}/metaspades/filtered_contigs.fasta", non_empty=True)
     threads: config["threads"]
     conda: config["ENVS"]["metaspades"]
     params:
         user_params=( lambda x: " ".join(filter(None , yaml.safe_load(open(x, "r"))["metaspades"])) ) (config["USER_PARAMS"]["metaspades"]),
-        seqkit_params=( lambda x: " ".join(filter(None , yaml.safe_load(open(x, "r"))["seqkit"])) ) (config["USER_PARAMS"]["metaspades"]) 
     shell:
         """
         mkdir -p {output.folder}
 
         spades.py {params.user_params} --meta --only-assembler -t {threads} {params.user_params} -1 {input.r1} -2 {input.r2} -o {output.folder}
-        seqkit seq {params.seqkit_params} {output.contigs_fasta} -o {output.filtered_fasta}
         """
 
 rule run_metaspades_parser:
     input: 
-        filtered_fasta = rules.run_metaspades.output.filtered_fasta
+        contigs_fasta = rules.run_metaspades.output.contigs_fasta
     output:
         output_fasta="{wdir}/{sample}/metaspades/geomosaic_contigs.fasta",
         output_mapping="{wdir}/{sample}/metaspades/mapping.tsv"
+    params:
+        seqkit_params=( lambda x: " ".join(filter(None , yaml.safe_load(open(x, "r"))["seqkit"])) ) (config["USER_PARAMS"]["metaspades"]) 
     run:
         from geomosaic.parser.rename_contigs import rename_contigs
-        rename_contigs(str(input.filtered_fasta), str(output.output_fasta), str(output.output_mapping))
+        rename_contigs(str(input.contigs_fasta), str(output.output_fasta), str(output.output_mapping), params.seqkit_params)
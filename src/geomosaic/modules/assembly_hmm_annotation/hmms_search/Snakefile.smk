@@ -1,9 +1,14 @@
+from geomosaic.parser.hmm_library import hmm_library_models
+
+hmm_library_models_tsv = hmm_library_models(config["ADDITIONAL_PARAM"]["hmm_folder"], config["EXT_DB"]["hmm_library"])
+
 
 rule hmms_search:
     input:
         orf_predicted = expand("{wdir}/{sample}/{orf_prediction}/orf_predicted.faa", orf_prediction=config["MODULES"]["orf_prediction"], allow_missing=True),
         orf_simple_mapping = expand("{wdir}/{sample}/{orf_prediction}/simple_orf_contig_mapping.tsv", orf_prediction=config["MODULES"]["orf_prediction"], allow_missing=True), 
-        coverage_folder = expand("{wdir}/{sample}/{assembly_coverage}", assembly_coverage=config["MODULES"]["assembly_coverage"], allow_missing=True)
+        coverage_folder = expand("{wdir}/{sample}/{assembly_coverage}", assembly_coverage=config["MODULES"]["assembly_coverage"], allow_missing=True),
+        hmm_library=hmm_library_models_tsv
     output:
         folder=directory("{wdir}/{sample}/{assembly_hmmsearch_output_folder}"),
     params:
@@ -23,28 +28,12 @@ rule hmms_search:
             for line in fd:
                 coverage_methods.append(line.rstrip("\n"))
 
-        list_output_files = []
-        for hmm in os.listdir(params.hmm_folder):
-            if not hmm.endswith(('.hmm', '.HMM')):
-                continue
-            
-            if hmm.endswith('.hmm'):
-                filename=hmm.split(".hmm")[0]
-            else:
-                filename=hmm.split(".HMM")[0]
-
-            out_path=os.path.join(output.folder, "output_hmms", filename)
-            shell("mkdir -p {out_path}")
-
-            hmm_file=os.path.join(params.hmm_folder, hmm)
-            shell("hmmsearch --tblout /dev/null -o {out_path}/hmmsearch_output.txt {params.user_params} --cpu {threads} --notextw {hmm_file} {input.orf_predicted}") 
-            if os.stat(os.path.join(out_path, "hmmsearch_output.txt")).st_size == 0:
-                continue
-
-            list_output_files.append(str(os.path.join(out_path, "hmmsearch_output.txt")))
+        from geomosaic.parser.hmm_library import search_hmm_library
+        hmm_library = os.path.dirname(str(input.hmm_library))
+        list_output_files = search_hmm_library(hmm_library, str(input.orf_predicted), os.path.join(output.folder, "output_hmms"), params.user_params, threads)
 
         from geomosaic.parser.make_hmmsearch_dataframe import make_hmmsearch_dataframe
-        df_hmmresults = make_hmmsearch_dataframe(list_output_files)
+        df_hmmresults = make_hmmsearch_dataframe(list_output_files, threads=threads)
         df_hmmresults.drop_duplicates(inplace=True)
         df_hmmresults.to_csv(os.path.join(output.folder, "hmmsearch_results.tsv"), sep="\t", header=True, index=False)
 
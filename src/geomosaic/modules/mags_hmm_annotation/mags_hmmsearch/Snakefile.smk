@@ -1,9 +1,14 @@
+from geomosaic.parser.hmm_library import hmm_library_models
+
+hmm_library_models_tsv = hmm_library_models(config["ADDITIONAL_PARAM"]["hmm_folder"], config["EXT_DB"]["hmm_library"])
+
 
 rule run_mags_hmmsearch:
     input:
         mags_orf=expand("{wdir}/{sample}/{mags_orf_prediction}/{mag}/orf_predicted.faa", mags_orf_prediction=config["MODULES"]["mags_orf_prediction"], allow_missing=True),
         mags_orfmap=expand("{wdir}/{sample}/{mags_orf_prediction}/{mag}/simple_orf_contig_mapping.tsv", mags_orf_prediction=config["MODULES"]["mags_orf_prediction"], allow_missing=True),
         mags_cov=expand("{wdir}/{sample}/{mags_coverage}/", mags_coverage=config["MODULES"]["mags_coverage"], allow_missing=True),
+        hmm_library=hmm_library_models_tsv,
     output:
         hmms_search="{wdir}/{sample}/{mags_hmmsearch_output_folder}/{mag}/HMMs_coverage_table.tsv",
     params:
@@ -26,28 +31,12 @@ rule run_mags_hmmsearch:
             for line in fd:
                 coverage_methods.append(line.rstrip("\n"))
 
-        list_output_files = []
-        for hmm in os.listdir(params.hmm_folder):
-            if not hmm.endswith(('.hmm', '.HMM')):
-                continue
-            
-            if hmm.endswith('.hmm'):
-                filename=hmm.split(".hmm")[0]
-            else:
-                filename=hmm.split(".HMM")[0]
-            
-            out_path=os.path.join(output_folder, "output_hmms", filename)
-            shell("mkdir -p {out_path}")
-
-            hmm_file=os.path.join(params.hmm_folder, hmm)
-            shell("hmmsearch --tblout /dev/null -o {out_path}/hmmsearch_output.txt {params.user_params} --cpu {threads} --notextw {hmm_file} {input.mags_orf}") 
-            if os.stat(os.path.join(out_path, "hmmsearch_output.txt")).st_size == 0:
-                continue
-
-            list_output_files.append(str(os.path.join(out_path, "hmmsearch_output.txt")))
+        from geomosaic.parser.hmm_library import search_hmm_library
+        hmm_library = os.path.dirname(str(input.hmm_library))
+        list_output_files = search_hmm_library(hmm_library, str(input.mags_orf), os.path.join(output_folder, "output_hmms"), params.user_params, threads)
 
         from geomosaic.parser.make_hmmsearch_dataframe import make_hmmsearch_dataframe
-        df_hmmresults = make_hmmsearch_dataframe(list_output_files, mags=True)
+        df_hmmresults = make_hmmsearch_dataframe(list_output_files, mags=True, threads=threads)
         df_hmmresults.drop_duplicates(inplace=True)
         df_hmmresults.to_csv(os.path.join(output_folder, "hmmsearch_results.tsv"), sep="\t", header=True, index=False)
 
@@ -80,7 +69,79 @@ def get_mags_hmmsearch_inputs(f_string):
     return _f
 
 
+mags_hmmsearch_pool_mags = ( lambda x: yaml.safe_load(open(x, "r")).get("mags_hmmsearch_pool_mags", False) ) (config["USER_PARAMS"]["mags_hmmsearch"])
+
+
+rule run_mags_hmmsearch_pooled:
+    input:
+        mags_orf=get_mags_hmmsearch_inputs("{wdir}/{sample}/" + config["MODULES"]["mags_orf_prediction"] + "/{mag}/orf_predicted.faa"),
+        mags_orfmap=get_mags_hmmsearch_inputs("{wdir}/{sample}/" + config["MODULES"]["mags_orf_prediction"] + "/{mag}/simple_orf_contig_mapping.tsv"),
+        mags_cov=expand("{wdir}/{sample}/{mags_coverage}/", mags_coverage=config["MODULES"]["mags_coverage"], allow_missing=True),
+        hmm_library=hmm_library_models_tsv,
+    output:
+        pooled=touch("{wdir}/{sample}/{mags_hmmsearch_output_folder}/pooled_OK.txt"),
+    params:
+        hmm_folder=config["ADDITIONAL_PARAM"]["hmm_folder"],
+        local_sample="{sample}",
+        user_params= ( lambda x: " ".join(filter(None , yaml.safe_load(open(x, "r"))["mags_hmmsearch"])) ) (config["USER_PARAMS"]["mags_hmmsearch"]) 
+    threads: config["threads"]
+    run:
+        import shutil
+        import pandas as pd
+
+        # all the proteomes of the sample in a single search: ORF ids are unique across MAGs (mag_N_contig_M_orf_K)
+        sample_folder = os.path.dirname(str(output.pooled))
+        pooled_folder = os.path.join(sample_folder, "pooled_search")
+        shell("mkdir -p {pooled_folder}")
+
+        pooled_faa = os.path.join(pooled_folder, "orf_predicted.faa")
+        with open(pooled_faa, "wb") as fo:
+            for faa in input.mags_orf:
+                with open(str(faa), "rb") as fd:
+                    shutil.copyfileobj(fd, fo)
+
+        df_mapping = pd.concat([pd.read_csv(str(x), sep="\t") for x in input.mags_orfmap], ignore_index=True)
+
+        coverage_methods = []
+        with open(os.path.join(str(input.mags_cov), "list.txt")) as fd:
+            for line in fd:
+                coverage_methods.append(line.rstrip("\n"))
+
+        from geomosaic.parser.hmm_library import search_hmm_library
+        hmm_library = os.path.dirname(str(input.hmm_library))
+        list_output_files = search_hmm_library(hmm_library, pooled_faa, os.path.join(pooled_folder, "output_hmms"), params.user_params, threads)
+
+        from geomosaic.parser.make_hmmsearch_dataframe import make_hmmsearch_dataframe
+        df_hmmresults = make_hmmsearch_dataframe(list_output_files, mags=True, threads=threads)
+        df_hmmresults.drop_duplicates(inplace=True)
+
+        m1 = df_hmmresults.merge(df_mapping, on="orf_id", how="left")
+
+        for mtd in coverage_methods:
+            df_coverage = pd.read_csv(os.path.join(str(input.mags_cov), f"{mtd}.tsv"), sep="\t")
+            df_coverage.columns = ['mags', mtd]
+            temp = pd.merge(m1, df_coverage, how="left", on="mags")
+            m1 = temp.copy()
+        
+        m1["sample"] = str(params.local_sample)
+
+        # split the hits back to the folder of each MAG
+        mag_of_orf = df_mapping.set_index("orf_id")["mags"]
+        hits_mags = df_hmmresults["orf_id"].map(mag_of_orf)
+        for faa in input.mags_orf:
+            mag = os.path.basename(os.path.dirname(str(faa)))
+            output_folder = os.path.join(sample_folder, mag)
+
+            shell("mkdir -p {output_folder}")
+            shell("echo '{params.hmm_folder}' > {output_folder}/hmm_folder_path.txt")
+
+            df_hmmresults[hits_mags == mag].to_csv(os.path.join(output_folder, "hmmsearch_results.tsv"), sep="\t", header=True, index=False)
+            m1[m1["mags"] == mag].to_csv(os.path.join(output_folder, "HMMs_coverage_table.tsv"), sep="\t", header=True, index=False)
+
+        shell("rm -r {pooled_folder}")
+
+
 rule gather_mags_hmmsearch_inputs:
-    input: get_mags_hmmsearch_inputs("{wdir}/{sample}/{mags_hmmsearch_output_folder}/{mag}/HMMs_coverage_table.tsv")
+    input: "{wdir}/{sample}/{mags_hmmsearch_output_folder}/pooled_OK.txt" if mags_hmmsearch_pool_mags else get_mags_hmmsearch_inputs("{wdir}/{sample}/{mags_hmmsearch_output_folder}/{mag}/HMMs_coverage_table.tsv")
     output: touch("{wdir}/{sample}/{mags_hmmsearch_output_folder}/gather_OK.txt")
     threads: 1
@@ -1,26 +1,53 @@
 
-rule run_prodigal:
+rule split_prodigal_contigs:
     input:
         gm_contigs=expand("{wdir}/{sample}/{assembly}/geomosaic_contigs.fasta", assembly=config["MODULES"]["assembly"], allow_missing=True),
     output:
-        proteins="{wdir}/{sample}/prodigal/protein_translations.faa",
-        genes="{wdir}/{sample}/prodigal/genes.gff",
-        folder=directory("{wdir}/{sample}/prodigal")
+        shards=temp(expand("{wdir}/{sample}/prodigal/shards/contigs_{shard}.fasta", shard=range(config["threads"]), allow_missing=True)),
+        manifest=temp("{wdir}/{sample}/prodigal/shards/shards.tsv")
+    threads: 1
+    run:
+        from geomosaic.parser.prodigal_shards import split_contigs_in_shards
+        split_contigs_in_shards(str(input.gm_contigs), [str(x) for x in output.shards], str(output.manifest))
+
+rule run_prodigal_shard:
+    input:
+        shard="{wdir}/{sample}/prodigal/shards/contigs_{shard}.fasta"
+    output:
+        proteins=temp("{wdir}/{sample}/prodigal/shards/protein_translations_{shard}.faa"),
+        genes=temp("{wdir}/{sample}/prodigal/shards/genes_{shard}.gff")
     params:
         meta="-p meta",
         user_params=( lambda x: " ".join(filter(None , yaml.safe_load(open(x, "r"))["prodigal"])) ) (config["USER_PARAMS"]["prodigal"])
     conda: config["ENVS"]["prodigal"]
+    threads: 1
     shell:
         """
-        mkdir -p {output.folder}
-        prodigal -i {input.gm_contigs} \
-                -o {output.genes} \
-                -a {output.proteins} \
-                -f gff \
-                {params.meta} \
-                {params.user_params}
+        if [ -s {input.shard} ]; then
+            prodigal -i {input.shard} \
+                    -o {output.genes} \
+                    -a {output.proteins} \
+                    -f gff \
+                    {params.meta} \
+                    {params.user_params}
+        else
+            touch {output.genes} {output.proteins}
+        fi
         """
 
+rule run_prodigal:
+    input:
+        proteins=expand("{wdir}/{sample}/prodigal/shards/protein_translations_{shard}.faa", shard=range(config["threads"]), allow_missing=True),
+        genes=expand("{wdir}/{sample}/prodigal/shards/genes_{shard}.gff", shard=range(config["threads"]), allow_missing=True),
+        manifest=rules.split_prodigal_contigs.output.manifest
+    output:
+        proteins="{wdir}/{sample}/prodigal/protein_translations.faa",
+        genes="{wdir}/{sample}/prodigal/genes.gff",
+    threads: 1
+    run:
+        from geomosaic.parser.prodigal_shards import merge_prodigal_shards
+        merge_prodigal_shards([str(x) for x in input.proteins], [str(x) for x in input.genes], str(input.manifest), str(output.proteins), str(output.genes))
+
 rule parse_prodigal:
     input:
         protein_fasta=rules.run_prodigal.output.proteins
@@ -5,7 +5,6 @@ rule run_kaiju:
         r2=expand("{wdir}/{sample}/{pre_processing}/R2.fastq.gz", pre_processing=config["MODULES"]["pre_processing"], allow_missing=True),
         kaijudb=expand("{kaiju_extdb_folder}", kaiju_extdb_folder=config["EXT_DB"]["kaiju"])
     output:
-        folder=directory("{wdir}/{sample}/kaiju"),
         fout="{wdir}/{sample}/kaiju/kaiju.out"
     params:
         user_params=( lambda x: " ".join(filter(None , yaml.safe_load(open(x, "r"))["kaiju"])) ) (config["USER_PARAMS"]["kaiju"])
@@ -18,14 +17,16 @@ rule run_kaiju:
             -i {input.r1} \
             -j {input.r2} \
             -o {output.fout}
-        
-        for level in phylum class order family genus species; do
-            kaiju2table \
-            -u \
-            -t {input.kaijudb}/nodes.dmp \
-            -n {input.kaijudb}/names.dmp \
-            -r $level \
-            -o {output.folder}/$level.tsv \
-            {output.fout} ;
-        done
         """
+
+rule run_kaiju_tables:
+    input:
+        fout=rules.run_kaiju.output.fout,
+        kaijudb=expand("{kaiju_extdb_folder}", kaiju_extdb_folder=config["EXT_DB"]["kaiju"])
+    output:
+        expand("{wdir}/{sample}/kaiju/{level}.tsv", level=["phylum", "class", "order", "family", "genus", "species"], allow_missing=True)
+    run:
+        import os
+        from geomosaic.parser.kaiju_rank_tables import kaiju_rank_tables
+        kaijudb = str(input.kaijudb)
+        kaiju_rank_tables(str(input.fout), os.path.join(kaijudb, "nodes.dmp"), os.path.join(kaijudb, "names.dmp"), os.path.dirname(str(output[0])))
@@ -2,4 +2,4 @@
 rule all_kaiju:
     input: 
         expand("{wdir}/{sample}/kaiju/kaiju.out", sample=config["SAMPLES"], wdir=config["WDIR"]),
-        expand("{wdir}/{sample}/kaiju", sample=config["SAMPLES"], wdir=config["WDIR"]),
+        expand("{wdir}/{sample}/kaiju/{level}.tsv", sample=config["SAMPLES"], wdir=config["WDIR"], level=["phylum", "class", "order", "family", "genus", "species"]),
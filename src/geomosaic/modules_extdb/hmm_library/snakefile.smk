@@ -0,0 +1,19 @@
+
+import os
+from geomosaic.parser.hmm_library import hmm_files, hmm_library_models
+
+hmm_library_models_tsv = hmm_library_models(config["ADDITIONAL_PARAM"]["hmm_folder"], config["EXT_DB"]["hmm_library"])
+
+rule hmm_library_db:
+    input:
+        hmm_files=[os.path.join(config["ADDITIONAL_PARAM"]["hmm_folder"], f) for f in hmm_files(config["ADDITIONAL_PARAM"]["hmm_folder"])]
+    params:
+        hmm_folder=config["ADDITIONAL_PARAM"]["hmm_folder"],
+        hmm_library_folder=config["EXT_DB"]["hmm_library"]
+    output:
+        hmm_library_models_tsv
+    message: "GEOMOSAIC MSG: Starting to prepare the HMM library"
+    threads: config["threads"]
+    run:
+        from geomosaic.parser.hmm_library import prepare_hmm_library
+        prepare_hmm_library(params.hmm_folder, params.hmm_library_folder, shards=threads)
@@ -0,0 +1,161 @@
+import os
+import shutil
+import hashlib
+from functools import lru_cache
+from subprocess import check_call
+from concurrent.futures import ThreadPoolExecutor
+from geomosaic._utils import GEOMOSAIC_ERROR, GEOMOSAIC_PROCESS, GEOMOSAIC_WARNING
+
+
+def hmm_files(hmm_folder):
+    return sorted(f for f in os.listdir(hmm_folder) if f.endswith((".hmm", ".HMM")))
+
+
+def hmm_folder_hash(hmm_folder, files):
+    # content hash of the HMM files (names included), the key of the library
+    digest = hashlib.sha256()
+    for f in files:
+        digest.update(f.encode() + b"\0")
+        with open(os.path.join(hmm_folder, f), "rb") as fd:
+            for block in iter(lambda: fd.read(1 << 20), b""):
+                digest.update(block)
+        digest.update(b"\0")
+
+    return digest.hexdigest()[:20]
+
+
+def read_hmm_models(hmm_file):
+    # [name, length, text] of each model of a HMM file, checking that it is a complete HMMER file
+    models = []
+    lines = []
+    name = length = None
+
+    with open(hmm_file) as fd:
+        for line in fd:
+            if len(models) == 0 and len(lines) == 0 and line.strip() != "" and not line.startswith("HMMER"):
+                print(f"{GEOMOSAIC_ERROR}: The file '{hmm_file}' is not in HMMER format.")
+                exit(1)
+
+            if len(lines) == 0 and line.strip() == "":
+                continue
+
+            lines.append(line)
+            if line.startswith("NAME "):
+                name = line.split()[1]
+            elif line.startswith("LENG "):
+                length = int(line.split()[1])
+            elif line.startswith("//"):
+                if name is None:
+                    print(f"{GEOMOSAIC_ERROR}: A model without NAME in the file '{hmm_file}'.")
+                    exit(1)
+
+                models.append([name, length if length is not None else 1, "".join(lines)])
+                lines = []
+                name = length = None
+
+    if len(lines) > 0 or len(models) == 0:
+        print(f"{GEOMOSAIC_ERROR}: The file '{hmm_file}' is empty or truncated (missing '//').")
+        exit(1)
+
+    return models
+
+
+def hmm_library_path(hmm_folder, library_base_folder):
+    files = hmm_files(hmm_folder)
+    if len(files) == 0:
+        print(f"{GEOMOSAIC_ERROR}: No '.hmm' or '.HMM' files in '{hmm_folder}'.")
+        exit(1)
+
+    return os.path.join(library_base_folder, hmm_folder_hash(hmm_folder, files))
+
+
+@lru_cache(maxsize=None)
+def hmm_library_models(hmm_folder, library_base_folder):
+    # models.tsv of the library of hmm_folder, the file that marks a complete library (computed once per workflow)
+    return os.path.join(hmm_library_path(hmm_folder, library_base_folder), "models.tsv")
+
+
+def prepare_hmm_library(hmm_folder, library_base_folder, shards=1):
+    """
+    Concatenate the HMM files of hmm_folder in `shards` files balanced by model
+    length and hmmpress them, in {library_base_folder}/{content hash}. The number
+    of shards is fixed when the library is built: an existing library with the
+    same content is reused as it is, also across projects.
+    """
+    library_folder = hmm_library_path(hmm_folder, library_base_folder)
+    if os.path.isfile(os.path.join(library_folder, "models.tsv")):
+        return library_folder
+
+    models = []
+    for f in hmm_files(hmm_folder):
+        models += [[f] + m for m in read_hmm_models(os.path.join(hmm_folder, f))]
+
+    k = max(1, min(int(shards), len(models)))
+    print(f"{GEOMOSAIC_PROCESS}: Preparing the HMM library of '{hmm_folder}' ({len(models)} models, {k} shards) in {library_folder}")
+
+    # consecutive models in each shard, with about the same total length
+    total = sum(m[2] for m in models)
+    shard_of = []
+    cumulative = 0
+    for m in models:
+        shard_of.append(min(k - 1, int(cumulative * k / total)))
+        cumulative += m[2]
+
+    names = [m[1] for m in models]
+    pressed = len(set(names)) == len(names)
+    if not pressed:
+        print(f"{GEOMOSAIC_WARNING}: Duplicated model names in '{hmm_folder}': the HMM library is not pressed.")
+
+    tmp_folder = f"{library_folder}.tmp.{os.getpid()}"
+    shutil.rmtree(tmp_folder, ignore_errors=True)
+    check_call(f"mkdir -p {tmp_folder}", shell=True)
+
+    for s in range(k):
+        shard_file = os.path.join(tmp_folder, f"shard_{s}.hmm")
+        with open(shard_file, "wt") as fo:
+            for m, ms in zip(models, shard_of):
+                if ms == s:
+                    fo.write(m[3])
+
+        if pressed:
+            check_call(f"hmmpress {shard_file} > /dev/null", shell=True)
+
+    with open(os.path.join(tmp_folder, "models.tsv"), "wt") as fo:
+        fo.write("model\tfile\tlength\tshard\n")
+        for m, ms in zip(models, shard_of):
+            fo.write(f"{m[1]}\t{m[0]}\t{m[2]}\tshard_{ms}\n")
+
+    # an incomplete library (or the empty folder of the snakemake output) is replaced
+    if os.path.isdir(library_folder) and not os.path.isfile(os.path.join(library_folder, "models.tsv")):
+        shutil.rmtree(library_folder, ignore_errors=True)
+
+    # another job may have prepared the same library in the meantime
+    try:
+        os.rename(tmp_folder, library_folder)
+    except OSError:
+        shutil.rmtree(tmp_folder, ignore_errors=True)
+        if not os.path.isfile(os.path.join(library_folder, "models.tsv")):
+            raise
+
+    return library_folder
+
+
+def search_hmm_library(library_folder, protein_fasta, output_folder, user_params, threads):
+    """
+    hmmsearch of all the shards of the library against protein_fasta, at most
+    `threads` at a time. Returns the non-empty outputs, in the model order.
+    """
+    shards = sorted((f for f in os.listdir(library_folder) if f.endswith(".hmm")), key=lambda x: int(x[len("shard_"):-len(".hmm")]))
+
+    check_call(f"mkdir -p {output_folder}", shell=True)
+    cpu = max(1, threads // len(shards))
+
+    def hmmsearch(shard):
+        out_file = os.path.join(output_folder, f"hmmsearch_output_{shard[:-len('.hmm')]}.txt")
+        check_call(f"hmmsearch --tblout /dev/null -o {out_file} {user_params} --cpu {cpu} --notextw {os.path.join(library_folder, shard)} {protein_fasta}", shell=True)
+        return out_file
+
+    with ThreadPoolExecutor(max_workers=max(1, min(threads, len(shards)))) as executor:
+        outputs = list(executor.map(hmmsearch, shards))
+
+    return [o for o in outputs if os.stat(o).st_size > 0]
@@ -0,0 +1,145 @@
+import os
+import csv
+import numpy as np
+import pandas as pd
+from geomosaic._utils import GEOMOSAIC_PROCESS, GEOMOSAIC_WARNING
+
+
+KAIJU_RANKS = ["phylum", "class", "order", "family", "genus", "species"]
+
+# NCBI taxon id of viruses, reported as a single taxon unless expanded
+VIRUSES_TAXON_ID = 10239
+
+
+def kaiju_rank_tables(kaiju_out, nodes_dmp, names_dmp, output_folder, ranks=KAIJU_RANKS, count_unclassified=False, chunksize=1000000):
+    # Same tables of 'kaiju2table -t nodes.dmp -n names.dmp -r {rank}' (with '-u' unless count_unclassified)
+    # for all the ranks, from a single pass over kaiju_out: reads are counted by taxon id and then
+    # each counted taxon is assigned to its ancestor at every rank.
+    parent, rank_code, rank_names = load_nodes(nodes_dmp)
+
+    print(f"{GEOMOSAIC_PROCESS}: Counting the reads of {kaiju_out} by taxon...")
+    taxa, reads, total_reads, unclassified = count_kaiju_reads(kaiju_out, chunksize)
+
+    known = (taxa < len(parent)) & (taxa >= 0)
+    known[known] = parent[taxa[known]] >= 0
+    if not known.all():
+        print(f"{GEOMOSAIC_WARNING}: {(~known).sum()} taxon ids of {kaiju_out} are not in {nodes_dmp}: their reads are not assigned.")
+    taxa, reads = taxa[known], reads[known]
+
+    wanted = [rank_names.index(r) if r in rank_names else -1 for r in ranks]
+    ancestors, viral = rank_ancestors(taxa, parent, rank_code, wanted)
+
+    denominator = total_reads if count_unclassified else total_reads - unclassified
+
+    tables = {}
+    for r, anc in zip(ranks, ancestors):
+        assigned = pd.Series(reads[~viral & (anc >= 0)]).groupby(anc[~viral & (anc >= 0)]).sum()
+        tables[r] = (assigned, int(reads[~viral & (anc < 0)].sum()), int(reads[viral].sum()))
+
+    needed = set(i for assigned, _, _ in tables.values() for i in assigned.index)
+    names = load_scientific_names(names_dmp, needed | {VIRUSES_TAXON_ID})
+
+    file_label = os.path.basename(kaiju_out)
+    for r, (assigned, not_assigned, viruses) in tables.items():
+        rows = [(int(taxon), int(n), names.get(int(taxon), "")) for taxon, n in assigned.items()]
+        if viruses > 0:
+            rows.append((VIRUSES_TAXON_ID, viruses, names.get(VIRUSES_TAXON_ID, "Viruses")))
+        rows.sort(key=lambda x: (-x[1], x[0]))
+
+        with open(os.path.join(output_folder, f"{r}.tsv"), "wt") as fo:
+            fo.write("file\tpercent\treads\ttaxon_id\ttaxon_name\n")
+            for taxon, n, name in rows:
+                fo.write(f"{file_label}\t{percentage(n, denominator):.6f}\t{n}\t{taxon}\t{name}\n")
+
+            if not_assigned > 0:
+                fo.write(f"{file_label}\t{percentage(not_assigned, denominator):.6f}\t{not_assigned}\tNA\tcannot be assigned to a (non-viral) {r}\n")
+
+            if count_unclassified:
+                fo.write(f"{file_label}\t{percentage(unclassified, denominator):.6f}\t{unclassified}\tNA\tunclassified\n")
+
+
+def percentage(n, denominator):
+    return n / denominator * 100.0 if denominator > 0 else 0.0
+
+
+def count_kaiju_reads(kaiju_out, chunksize):
+    # kaiju output: C/U, read name, taxon id, then optional columns
+    counts = None
+    total_reads = 0
+    unclassified = 0
+
+    chunks = pd.read_csv(kaiju_out, sep="\t", header=None, names=["status", "read", "taxon_id"], usecols=["status", "taxon_id"],
+                         index_col=False, quoting=csv.QUOTE_NONE, dtype={"status": str, "taxon_id": np.int64}, chunksize=chunksize)
+
+    for chunk in chunks:
+        classified = chunk["status"] == "C"
+
+        total_reads += len(chunk)
+        unclassified += int((~classified).sum())
+
+        c = chunk.loc[classified, "taxon_id"].value_counts()
+        counts = c if counts is None else counts.add(c, fill_value=0)
+
+    if counts is None or len(counts) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), total_reads, unclassified
+
+    counts = counts.sort_index()
+    return counts.index.to_numpy(dtype=np.int64), counts.to_numpy(dtype=np.int64), total_reads, unclassified
+
+
+def load_nodes(nodes_dmp):
+    # parent and rank code of each node, indexed by taxon id (-1 for ids not in the taxonomy)
+    nodes = pd.read_csv(nodes_dmp, sep="\t", header=None, names=["taxon_id", "s1", "parent", "s2", "rank"], usecols=["taxon_id", "parent", "rank"],
+                        index_col=False, quoting=csv.QUOTE_NONE, dtype={"taxon_id": np.int64, "parent": np.int64, "rank": "category"})
+
+    size = int(nodes["taxon_id"].max()) + 1 if len(nodes) > 0 else 0
+    dtype = np.int32 if size < 2**31 else np.int64
+
+    parent = np.full(size, -1, dtype=dtype)
+    parent[nodes["taxon_id"].to_numpy()] = nodes["parent"].to_numpy()
+
+    rank_code = np.full(size, -1, dtype=np.int16)
+    rank_code[nodes["taxon_id"].to_numpy()] = nodes["rank"].cat.codes.to_numpy()
+
+    return parent, rank_code, list(nodes["rank"].cat.categories)
+
+
+def rank_ancestors(taxa, parent, rank_code, wanted):
+    # climb the taxonomy from all the taxa at once: for each wanted rank, the ancestor of
+    # each taxon at that rank (-1 if none), and whether each taxon descends from the viruses
+    ancestors = [np.full(len(taxa), -1, dtype=np.int64) for _ in wanted]
+    viral = np.zeros(len(taxa), dtype=bool)
+
+    current = taxa.astype(np.int64)
+    active = np.ones(len(taxa), dtype=bool)
+
+    while active.any():
+        cur = current[active]
+
+        for anc, code in zip(ancestors, wanted):
+            found = rank_code[cur] == code
+            idx = np.flatnonzero(active)[found]
+            anc[idx] = np.where(anc[idx] < 0, cur[found], anc[idx])
+
+        viral[active] |= cur == VIRUSES_TAXON_ID
+
+        up = parent[cur].astype(np.int64)
+        # the root is its own parent, broken lineages stop at unknown ids
+        stop = (up == cur) | (up < 0)
+        current[active] = up
+        active[np.flatnonzero(active)[stop]] = False
+
+    return ancestors, viral
+
+
+def load_scientific_names(names_dmp, taxa, chunksize=1000000):
+    names = {}
+
+    chunks = pd.read_csv(names_dmp, sep="\t", header=None, names=["taxon_id", "s1", "name", "s2", "unique", "s3", "class"], usecols=["taxon_id", "name", "class"],
+                         index_col=False, quoting=csv.QUOTE_NONE, dtype={"taxon_id": np.int64, "name": str, "class": str}, keep_default_na=False, chunksize=chunksize)
+
+    for chunk in chunks:
+        chunk = chunk[(chunk["class"] == "scientific name") & chunk["taxon_id"].isin(taxa)]
+        names.update(zip(chunk["taxon_id"].tolist(), chunk["name"].tolist()))
+
+    return names
@@ -1,49 +1,125 @@
-
 from geomosaic._utils import GEOMOSAIC_PROCESS
-from Bio import SearchIO
+from concurrent.futures import ProcessPoolExecutor
+import re
 import pandas as pd
 from tqdm import tqdm
 
 
-def make_hmmsearch_dataframe(list_hmmsearch_outputs, mags=False):
+HMMSEARCH_COLUMNS = ["HMM_model", "orf_id", "HMM_length", "hmm_start", "hmm_end",
+                     "identical_match", "conserved_match", "perc_identical", "perc_conserved",
+                     "bitscore", "indipendent_evalue", "conditional_evalue", "dels", "sequence_match" ]
+
+# same patterns of the hmmer3-text parser of Bio.SearchIO
+_QUERY_LINE = re.compile(rb"^Query:\s*(.*)\s+\[\w=(\d+)\]")
+_ALN_ID_LINE = re.compile(rb"^(\s+\S+\s+[0-9-]+ )(.+?)(\s+[0-9-]+)")
+
+
+def make_hmmsearch_dataframe(list_hmmsearch_outputs, mags=False, threads=1, sequence_match=True):
     l = []
     print(f"{GEOMOSAIC_PROCESS}: Processing all the output results from hmmsearch...")
-    for pathfilename in tqdm(list_hmmsearch_outputs):
-        with open (pathfilename,"r") as handle: 
-            for record in SearchIO.parse(handle, 'hmmer3-text'):
-                l += parse_hmmsearch_output(record)
-    
-    df = pd.DataFrame(l, columns=["HMM_model", "orf_id", "HMM_length", "hmm_start", "hmm_end", 
-                              "identical_match", "conserved_match", "perc_identical", "perc_conserved",
-                              "bitscore", "indipendent_evalue", "conditional_evalue", "dels", "sequence_match" ])
+
+    if threads > 1 and len(list_hmmsearch_outputs) > 1:
+        with ProcessPoolExecutor(max_workers=min(threads, len(list_hmmsearch_outputs))) as executor:
+            parsed = executor.map(parse_hmmsearch_file, list_hmmsearch_outputs, [sequence_match] * len(list_hmmsearch_outputs))
+            for rows in tqdm(parsed, total=len(list_hmmsearch_outputs)):
+                l += rows
+    else:
+        for pathfilename in tqdm(list_hmmsearch_outputs):
+            l += parse_hmmsearch_file(pathfilename, sequence_match)
+
+    columns = HMMSEARCH_COLUMNS if sequence_match else HMMSEARCH_COLUMNS[:-1]
+    df = pd.DataFrame(l, columns=columns)
 
     df.sort_values(by="perc_identical", ascending=False, inplace=True)
     return df
 
 
-def parse_hmmsearch_output(record):
+def parse_hmmsearch_file(pathfilename, sequence_match=True):
+    # Streaming parser of the hmmsearch text output (-o), giving the same rows of Bio.SearchIO 'hmmer3-text':
+    # a row for each domain of the domain tables, completed by its alignment ("== domain N" blocks).
     rows = []
-    
-    for i in record.hsps:
-        model_id = i.query_id
-        orf_id = i.hit_id
-        model_len = record.seq_len
-        model_start = i.query_range[0]
-        model_end = i.query_range[1]
-        sequence_match = i.aln_annotation["similarity"]
-        identical_match = sum([1 if c not in ("+", " ") else 0 for c in sequence_match])
-        conserved_match = sum([1 if c != " " else 0 for c in sequence_match])
-        dels = sum([1 for c in str(i.hit.seq) if c == "-"])
-        perc_identical = (identical_match/model_len)*100
-        perc_conserved = (conserved_match/model_len)*100
-        bitscore = i.bitscore
-        indipendent_evalue = i.evalue
-        conditional_evalue = i.evalue_cond
-        
-        match_res = [model_id, orf_id, model_len, model_start, model_end, 
-                     identical_match, conserved_match, perc_identical, perc_conserved, 
-                     bitscore, indipendent_evalue, conditional_evalue, dels, sequence_match ]
-        
-        rows.append(match_res)
-    
-    return rows
+
+    model_id = model_len = None
+    domains = []
+    current = None
+    state = None
+
+    with open(pathfilename, "rb") as handle:
+        for line in handle:
+            if line.startswith(b"Query:"):
+                rows += domains
+                domains = []
+
+                regx = _QUERY_LINE.search(line)
+                model_id = regx.group(1).strip().decode()
+                model_len = int(regx.group(2))
+                state = None
+
+            elif line.startswith(b">> "):
+                rows += domains
+                domains = []
+
+                orf_id = line[3:].split(b"  ", 1)[0].strip().decode()
+                state = "domains"
+
+            elif state == "domains":
+                parsed = line.split()
+                if len(parsed) == 16 and parsed[1] in (b"!", b"?"):
+                    # domain, is_included, score, bias, c-Evalue, i-Evalue, hmmfrom, hmm to, .., alifrom, ali to, .., envfrom, env to, .., acc
+                    domains.append([model_id, orf_id, model_len, int(parsed[6]) - 1, int(parsed[7]),
+                                    float(parsed[2]), float(parsed[5]), float(parsed[4])])
+                elif line.startswith(b"  Alignments for each domain:"):
+                    state = "alignments"
+
+            elif state == "alignments" or state == "alignment":
+                if line.startswith(b"  == domain"):
+                    current = int(line.split()[2]) - 1
+                    hmm_len = ali_len = dels = 0
+                    prefix_len = None
+                    similarity = []
+                    state = "alignment"
+                    domains[current].append(similarity)
+                    domains[current].append(0)
+
+                elif line.startswith(b"Internal pipeline"):
+                    state = None
+
+                elif state == "alignment":
+                    regx = _ALN_ID_LINE.search(line)
+                    if regx:
+                        if prefix_len is None:
+                            prefix_len = len(regx.group(1))
+                        # model line first, then the ORF line
+                        if hmm_len == ali_len:
+                            hmm_len += len(regx.group(2))
+                        else:
+                            ali_len += len(regx.group(2))
+                            domains[current][-1] += regx.group(2).count(b"-")
+                    elif hmm_len > ali_len and prefix_len is not None:
+                        similarity.append(line[prefix_len:].rstrip(b"\r\n"))
+
+    rows += domains
+
+    return [complete_hmmsearch_row(d, sequence_match) for d in rows]
+
+
+def complete_hmmsearch_row(domain, sequence_match):
+    model_id, orf_id, model_len, model_start, model_end, bitscore, indipendent_evalue, conditional_evalue = domain[:8]
+
+    similarity = b"".join(domain[8]) if len(domain) > 8 else b""
+    dels = domain[9] if len(domain) > 8 else 0
+
+    spaces = similarity.count(b" ")
+    conserved_match = len(similarity) - spaces
+    identical_match = conserved_match - similarity.count(b"+")
+    perc_identical = (identical_match/model_len)*100
+    perc_conserved = (conserved_match/model_len)*100
+
+    match_res = [model_id, orf_id, model_len, model_start, model_end,
+                 identical_match, conserved_match, perc_identical, perc_conserved,
+                 bitscore, indipendent_evalue, conditional_evalue, dels]
+
+    if sequence_match:
+        match_res.append(similarity.decode())
+
+    return match_res
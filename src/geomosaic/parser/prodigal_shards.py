@@ -0,0 +1,75 @@
+import re
+from Bio.SeqIO.FastaIO import SimpleFastaParser
+
+
+# prodigal numbers the sequences of its input: ID=<sequence>_<gene> in the proteins and the GFF, seqnum=<sequence> in the GFF
+_PRODIGAL_ID = re.compile(r"(?<=ID=)\d+(?=_)")
+_PRODIGAL_SEQNUM = re.compile(r"(?<=seqnum=)\d+")
+
+
+def split_contigs_in_shards(contigs_fasta, shard_files, output_manifest):
+    # consecutive contigs in each shard, with about the same total length (prodigal -p meta predicts each contig on its own)
+    lengths = []
+    with open(contigs_fasta) as fd:
+        for _, seq in SimpleFastaParser(fd):
+            lengths.append(len(seq))
+
+    k = len(shard_files)
+    total = max(1, sum(lengths))
+
+    shard_of = []
+    cumulative = 0
+    for l in lengths:
+        shard_of.append(min(k - 1, cumulative * k // total))
+        cumulative += l
+
+    fds = [open(f, "wt") for f in shard_files]
+    try:
+        with open(contigs_fasta) as fd:
+            for (header, seq), s in zip(SimpleFastaParser(fd), shard_of):
+                fds[s].write(f">{header}\n{seq}\n")
+    finally:
+        for fo in fds:
+            fo.close()
+
+    with open(output_manifest, "wt") as fo:
+        fo.write("shard\tfirst_sequence\tsequences\n")
+        first = 1
+        for s in range(k):
+            n = shard_of.count(s)
+            fo.write(f"{s}\t{first}\t{n}\n")
+            first += n
+
+
+def merge_prodigal_shards(shard_proteins, shard_genes, manifest, output_proteins, output_genes):
+    # concatenate the outputs of the shards, numbering their sequences as in a single prodigal run
+    offsets = []
+    with open(manifest) as fd:
+        next(fd)
+        for line in fd:
+            offsets.append(int(line.split("\t")[1]) - 1)
+
+    renumber = lambda offset: (lambda m: str(int(m.group(0)) + offset))
+
+    with open(output_proteins, "wt") as fo:
+        for faa, offset in zip(shard_proteins, offsets):
+            with open(faa) as fd:
+                for line in fd:
+                    if line.startswith(">"):
+                        line = _PRODIGAL_ID.sub(renumber(offset), line, count=1)
+                    fo.write(line)
+
+    gff_version = False
+    with open(output_genes, "wt") as fo:
+        for gff, offset in zip(shard_genes, offsets):
+            with open(gff) as fd:
+                for line in fd:
+                    if line.startswith("##gff-version"):
+                        if gff_version:
+                            continue
+                        gff_version = True
+                    elif line.startswith("# Sequence Data:"):
+                        line = _PRODIGAL_SEQNUM.sub(renumber(offset), line, count=1)
+                    elif not line.startswith("#"):
+                        line = _PRODIGAL_ID.sub(renumber(offset), line, count=1)
+                    fo.write(line)
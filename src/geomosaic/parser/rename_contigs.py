@@ -1,22 +1,69 @@
-
 from Bio.SeqIO.FastaIO import SimpleFastaParser
 from geomosaic._utils import GEOMOSAIC_ERROR
 
 
-def rename_contigs(contigs_fasta, output_fasta, output_mapping):
-    contigs_list = []
-    with open(contigs_fasta) as fd:
-        for header, seq in SimpleFastaParser(fd):
-            contigs_list.append((header, seq))
+# gap letters removed by 'seqkit seq --remove-gaps' (spaces and tabs are already dropped by the parser)
+GAPS = str.maketrans("", "", "-.")
 
-    if len(contigs_list) == 0:
-        print(f"\n{GEOMOSAIC_ERROR}: Your Assembler didn't provide any contigs longer than the minimum length specified. Try to lower these values. SystemExit.\n")
-        exit(1)
 
-    with open(output_fasta, "wt") as fo, open(output_mapping, "wt") as fm:
+def rename_contigs(contigs_fasta, output_fasta, output_mapping, seqkit_params=""):
+    # Single pass over the assembler contigs: the filters of 'seqkit seq {seqkit_params}' are applied to each
+    # contig as it is read, and the kept ones are written as contig_N with their old header in the mapping
+    filters = parse_seqkit_filters(seqkit_params)
+
+    n_contigs = 0
+    with open(contigs_fasta) as fd, open(output_fasta, "wt") as fo, open(output_mapping, "wt") as fm:
         fm.write("old_header\tnew_header\n")
-        for idx, i in enumerate(contigs_list, start = 1):
-            old_header, seq = i
-            new_header = f"contig_{idx}"
+        for old_header, seq in SimpleFastaParser(fd):
+            if filters["remove_gaps"]:
+                seq = seq.translate(GAPS)
+
+            if len(seq) < filters["min_len"] or (filters["max_len"] >= 0 and len(seq) > filters["max_len"]):
+                continue
+
+            if filters["case"] is not None:
+                seq = seq.upper() if filters["case"] == "upper" else seq.lower()
+
+            n_contigs += 1
+            new_header = f"contig_{n_contigs}"
             fo.write(f">{new_header}\n{seq}\n")
             fm.write(f"{old_header}\t{new_header}\n")
+
+    if n_contigs == 0:
+        print(f"\n{GEOMOSAIC_ERROR}: Your Assembler didn't provide any contigs longer than the minimum length specified. Try to lower these values. SystemExit.\n")
+        exit(1)
+
+
+def parse_seqkit_filters(seqkit_params):
+    # the options of 'seqkit seq' that select or change the contigs; -j/-w do not change the renamed contigs
+    filters = {"min_len": -1, "max_len": -1, "remove_gaps": False, "case": None}
+    values = {"-m": "min_len", "--min-len": "min_len", "-M": "max_len", "--max-len": "max_len"}
+
+    tokens = seqkit_params.split()
+    i = 0
+    while i < len(tokens):
+        option, _, value = tokens[i].partition("=")
+
+        if option in values or option in ["-j", "--threads", "-w", "--line-width"]:
+            if value == "":
+                i += 1
+                value = tokens[i] if i < len(tokens) else ""
+            if option in values:
+                try:
+                    filters[values[option]] = int(value)
+                except ValueError:
+                    print(f"{GEOMOSAIC_ERROR}: Invalid value '{value}' for the seqkit option '{option}'.")
+                    exit(1)
+        elif option in ["-g", "--remove-gaps"]:
+            filters["remove_gaps"] = True
+        elif option in ["-u", "--upper-case"]:
+            filters["case"] = "upper"
+        elif option in ["-l", "--lower-case"]:
+            filters["case"] = "lower"
+        else:
+            print(f"{GEOMOSAIC_ERROR}: The seqkit option '{tokens[i]}' is not supported for filtering the contigs. Supported: --min-len, --max-len, --remove-gaps, --upper-case, --lower-case.")
+            exit(1)
+
+        i += 1
+
+    return filters
@@ -0,0 +1,24 @@
+import sqlite3
+import pandas as pd
+
+from geomosaic.gathering.database import export_database
+
+
+def test_same_id_under_two_classes(tmp_path):
+    folder = tmp_path / "recognizer"
+    folder.mkdir()
+    pd.DataFrame({
+        "class": ["A", "B"], "subclass": ["a", "b"], "descr": ["x", "y"],
+        "COG_id": ["COG0001", "COG0001"], "s1": [2, 5], "s2": [0, 1],
+    }).to_csv(folder / "COG_quantification.tsv", sep="\t", index=False)
+
+    db_file = str(tmp_path / "project.sqlite")
+    export_database(db_file, str(tmp_path), ["recognizer"], ["s1", "s2"])
+
+    con = sqlite3.connect(db_file)
+    rows = con.execute("SELECT sample, feature, info, value FROM abundance ORDER BY sample, info").fetchall()
+    features = con.execute("SELECT feature, info FROM features ORDER BY info").fetchall()
+    con.close()
+
+    assert rows == [("s1", "COG0001", "A | a | x", 2.0), ("s1", "COG0001", "B | b | y", 5.0), ("s2", "COG0001", "B | b | y", 1.0)]
+    assert features == [("COG0001", "A | a | x"), ("COG0001", "B | b | y")]
@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from geomosaic.gathering.matrix import compose_sample_matrix, compose_sparse_matrix
+
+
+def test_nan_key_single_pivot():
+    frames = [pd.DataFrame({"KO": ["K2", np.nan, "K1"], "s1": [2, 5, 1]}),
+              pd.DataFrame({"KO": ["K1"], "s2": [3]})]
+
+    df = compose_sample_matrix(frames, "KO")
+
+    assert df["KO"].tolist()[:2] == ["K1", "K2"]
+    assert pd.isna(df["KO"].iloc[2])
+    assert df["s1"].tolist() == [1, 2, 5]
+    assert df["s2"].tolist() == [3, 0, 0]
+
+
+def test_nan_key_several_pivots():
+    frames = [pd.DataFrame({"class": ["A", "A", np.nan], "id": ["C2", "C1", "C3"], "s1": [2, 1, 5]}),
+              pd.DataFrame({"class": ["A"], "id": ["C1"], "s2": [3]})]
+
+    df = compose_sample_matrix(frames, ["class", "id"])
+
+    assert df["id"].tolist() == ["C1", "C2", "C3"]
+    assert pd.isna(df["class"].iloc[2])
+    assert df["s1"].tolist() == [1, 2, 5]
+    assert df["s2"].tolist() == [3, 0, 0]
+
+
+def test_nan_key_sparse():
+    frames = [pd.DataFrame({"KO": [np.nan, "K1"], "s1": [5, 1]})]
+
+    res = compose_sparse_matrix(frames, "KO")
+
+    assert len(res["features"]) == 2
+    assert res["data"].tolist() == [1, 5]
+
+
+def test_two_value_columns():
+    frames = [pd.DataFrame({"KO": ["K1"], "s1": [1], "s2": [2]})]
+
+    with pytest.raises(ValueError):
+        compose_sample_matrix(frames, "KO")
@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from geomosaic.gathering.writer import write_table_stream, table_path
+
+
+COLUMNS = ["HMM_model", "orf_id", "perc_conserved", "tpm"]
+
+
+def read_back(path, fmt):
+    if fmt == "parquet":
+        return pd.read_parquet(table_path(path, fmt))
+    return pd.read_feather(table_path(path, fmt))
+
+
+def sample(models, tpm):
+    return pd.DataFrame({"HMM_model": models, "orf_id": [f"orf_{i}" for i in range(len(models))],
+                         "perc_conserved": [60.0] * len(models), "tpm": tpm})
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "feather"])
+def test_empty_first_sample(tmp_path, fmt):
+    frames = [pd.DataFrame(columns=COLUMNS), sample(["K1", "K2"], [1, 2]), sample(["K3"], [3])]
+    path = str(tmp_path / "ALL_SAMPLES_HMM_coverage_table.tsv")
+
+    write_table_stream(iter(frames), path, COLUMNS, {"output_format": fmt})
+    df = read_back(path, fmt)
+
+    assert list(df.columns) == COLUMNS
+    assert df["HMM_model"].tolist() == ["K1", "K2", "K3"]
+    assert df["tpm"].tolist() == [1, 2, 3]
+    assert np.issubdtype(df["tpm"].dtype, np.integer)
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "feather"])
+def test_int_then_float_sample(tmp_path, fmt):
+    frames = [sample(["K1", "K2"], [1, 2]), sample(["K3"], [1.5])]
+    path = str(tmp_path / "ALL_SAMPLES_HMM_coverage_table.tsv")
+
+    write_table_stream(iter(frames), path, COLUMNS, {"output_format": fmt})
+    df = read_back(path, fmt)
+
+    assert df["tpm"].dtype == np.float64
+    assert df["tpm"].tolist() == [1.0, 2.0, 1.5]
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "feather"])
+def test_all_nan_then_strings(tmp_path, fmt):
+    first = sample(["K1"], [1])
+    first["orf_id"] = np.nan
+    frames = [first, sample(["K2"], [2])]
+    path = str(tmp_path / "ALL_SAMPLES_HMM_coverage_table.tsv")
+
+    write_table_stream(iter(frames), path, COLUMNS, {"output_format": fmt})
+    df = read_back(path, fmt)
+
+    assert df["orf_id"].isna().tolist() == [True, False]
+    assert df["orf_id"].iloc[1] == "orf_0"
+
+
+def test_no_rows(tmp_path):
+    path = str(tmp_path / "ALL_SAMPLES_HMM_coverage_table.tsv")
+
+    write_table_stream(iter([pd.DataFrame(columns=COLUMNS)]), path, COLUMNS, {"output_format": "parquet"})
+    df = read_back(path, "parquet")
+
+    assert list(df.columns) == COLUMNS
+    assert len(df) == 0
+    assert not any(f.name.endswith(".tmp") or ".tmp." in f.name for f in tmp_path.iterdir())
+
+
+def test_tsv_int_then_float_sample(tmp_path):
+    frames = [sample(["K1", "K2"], [3, 2]), sample(["K3"], [1.5])]
+    path = str(tmp_path / "ALL_SAMPLES_HMM_coverage_table.tsv")
+
+    write_table_stream(iter(frames), path, COLUMNS, {"output_format": "tsv"})
+
+    with open(path) as fd:
+        streamed = fd.read()
+
+    expected = pd.concat(frames).to_csv(sep="\t", header=True, index=False)
+    assert streamed == expected
+    assert "\t3.0\n" in streamed
+    assert not any(".tmp." in f.name for f in tmp_path.iterdir())
@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from geomosaic.gathering.xlsx import read_first_sheet
+
+openpyxl = pytest.importorskip("openpyxl")
+
+
+def write_sheet(path, rows):
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet()
+    for row in rows:
+        ws.append(row)
+    wb.save(path)
+
+
+def test_metabolism_summary_like_sheet(tmp_path):
+    # 5000 rows x 35 columns: text annotation columns and MAG count columns with empty cells
+    rng = np.random.default_rng(0)
+    header = ["gene_id", "gene_description", "module", "header", "subheader"] + [f"mag_{i}" for i in range(30)]
+
+    rows = [header]
+    for r in range(5000):
+        counts = [int(c) if c > 0 else None for c in rng.integers(-2, 5, size=30)]
+        counts[r % 30] = float(counts[r % 30] or 0) + 0.5 if r % 7 == 0 else counts[r % 30]
+        rows.append([f"K{r:05d}", f"gene {r}; EC:{r % 97}", "NA" if r % 11 == 0 else f"M{r % 50:05d}",
+                     None if r % 13 == 0 else "Carbon utilization", str(r % 3)] + counts)
+
+    path = str(tmp_path / "metabolism_summary.xlsx")
+    write_sheet(path, rows)
+
+    pd.testing.assert_frame_equal(read_first_sheet(path), pd.read_excel(path))
+
+
+def test_header_and_type_edge_cases(tmp_path):
+    rows = [
+        ["a", "a", None, 1, "b", "a.1", "c", "d", "e", "f"],
+        [1, "x", None, 2.5, True, "NA", "1", None, 1, "2"],
+        [2, "y", None, 3, False, "z", "2", None, "n/a", 3.5],
+        [3, "z", None, 4, None, "w", "3", None, 2, "x"],
+        [4, "w", None, 5, True, True, "4", None, 3, True],
+    ]
+    path = str(tmp_path / "edge.xlsx")
+    write_sheet(path, rows)
+
+    pd.testing.assert_frame_equal(read_first_sheet(path), pd.read_excel(path))
+
+
+def test_header_only_sheet(tmp_path):
+    path = str(tmp_path / "header.xlsx")
+    write_sheet(path, [["gene_id", "mag_1"]])
+
+    pd.testing.assert_frame_equal(read_first_sheet(path), pd.read_excel(path))